@@ -0,0 +1,221 @@
+"""
+Сессии WebApp и кэш данных авторизации для /api/auth
+
+WebApp открывает /api/auth при каждом запуске. Раньше каждый вызов создавал
+нового бота и делал два запроса к Telegram (get_chat для username и
+get_chat_member для проверки подписки на канал), а также читал пользователя из БД.
+
+- после успешной авторизации выдаётся короткоживущий токен сессии, подписанный
+  HMAC-SHA256 (telegram_id, роль, срок действия); клиент передаёт его при
+  следующих запусках
+- роль, username и результат проверки подписки хранятся в кэше auth_profile_cache;
+  при действующем токене и записи в кэше /api/auth не обращается ни к Telegram,
+  ни к БД
+- устаревшая (старше AUTH_PROFILE_REFRESH_AFTER) запись отдаётся сразу, а
+  username и подписка обновляются в фоне; отписавшийся от канала пользователь
+  удаляется из кэша и при следующем запуске проходит полную проверку
+- запросы к Telegram идут через один общий экземпляр бота
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import time
+
+from cache import TTLCache
+from config import BOT_TOKEN, SESSION_SECRET, SESSION_TOKEN_TTL
+from shared_state import SharedVersion, shared_path
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_CHANNEL = "@monkeys_giveaways"
+TELEGRAM_TIMEOUT = 5.0  # секунды на запрос к Telegram
+AUTH_PROFILE_REFRESH_AFTER = 300  # секунды, после которых данные обновляются в фоне
+AUTH_PROFILE_MAX_AGE = 24 * 3600  # секунды, после которых запись удаляется из кэша
+
+_secret = (
+    SESSION_SECRET
+    or hmac.new(b"webapp-session", (BOT_TOKEN or "").encode(), hashlib.sha256).hexdigest()
+).encode()
+
+# Версия данных авторизации: меняется при изменении роли пользователя,
+# сбрасывает кэши auth_profile_cache и webapp_auth во всех процессах
+auth_version = SharedVersion(shared_path("auth_profiles.version"))
+
+# Данные авторизации по telegram_id: {"role", "username", "checked_at"}
+auth_profile_cache = TTLCache(ttl=AUTH_PROFILE_MAX_AGE, shared_version=auth_version)
+
+_bot = None
+_refreshing = set()
+_refresh_tasks = set()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(body: str) -> str:
+    return _b64encode(hmac.new(_secret, body.encode(), hashlib.sha256).digest())
+
+
+def issue_session_token(telegram_id: int, role: str, ttl: int = SESSION_TOKEN_TTL) -> str:
+    """Токен сессии: base64(данные).base64(подпись)"""
+    body = _b64encode(json.dumps(
+        {"uid": int(telegram_id), "role": role, "exp": int(time.time()) + ttl},
+        separators=(",", ":")
+    ).encode())
+    return f"{body}.{_sign(body)}"
+
+
+def verify_session_token(token: str):
+    """
+    Проверяет подпись и срок действия токена
+
+    Returns:
+        dict | None: {"uid", "role", "exp"} или None, если токен недействителен
+    """
+    if not token or token.count(".") != 1:
+        return None
+    body, signature = token.split(".")
+    if not hmac.compare_digest(signature, _sign(body)):
+        return None
+    try:
+        data = json.loads(_b64decode(body))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(data, dict) or data.get("exp", 0) < time.time():
+        return None
+    return data
+
+
+def get_bot():
+    """Общий экземпляр бота для запросов веб-сервера к Telegram"""
+    global _bot
+    if _bot is None:
+        from aiogram import Bot
+        _bot = Bot(token=BOT_TOKEN)
+    return _bot
+
+
+async def close_bot() -> None:
+    global _bot
+    for task in list(_refresh_tasks):
+        task.cancel()
+    if _bot is not None:
+        try:
+            session = await _bot.get_session()
+            if session:
+                await session.close()
+        except Exception as e:
+            logger.warning(f"Ошибка при закрытии сессии бота (auth_session): {e}")
+        _bot = None
+
+
+async def fetch_username(telegram_id: int):
+    """username (или first_name) пользователя из Telegram; None при ошибке"""
+    try:
+        user_info = await asyncio.wait_for(get_bot().get_chat(telegram_id), timeout=TELEGRAM_TIMEOUT)
+        return getattr(user_info, 'username', None) or getattr(user_info, 'first_name', None)
+    except asyncio.TimeoutError:
+        logger.warning(f"Таймаут получения данных пользователя {telegram_id} через Bot API, пропускаем username")
+    except Exception as e:
+        logger.warning(f"Не удалось получить username пользователя {telegram_id}: {e}")
+    return None
+
+
+async def check_subscription(telegram_id: int, channel_username: str = REQUIRED_CHANNEL) -> bool:
+    """
+    Подписан ли пользователь на канал
+
+    При таймауте и ошибках считаем, что подписан, чтобы не блокировать доступ.
+    """
+    try:
+        member = await asyncio.wait_for(
+            get_bot().get_chat_member(channel_username, telegram_id),
+            timeout=TELEGRAM_TIMEOUT
+        )
+        return member.status in ['member', 'administrator', 'creator']
+    except asyncio.TimeoutError:
+        logger.warning(f"Таймаут при проверке подписки на {channel_username} для пользователя {telegram_id}")
+    except Exception as e:
+        logger.warning(f"Ошибка проверки подписки на {channel_username}: {e}")
+    return True
+
+
+async def fetch_telegram_profile(telegram_id: int, check_channel: bool = True) -> tuple:
+    """(username, подписан ли на канал) - оба запроса к Telegram выполняются параллельно"""
+    if not check_channel:
+        return await fetch_username(telegram_id), True
+    username, subscribed = await asyncio.gather(fetch_username(telegram_id), check_subscription(telegram_id))
+    return username, subscribed
+
+
+async def save_username(telegram_id: int, username: str) -> None:
+    """Обновляет username в БД, если он изменился"""
+    from sqlalchemy import update
+    from db import async_session
+    from models import User
+    async with async_session() as session:
+        result = await session.execute(
+            update(User)
+            .where(User.telegram_id == telegram_id, (User.username.is_(None)) | (User.username != username))
+            .values(username=username)
+        )
+        await session.commit()
+    if result.rowcount:
+        logger.info(f"✅ Обновлен username для пользователя {telegram_id}: {username}")
+
+
+def cache_profile(telegram_id: int, role: str, username: str = None) -> None:
+    auth_profile_cache.set(telegram_id, {"role": role, "username": username, "checked_at": time.monotonic()})
+
+
+def get_cached_profile(telegram_id: int, check_channel: bool = True):
+    """
+    Данные авторизации из кэша (None - нет записи)
+
+    Если запись устарела, запускает фоновое обновление username и подписки.
+    """
+    profile = auth_profile_cache.get(telegram_id)
+    if profile is not None and time.monotonic() - profile["checked_at"] > AUTH_PROFILE_REFRESH_AFTER:
+        schedule_refresh(telegram_id, check_channel)
+    return profile
+
+
+def invalidate_profile(telegram_id: int) -> None:
+    """Сбрасывает кэш авторизации (при изменении роли пользователя)"""
+    auth_profile_cache.invalidate(telegram_id)
+
+
+def schedule_refresh(telegram_id: int, check_channel: bool = True) -> None:
+    if telegram_id in _refreshing:
+        return
+    _refreshing.add(telegram_id)
+    task = asyncio.create_task(_refresh_profile(telegram_id, check_channel))
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+
+async def _refresh_profile(telegram_id: int, check_channel: bool) -> None:
+    try:
+        username, subscribed = await fetch_telegram_profile(telegram_id, check_channel)
+        profile = auth_profile_cache.get(telegram_id)
+        if profile is None:
+            return
+        if not subscribed:
+            # Следующий запуск пройдёт полную проверку и покажет сообщение о подписке
+            invalidate_profile(telegram_id)
+            return
+        if username and username != profile["username"]:
+            await save_username(telegram_id, username)
+        cache_profile(telegram_id, profile["role"], username or profile["username"])
+    except Exception as e:
+        logger.warning(f"Не удалось обновить данные авторизации пользователя {telegram_id}: {e}")
+    finally:
+        _refreshing.discard(telegram_id)
@@ -0,0 +1,119 @@
+"""
+Замер параллельной записи и чтения SQLite: настройки по умолчанию против профиля db.py
+
+    python bench_db.py [--writers 8] [--readers 16] [--operations 200] [--users 5000]
+
+Для каждого режима создаётся отдельная временная БД (DATABASE_URL рабочей БД
+не используется) с --users пользователями, затем одновременно запускаются
+--writers писателей (UPDATE users.experience + commit) и --readers читателей
+(SELECT пользователя), каждый выполняет --operations операций.
+
+- default: один движок без PRAGMA (журнал DELETE, стандартный таймаут sqlite3),
+  чтение и запись через общий пул
+- tuned: db.engine с SQLITE_PRAGMAS (WAL, busy_timeout, ...) для записи
+  и db.read_engine (отдельный пул, query_only) для чтения
+
+Выводит общее время, операций в секунду и число ошибок ("database is locked").
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+
+async def seed(engine, users: int) -> None:
+    from sqlalchemy import insert
+    from models import Base, User
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(User), [{"telegram_id": 1_000_000 + i, "experience": 0} for i in range(users)])
+
+
+async def run_load(write_session, read_session, args) -> dict:
+    from sqlalchemy import select, update
+    from models import User
+
+    stats = {"writes": 0, "reads": 0, "errors": 0}
+
+    async def writer():
+        for _ in range(args.operations):
+            user_id = 1_000_000 + random.randrange(args.users)
+            try:
+                async with write_session() as session:
+                    await session.execute(
+                        update(User).where(User.telegram_id == user_id).values(experience=User.experience + 1)
+                    )
+                    await session.commit()
+                stats["writes"] += 1
+            except Exception:
+                stats["errors"] += 1
+
+    async def reader():
+        for _ in range(args.operations):
+            user_id = 1_000_000 + random.randrange(args.users)
+            try:
+                async with read_session() as session:
+                    await session.execute(select(User).where(User.telegram_id == user_id))
+                stats["reads"] += 1
+            except Exception:
+                stats["errors"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[writer() for _ in range(args.writers)], *[reader() for _ in range(args.readers)])
+    stats["elapsed"] = time.perf_counter() - started
+    return stats
+
+
+def report(mode: str, stats: dict) -> None:
+    operations = stats["writes"] + stats["reads"]
+    print(
+        f"{mode:8} {stats['elapsed']:.3f} с, записей {stats['writes']}, чтений {stats['reads']}, "
+        f"{operations / stats['elapsed']:.0f} оп/с, ошибок {stats['errors']}"
+    )
+
+
+async def run_default(path: str, args) -> dict:
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}", echo=False)
+    await seed(engine, args.users)
+    session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    try:
+        return await run_load(session, session, args)
+    finally:
+        await engine.dispose()
+
+
+async def run_tuned(args) -> dict:
+    # Движки db.py создаются при импорте по DATABASE_URL, выставленному в main()
+    import db
+
+    await seed(db.engine, args.users)
+    try:
+        return await run_load(db.async_session, db.read_session, args)
+    finally:
+        await db.read_engine.dispose()
+        await db.engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Замер параллельной записи и чтения SQLite")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--operations", type=int, default=200, help="операций на каждого писателя/читателя")
+    parser.add_argument("--users", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tmp_dir, 'tuned.db')}"
+        os.environ.setdefault("SHARED_STATE_DIR", os.path.join(tmp_dir, "shared_state"))
+        report("default", asyncio.run(run_default(os.path.join(tmp_dir, "default.db"), args)))
+        report("tuned", asyncio.run(run_tuned(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Замер начисления опыта за конкурс (giveaway.award_experience_for_contest)
+
+    python bench_experience.py --participants 50000 [--type drawing|random_comment] [--winners 10] [--missing 0.1]
+
+Создаёт временную SQLite-БД (DATABASE_URL рабочей БД не используется),
+заполняет её пользователями, участниками (для random_comment - комментариями
+под постом) и победителями, затем один раз начисляет опыт и выводит время
+и количество SQL-запросов. Доля --missing участников отсутствует в таблице
+users (не запускали бота) и должна быть пропущена.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+POST_LINK = "https://t.me/bench_channel/10"
+POST_CHANNEL = "bench_channel"
+POST_MESSAGE_ID = 10
+
+
+async def seed(session, contest_type: str, participants: int, winners: int, missing: float) -> list:
+    from sqlalchemy import insert
+    from models import Comment, Giveaway, Participant, User, Winner
+
+    giveaway = Giveaway(
+        name="Benchmark", prize="-", end_date=datetime_now(), contest_type=contest_type,
+        post_link=POST_LINK if contest_type == "random_comment" else None,
+    )
+    session.add(giveaway)
+    await session.flush()
+
+    user_ids = [1_000_000 + i for i in range(participants)]
+    registered = user_ids[int(len(user_ids) * missing):]
+    await session.execute(insert(User), [{"telegram_id": user_id, "experience": 0} for user_id in registered])
+    if contest_type == "random_comment":
+        await session.execute(insert(Comment), [
+            {
+                "chat_id": POST_CHANNEL, "post_message_id": POST_MESSAGE_ID,
+                "comment_message_id": i, "comment_chat_id": "-100500",
+                "comment_link": f"https://t.me/c/500/{i}", "user_id": user_id,
+            }
+            for i, user_id in enumerate(user_ids)
+        ])
+        # Победители рандом соо сохраняются без user_id - он находится по ссылке на комментарий
+        winner_rows = [
+            {"giveaway_id": giveaway.id, "comment_link": f"https://t.me/c/500/{i}", "place": i + 1}
+            for i in range(winners)
+        ]
+    else:
+        await session.execute(insert(Participant), [
+            {"giveaway_id": giveaway.id, "user_id": user_id, "photo_link": "bench"} for user_id in user_ids
+        ])
+        winner_rows = [
+            {"giveaway_id": giveaway.id, "user_id": user_ids[-1 - i], "place": i + 1}
+            for i in range(winners)
+        ]
+    await session.execute(insert(Winner), winner_rows)
+    await session.commit()
+    return [giveaway.id, registered]
+
+
+def datetime_now():
+    from datetime import datetime
+    return datetime.now()
+
+
+async def run(args) -> None:
+    from sqlalchemy import event, func, select
+    import db
+    from giveaway import award_experience_for_contest
+    from models import User
+
+    await db.init_db()
+    async with db.async_session() as session:
+        started = time.perf_counter()
+        contest_id, registered = await seed(session, args.type, args.participants, args.winners, args.missing)
+        print(f"Подготовка данных: {time.perf_counter() - started:.2f} с")
+
+    statements = 0
+
+    def count_statement(*_):
+        nonlocal statements
+        statements += 1
+
+    event.listen(db.engine.sync_engine, "before_cursor_execute", count_statement)
+    async with db.async_session() as session:
+        started = time.perf_counter()
+        deltas = await award_experience_for_contest(contest_id, session)
+        elapsed = time.perf_counter() - started
+    event.remove(db.engine.sync_engine, "before_cursor_execute", count_statement)
+
+    async with db.async_session() as session:
+        total = (await session.execute(select(func.sum(User.experience)))).scalar() or 0
+    print(
+        f"Начисление опыта ({args.type}, участников {args.participants}, в боте {len(registered)}): "
+        f"{elapsed:.3f} с, SQL-запросов {statements}, пользователей с опытом {len(deltas)}, "
+        f"опыта начислено {sum(deltas.values())}"
+    )
+    assert total == sum(deltas.values()), "сумма опыта в users не совпадает с начисленной"
+    await db.engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Замер начисления опыта за конкурс")
+    parser.add_argument("--participants", type=int, default=50000)
+    parser.add_argument("--type", choices=["drawing", "random_comment"], default="drawing")
+    parser.add_argument("--winners", type=int, default=10)
+    parser.add_argument("--missing", type=float, default=0.1, help="доля участников, которых нет в users")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # До импорта db: движок создаётся при импорте по DATABASE_URL
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+        os.environ.setdefault("SHARED_STATE_DIR", os.path.join(tmp_dir, "shared_state"))
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Контентно-адресуемое хранилище файлов работ (drawing_uploads/blobs)
+
+- файл хранится один раз под именем SHA-256 своего содержимого:
+  blobs/ab/cd/abcd...<ext> (две вложенные папки по первым байтам хэша)
+- одинаковые загрузки не дублируются на диске
+- количество ссылок на файл считается по работам в drawing_contests.json
+  (local_path и пути уменьшенных копий), отдельный счётчик не хранится
+  и поэтому не может "разъехаться" с документом
+- сборка мусора удаляет файлы без ссылок, verify проверяет хэши содержимого
+
+Использование из консоли:
+    python blob_store.py verify   - проверить целостность файлов
+    python blob_store.py gc       - удалить файлы, на которые не ссылаются работы
+"""
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# Файлы моложе этого возраста сборщик мусора не трогает (загрузка могла ещё не сохраниться)
+GC_GRACE_SECONDS = 3600
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def referenced_paths(drawing_data: dict) -> dict:
+    """
+    Количество ссылок на файлы из работ всех конкурсов
+
+    Returns:
+        dict: {путь относительно корня проекта: количество ссылок}
+    """
+    refs = {}
+    for contest_entry in (drawing_data or {}).values():
+        if not isinstance(contest_entry, dict):
+            continue
+        for work in contest_entry.get("works", []):
+            paths = [work.get("local_path")]
+            paths.extend(info.get("path") for info in (work.get("derivatives") or {}).values())
+            for path in paths:
+                if path:
+                    refs[path] = refs.get(path, 0) + 1
+    return refs
+
+
+class BlobStore:
+    """
+    Хранилище файлов по хэшу содержимого
+
+    Args:
+        root: Папка хранилища
+        base_dir: Папка, относительно которой возвращаются пути (корень проекта)
+    """
+
+    def __init__(self, root: str, base_dir: str):
+        self.root = root
+        self.base_dir = base_dir
+
+    def _blob_path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}{ext}")
+
+    def _relative(self, path: str) -> str:
+        return os.path.relpath(path, self.base_dir).replace("\\", "/")
+
+    def contains(self, rel_path: str) -> bool:
+        """Лежит ли путь (относительно base_dir) внутри хранилища"""
+        full_path = os.path.abspath(os.path.join(self.base_dir, rel_path))
+        return full_path.startswith(os.path.abspath(self.root) + os.sep)
+
+    def put_file(self, src_path: str, ext: str = "", digest: str = None) -> str:
+        """
+        Перемещает файл в хранилище (если такой файл уже есть - исходный удаляется)
+
+        Returns:
+            str: путь к файлу в хранилище относительно base_dir
+        """
+        if digest is None:
+            digest = sha256_file(src_path)
+        target = self._blob_path(digest, ext.lower())
+        if os.path.exists(target):
+            if os.path.exists(src_path):
+                os.remove(src_path)
+            # Обновляем mtime, чтобы сборщик мусора не удалил файл до сохранения ссылки
+            os.utime(target)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(src_path, target)
+        return self._relative(target)
+
+    def remove_if_unreferenced(self, rel_paths, refs: dict) -> int:
+        """Удаляет файлы хранилища из rel_paths, на которые больше нет ссылок"""
+        removed = 0
+        for rel_path in rel_paths:
+            if not rel_path or refs.get(rel_path) or not self.contains(rel_path):
+                continue
+            try:
+                os.remove(os.path.join(self.base_dir, rel_path))
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось удалить файл {rel_path}: {e}")
+        return removed
+
+    def iter_blobs(self):
+        """Все файлы хранилища: (полный путь, ожидаемый хэш из имени)"""
+        if not os.path.isdir(self.root):
+            return
+        for dir_path, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                digest = os.path.splitext(file_name)[0]
+                yield os.path.join(dir_path, file_name), digest
+
+    def collect_garbage(self, refs: dict, grace_seconds: int = GC_GRACE_SECONDS) -> dict:
+        """
+        Удаляет файлы, на которые нет ссылок и которые старше grace_seconds
+
+        Returns:
+            dict: {"removed": количество, "freed_bytes": освобождено байт}
+        """
+        now = time.time()
+        removed = 0
+        freed = 0
+        for path, _ in list(self.iter_blobs()):
+            if refs.get(self._relative(path)):
+                continue
+            try:
+                stat = os.stat(path)
+                if now - stat.st_mtime < grace_seconds:
+                    continue
+                os.remove(path)
+                removed += 1
+                freed += stat.st_size
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось удалить файл {path}: {e}")
+        return {"removed": removed, "freed_bytes": freed}
+
+    def verify(self) -> list:
+        """
+        Проверяет, что содержимое каждого файла соответствует хэшу в его имени
+
+        Returns:
+            list: пути повреждённых файлов (относительно base_dir)
+        """
+        corrupted = []
+        for path, digest in self.iter_blobs():
+            try:
+                if sha256_file(path) != digest:
+                    corrupted.append(self._relative(path))
+            except Exception as e:
+                logger.error(f"Не удалось прочитать {path}: {e}")
+                corrupted.append(self._relative(path))
+        return corrupted
+
+
+def _main(argv: list) -> int:
+    root_dir = os.path.dirname(os.path.abspath(__file__))
+    store = BlobStore(os.path.join(root_dir, "drawing_uploads", "blobs"), root_dir)
+    command = argv[1] if len(argv) > 1 else ""
+    if command == "verify":
+        corrupted = store.verify()
+        for rel_path in corrupted:
+            print(f"❌ Повреждён: {rel_path}")
+        print(f"Проверка завершена, повреждённых файлов: {len(corrupted)}")
+        return 1 if corrupted else 0
+    if command == "gc":
+        data_file = os.path.join(root_dir, "drawing_contests.json")
+        if not os.path.exists(data_file):
+            print("drawing_contests.json не найден - сборка мусора отменена")
+            return 1
+        with open(data_file, "r", encoding="utf-8") as f:
+            drawing_data = json.load(f)
+        result = store.collect_garbage(referenced_paths(drawing_data))
+        print(f"🗑️ Удалено файлов: {result['removed']}, освобождено байт: {result['freed_bytes']}")
+        return 0
+    print(__doc__)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv))
@@ -8,7 +8,11 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 from aiogram.dispatcher.middlewares import BaseMiddleware
 from sqlalchemy.future import select
 
-from config import BOT_TOKEN, CREATOR_ID, WEBAPP_URL
+from config import (
+    BOT_TOKEN, CREATOR_ID, WEBAPP_URL, APP_ROLE, WEB_WORKERS, WEB_PORT,
+    BOT_UPDATES_MODE, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_PORT,
+)
 from db import init_db, async_session
 from models import User
 from web_server import app as fastapi_app
@@ -20,6 +24,10 @@ logging.basicConfig(level=logging.INFO)
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher(bot)
 
+# Явно указываем, что принимаем все типы обновлений, включая pre_checkout_query и successful_payment
+# Это критично для работы платежей через Telegram Stars
+ALLOWED_UPDATES = ["message", "callback_query", "pre_checkout_query", "poll", "poll_answer"]
+
 async def check_subscription_to_channel(bot: Bot, user_id: int, channel_username: str) -> bool:
     """Проверяет подписку пользователя на канал"""
     try:
@@ -322,28 +330,31 @@ async def process_successful_payment(message: types.Message):
                 # Пополняем баланс в базе данных
                 try:
                     from db import async_session
-                    from models import User
-                    from sqlalchemy.future import select
+                    from ledger import LedgerError, apply_coin_delta
                     
                     async with async_session() as session:
-                        result = await session.execute(select(User).where(User.telegram_id == user_id))
-                        user = result.scalars().first()
-                        
-                        if user:
-                            current_balance = getattr(user, 'monkey_coins', 0) or 0
-                            user.monkey_coins = current_balance + int(monkey_coins)
-                            await session.commit()
-                            
-                            logging.info(f"✅ Баланс пополнен: Пользователь {username} (ID: {user_id}) получил {monkey_coins} Monkey Coins, новый баланс: {user.monkey_coins}")
-                            
-                            # Отправляем подтверждение пользователю
-                            await message.answer(
-                                f"✅ **Баланс пополнен!**\n\n"
-                                f"Получено: {monkey_coins} Monkey Coins\n"
-                                f"Ваш баланс: {user.monkey_coins} Monkey Coins",
-                                parse_mode="Markdown"
+                        try:
+                            # Повторная доставка того же платежа не начислит монеты второй раз
+                            balance, applied = await apply_coin_delta(
+                                session, user_id, int(monkey_coins), "topup_stars",
+                                idempotency_key=f"stars:{payment.telegram_payment_charge_id}"
                             )
-                            return
+                        except LedgerError:
+                            balance = None
+                        await session.commit()
+                    
+                    if balance is not None:
+                        if applied:
+                            logging.info(f"✅ Баланс пополнен: Пользователь {username} (ID: {user_id}) получил {monkey_coins} Monkey Coins, новый баланс: {balance}")
+                        
+                        # Отправляем подтверждение пользователю
+                        await message.answer(
+                            f"✅ **Баланс пополнен!**\n\n"
+                            f"Получено: {monkey_coins} Monkey Coins\n"
+                            f"Ваш баланс: {balance} Monkey Coins",
+                            parse_mode="Markdown"
+                        )
+                        return
                 except Exception as e:
                     logging.error(f"❌ Ошибка пополнения баланса в БД: {e}", exc_info=True)
                     await message.answer("❌ Ошибка при пополнении баланса. Обратитесь в поддержку.")
@@ -365,35 +376,13 @@ async def process_successful_payment(message: types.Message):
                 from db import async_session
                 from models import User
                 from sqlalchemy.future import select
-                import json
+                from user_items import add_user_item
                 
                 async with async_session() as session:
-                    result = await session.execute(select(User).where(User.telegram_id == user_id))
-                    user = result.scalars().first()
+                    result = await session.execute(select(User.id).where(User.telegram_id == user_id))
                     
-                    if user:
-                        # Получаем текущие покупки
-                        purchased_items = None
-                        if hasattr(user, 'purchased_items') and user.purchased_items:
-                            try:
-                                if isinstance(user.purchased_items, str):
-                                    purchased_items = json.loads(user.purchased_items)
-                                else:
-                                    purchased_items = user.purchased_items
-                            except:
-                                purchased_items = {"themes": [], "avatarStars": [], "nftGifts": []}
-                        else:
-                            purchased_items = {"themes": [], "avatarStars": [], "nftGifts": []}
-                        
-                        # Добавляем покупку
-                        if category not in purchased_items:
-                            purchased_items[category] = []
-                        
-                        if item_id not in purchased_items[category]:
-                            purchased_items[category].append(item_id)
-                        
-                        # Сохраняем в базу данных
-                        user.purchased_items = json.dumps(purchased_items)
+                    if result.first() is not None and category and item_id:
+                        await add_user_item(session, user_id, category, item_id)
                         await session.commit()
                         
                         logging.info(f"✅ Покупка сохранена в БД: Пользователь {username} (ID: {user_id}) получил {item_name} (категория: {category}, товар: {item_id})")
@@ -415,38 +404,48 @@ async def process_successful_payment(message: types.Message):
         logging.error(f"❌ Ошибка при обработке успешной оплаты: {e}", exc_info=True)
 
 
-async def start_web_server():
-    """Запускаем FastAPI сервер в том же event loop"""
+def _uvicorn_options(port: int = WEB_PORT) -> dict:
+    """Параметры uvicorn: HTTPS, если найдены сертификаты"""
     import os
     ssl_keyfile = os.getenv("SSL_KEYFILE", "ssl/key.pem")
     ssl_certfile = os.getenv("SSL_CERTFILE", "ssl/cert.pem")
     
     use_ssl = os.path.exists(ssl_keyfile) and os.path.exists(ssl_certfile)
     
+    options = {
+        "host": "0.0.0.0",
+        "port": port,
+        "log_level": "info",
+    }
     if use_ssl:
-        print("🔒 WebApp доступен на https://0.0.0.0:8000")
-        config = uvicorn.Config(
-            fastapi_app,
-            host="0.0.0.0",
-            port=8000,
-            log_level="info",
-            ssl_keyfile=ssl_keyfile,
-            ssl_certfile=ssl_certfile,
-        )
+        print(f"🔒 WebApp доступен на https://0.0.0.0:{port}")
+        options["ssl_keyfile"] = ssl_keyfile
+        options["ssl_certfile"] = ssl_certfile
     else:
-        print("⚠️  SSL сертификаты не найдены. WebApp доступен на http://0.0.0.0:8000")
+        print(f"⚠️  SSL сертификаты не найдены. WebApp доступен на http://0.0.0.0:{port}")
         print("💡 Для HTTPS создайте сертификаты: python generate_ssl.py")
-        config = uvicorn.Config(
-            fastapi_app,
-            host="0.0.0.0",
-            port=8000,
-            log_level="info",
-        )
-    
+    return options
+
+
+async def start_web_server():
+    """Запускаем FastAPI сервер в том же event loop"""
+    config = uvicorn.Config(fastapi_app, **_uvicorn_options())
     server = uvicorn.Server(config)
     await server.serve()
 
 
+def run_web_workers():
+    """
+    Только веб-API (APP_ROLE=web): WEB_WORKERS независимых процессов uvicorn
+
+    Воркеры не хранят общего состояния в памяти: документы конкурсов защищены
+    межпроцессными блокировками, кэши сбрасываются через общие версии
+    (см. shared_state.py), уведомления отправляет процесс бота.
+    """
+    print(f"🌐 Запуск веб-API: воркеров {WEB_WORKERS}")
+    uvicorn.run("web_server:app", workers=WEB_WORKERS, **_uvicorn_options())
+
+
 async def run_bot():
     # База данных инициализируется в lifespan FastAPI приложения
     # await init_db()  # Убрано, чтобы избежать дублирования инициализации
@@ -519,15 +518,69 @@ async def run_bot():
         except:
             pass
     
+    if BOT_UPDATES_MODE == "webhook":
+        await run_webhook()
+        return
+    
     logging.info("🚀 Запуск polling...")
-    # Явно указываем, что принимаем все типы обновлений, включая pre_checkout_query и successful_payment
-    # Это критично для работы платежей через Telegram Stars
-    await dp.start_polling(
-        allowed_updates=["message", "callback_query", "pre_checkout_query", "poll", "poll_answer"]
-    )
+    await dp.start_polling(allowed_updates=ALLOWED_UPDATES)
+
+
+async def run_webhook():
+    """
+    Получение обновлений через webhook (BOT_UPDATES_MODE=webhook)
+    
+    Эндпоинт добавляется в приложение веб-API; при APP_ROLE=bot веб-API работает
+    в других процессах, поэтому обновления принимает отдельный uvicorn на WEBHOOK_PORT.
+    """
+    from telegram_webhook import WebhookUpdateQueue, register_webhook_route, setup_webhook
+    
+    update_queue = WebhookUpdateQueue(dp, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE)
+    update_queue.start()
+    webhook_server_task = None
+    if APP_ROLE == "bot":
+        from fastapi import FastAPI
+        webhook_app = FastAPI()
+        register_webhook_route(webhook_app, WEBHOOK_PATH, WEBHOOK_SECRET, update_queue)
+        config = uvicorn.Config(webhook_app, **_uvicorn_options(port=WEBHOOK_PORT))
+        webhook_server_task = asyncio.create_task(uvicorn.Server(config).serve(), name="webhook-server")
+    else:
+        register_webhook_route(fastapi_app, WEBHOOK_PATH, WEBHOOK_SECRET, update_queue)
+    
+    logging.info("🚀 Запуск приёма обновлений через webhook...")
+    try:
+        await setup_webhook(bot, WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH, WEBHOOK_SECRET, ALLOWED_UPDATES)
+        if webhook_server_task is not None:
+            await webhook_server_task
+        else:
+            # Обновления приходят в веб-сервер, запущенный в main()
+            await asyncio.Event().wait()
+    finally:
+        if webhook_server_task is not None and not webhook_server_task.done():
+            webhook_server_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await webhook_server_task
+        await update_queue.stop()
+        session = await bot.get_session()
+        if session:
+            await session.close()
+
+
+async def run_bot_with_background_jobs():
+    """Только бот (APP_ROLE=bot): polling и фоновые задачи, общие для всех воркеров веб-API"""
+    from web_server import start_background_jobs, stop_background_jobs
+    await init_db()
+    background_tasks = await start_background_jobs()
+    try:
+        await run_bot()
+    finally:
+        await stop_background_jobs(background_tasks)
 
 
 async def main():
+    if APP_ROLE == "bot":
+        await run_bot_with_background_jobs()
+        return
     web_task = asyncio.create_task(start_web_server(), name="fastapi-server")
     try:
         await run_bot()
@@ -539,4 +592,7 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if APP_ROLE == "web":
+        run_web_workers()
+    else:
+        asyncio.run(main())
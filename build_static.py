@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Сборка статики WebApp для продакшена
+
+Для каждой HTML-страницы:
+- встроенные <style> и <script> выносятся в отдельные файлы assets/ с хэшем
+  содержимого в имени (их можно кэшировать навсегда - Cache-Control: immutable)
+- HTML-оболочка сохраняется в static_build/ и отдаётся с ревалидацией по ETag
+- для всех файлов создаются предсжатые варианты .gz и .br (если установлен brotli)
+
+Результат описывается в static_build/manifest.json, который читает web_server.py.
+Использование: python build_static.py
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+BUILD_DIR = os.path.join(ROOT_DIR, "static_build")
+ASSETS_DIR = os.path.join(BUILD_DIR, "assets")
+MANIFEST_FILE = os.path.join(BUILD_DIR, "manifest.json")
+
+# Страницы, которые отдаёт web_server.py
+PAGES = ["index.html", "user.html", "admin.html", "creator.html"]
+# Отдельные файлы, которые копируются как есть (с предсжатием)
+PLAIN_FILES = ["style.css", "script.js"]
+
+# Встроенные блоки без атрибута src (внешние CDN-скрипты не трогаем)
+INLINE_SCRIPT_RE = re.compile(r"<script(?P<attrs>(?:(?!\bsrc=)[^>])*)>(?P<body>.*?)</script>", re.S | re.I)
+INLINE_STYLE_RE = re.compile(r"<style(?P<attrs>[^>]*)>(?P<body>.*?)</style>", re.S | re.I)
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def write_with_variants(path: str, data: bytes) -> dict:
+    """Записывает файл и его предсжатые варианты, возвращает описание для манифеста"""
+    with open(path, "wb") as f:
+        f.write(data)
+    encodings = []
+    gz_data = gzip.compress(data, compresslevel=9)
+    if len(gz_data) < len(data):
+        with open(path + ".gz", "wb") as f:
+            f.write(gz_data)
+        encodings.append("gzip")
+    if HAS_BROTLI:
+        br_data = brotli.compress(data, quality=11)
+        if len(br_data) < len(data):
+            with open(path + ".br", "wb") as f:
+                f.write(br_data)
+            encodings.append("br")
+    return {
+        "file": os.path.relpath(path, BUILD_DIR).replace(os.sep, "/"),
+        "etag": content_hash(data),
+        "size": len(data),
+        "encodings": encodings,
+    }
+
+
+def extract_asset(page_name: str, index: int, ext: str, body: str) -> str:
+    """Сохраняет встроенный блок в assets/ и возвращает его URL"""
+    data = body.encode("utf-8")
+    base = os.path.splitext(page_name)[0]
+    asset_name = f"{base}-{index}.{content_hash(data)}.{ext}"
+    write_with_variants(os.path.join(ASSETS_DIR, asset_name), data)
+    return f"/assets/{asset_name}"
+
+
+def build_page(page_name: str) -> dict:
+    with open(os.path.join(ROOT_DIR, page_name), "r", encoding="utf-8") as f:
+        html = f.read()
+
+    counter = {"n": 0}
+
+    def replace_style(match):
+        counter["n"] += 1
+        url = extract_asset(page_name, counter["n"], "css", match.group("body"))
+        return f'<link rel="stylesheet" href="{url}">'
+
+    def replace_script(match):
+        attrs = match.group("attrs")
+        body = match.group("body")
+        # JSON/шаблоны и пустые блоки оставляем встроенными
+        if not body.strip() or ("type=" in attrs and "javascript" not in attrs and "module" not in attrs):
+            return match.group(0)
+        counter["n"] += 1
+        url = extract_asset(page_name, counter["n"], "js", body)
+        return f'<script{attrs} src="{url}"></script>'
+
+    # Сначала скрипты: строки внутри JS не должны попасть под замену <style>
+    html = INLINE_SCRIPT_RE.sub(replace_script, html)
+    html = INLINE_STYLE_RE.sub(replace_style, html)
+
+    entry = write_with_variants(os.path.join(BUILD_DIR, page_name), html.encode("utf-8"))
+    print(f"✅ {page_name}: {entry['size']} байт, вынесено блоков: {counter['n']}, сжатие: {', '.join(entry['encodings']) or 'нет'}")
+    return entry
+
+
+def build_plain(file_name: str) -> dict:
+    with open(os.path.join(ROOT_DIR, file_name), "rb") as f:
+        data = f.read()
+    entry = write_with_variants(os.path.join(BUILD_DIR, file_name), data)
+    print(f"✅ {file_name}: {entry['size']} байт, сжатие: {', '.join(entry['encodings']) or 'нет'}")
+    return entry
+
+
+def main():
+    if os.path.exists(BUILD_DIR):
+        shutil.rmtree(BUILD_DIR)
+    os.makedirs(ASSETS_DIR, exist_ok=True)
+
+    if not HAS_BROTLI:
+        print("⚠️ brotli не установлен - создаются только .gz варианты (pip install brotli)")
+
+    manifest = {}
+    for page_name in PAGES:
+        if os.path.exists(os.path.join(ROOT_DIR, page_name)):
+            manifest[page_name] = build_page(page_name)
+        else:
+            print(f"⚠️ {page_name} не найден, пропускаем")
+    for file_name in PLAIN_FILES:
+        if os.path.exists(os.path.join(ROOT_DIR, file_name)):
+            manifest[file_name] = build_plain(file_name)
+
+    with open(MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"📦 Статика собрана в {BUILD_DIR}")
+
+
+if __name__ == "__main__":
+    main()
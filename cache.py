@@ -0,0 +1,91 @@
+"""
+Простые in-memory кэши с TTL для горячих API-эндпоинтов
+
+Каждый процесс держит свой кэш; сброс передаётся другим процессам
+(воркерам uvicorn) через общую версию в файле (shared_state.SharedVersion).
+"""
+import time
+
+from shared_state import SharedVersion, shared_path
+
+
+class TTLCache:
+    """
+    Кэш "ключ -> значение" с временем жизни записей
+
+    Args:
+        ttl: Время жизни записи в секундах
+        maxsize: Максимальное количество записей (при переполнении удаляются самые старые)
+        shared_version: Общая версия: invalidate/clear в одном процессе
+            сбрасывают кэш целиком во всех остальных
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 10000, shared_version: SharedVersion = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}
+        self.shared_version = shared_version
+        self._seen_version = shared_version.get() if shared_version else None
+
+    def _check_shared_version(self) -> None:
+        if self.shared_version is None:
+            return
+        version = self.shared_version.get()
+        if version != self._seen_version:
+            # Другой процесс сбросил записи - какие именно, неизвестно
+            self._data.clear()
+            self._seen_version = version
+
+    def _bump_shared_version(self) -> None:
+        if self.shared_version is not None:
+            self._check_shared_version()
+            self._seen_version = self.shared_version.bump()
+
+    def get(self, key, default=None):
+        self._check_shared_version()
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return default
+        return value
+
+    def set(self, key, value, ttl: float = None) -> None:
+        """ttl - время жизни этой записи (по умолчанию - общее для кэша)"""
+        self._check_shared_version()
+        if key not in self._data and len(self._data) >= self.maxsize:
+            # dict сохраняет порядок вставки - первая запись самая старая
+            self._data.pop(next(iter(self._data)), None)
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+
+    def invalidate(self, key) -> None:
+        self._data.pop(key, None)
+        self._bump_shared_version()
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._bump_shared_version()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# Статистика профиля (участия/победы) по telegram_id.
+# Сбрасывается при участии пользователя в конкурсе, при сохранении комментариев
+# к постам рандом соо (giveaway.py) и при изменении победителей.
+profile_stats_cache = TTLCache(ttl=300, shared_version=SharedVersion(shared_path("profile_stats.version")))
+
+# Версия списка конкурсов: меняется при любом изменении конкурсов
+# (создание, редактирование, удаление, выбор и подтверждение победителей).
+# Используется как ключ ETag для /api/giveaways; общая для всех процессов.
+_contests_version = SharedVersion(shared_path("contests.version"))
+
+
+def get_contests_version() -> int:
+    return _contests_version.get()
+
+
+def bump_contests_version() -> int:
+    return _contests_version.bump()
@@ -1,4 +1,5 @@
 import os
+import secrets
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,6 +8,14 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 CREATOR_ID = int(os.getenv("CREATOR_ID", "0"))
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///giveaway.db")
 
+# Режим запуска процесса (см. bot.py):
+# all - бот и веб-сервер в одном процессе (по умолчанию)
+# bot - только бот (polling) и фоновые задачи (очередь уведомлений, сжатие журнала голосов, хранилище файлов)
+# web - только веб-API в WEB_WORKERS процессах uvicorn
+APP_ROLE = os.getenv("APP_ROLE", "all")
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+WEB_PORT = int(os.getenv("WEB_PORT", "8000"))
+
 # Telethon конфигурация (для получения исторических комментариев)
 TELEGRAM_API_ID = os.getenv("TELEGRAM_API_ID")
 TELEGRAM_API_HASH = os.getenv("TELEGRAM_API_HASH")
@@ -22,5 +31,24 @@ CRYPTOBOT_API_URL = "https://pay.crypt.bot/api"
 # Или домен, если есть (например: https://yourdomain.com)
 WEBAPP_URL = os.getenv("WEBAPP_URL", "https://90.156.211.211")
 
+# Сессии WebApp (см. auth_session.py): подпись токена, выдаваемого /api/auth.
+# Если SESSION_SECRET не задан, ключ выводится из BOT_TOKEN (одинаков во всех процессах).
+SESSION_SECRET = os.getenv("SESSION_SECRET", "")
+SESSION_TOKEN_TTL = int(os.getenv("SESSION_TOKEN_TTL", "3600"))  # секунды
+# Проверка подписи Telegram WebApp initData (см. webapp_auth.py)
+INIT_DATA_MAX_AGE = int(os.getenv("INIT_DATA_MAX_AGE", "86400"))  # секунды с момента auth_date
+# 1 - запросы без действительного initData отклоняются; 0 - принимается и tg_id из параметров (старые клиенты)
+WEBAPP_AUTH_REQUIRED = os.getenv("WEBAPP_AUTH_REQUIRED", "0") == "1"
+
+# Получение обновлений бота: polling (по умолчанию) или webhook (см. telegram_webhook.py)
+BOT_UPDATES_MODE = os.getenv("BOT_UPDATES_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", WEBAPP_URL)  # Публичный HTTPS адрес, на который Telegram шлёт обновления
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token (если не задан - новый при каждом запуске)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))  # Порт приёма webhook при APP_ROLE=bot
+
 # See.tg API конфигурация для получения информации о NFT
 SEE_TG_API_KEY = os.getenv("SEE_TG_API_KEY", "e9920398-1667-4f87-8b10-87f8ffda7d01:873a587224a276e557a0ee8871088a6748134807d7dd08e817ab89b21cd36e98")
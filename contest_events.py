@@ -0,0 +1,83 @@
+"""
+Внутрипроцессная шина событий конкурсов для live-таблицы лидеров (SSE)
+
+- подписчик (открытая страница создателя/жюри) получает свою очередь asyncio.Queue
+- изменения (новая работа, новый голос) только помечают конкурс как "изменённый"
+- фоновый цикл раз в интервал строит ОДИН снимок таблицы по каждому изменённому
+  конкурсу с подписчиками и рассылает его всем подписчикам (fan-out)
+- очередь подписчика ограничена: если клиент не успевает читать, самые старые
+  снимки выбрасываются (каждый снимок полный, поэтому достаточно последнего)
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ContestEventBus:
+    """
+    Pub/sub по contest_id
+
+    Args:
+        queue_size: Максимальное количество недоставленных событий на подписчика
+    """
+
+    def __init__(self, queue_size: int = 8):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._types = {}
+        self._dirty = {}
+
+    def subscribe(self, contest_id: int, contest_type: str = None) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(contest_id, set()).add(queue)
+        if contest_type:
+            self._types[contest_id] = contest_type
+        return queue
+
+    def unsubscribe(self, contest_id: int, queue: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(contest_id)
+        if not subscribers:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[contest_id]
+            self._types.pop(contest_id, None)
+
+    def has_subscribers(self, contest_id: int) -> bool:
+        return bool(self._subscribers.get(contest_id))
+
+    def subscribers_count(self, contest_id: int) -> int:
+        return len(self._subscribers.get(contest_id, ()))
+
+    def subscribed_contests(self) -> dict:
+        """Конкурсы с подписчиками и известным типом: {contest_id: contest_type}"""
+        return {contest_id: self._types[contest_id] for contest_id in self._subscribers if contest_id in self._types}
+
+    def mark_changed(self, contest_id: int, contest_type: str) -> None:
+        """Отмечает, что таблица конкурса изменилась (дёшево, вызывается на каждый голос)"""
+        if contest_id in self._subscribers:
+            self._dirty[contest_id] = contest_type
+
+    def take_changed(self) -> dict:
+        """Возвращает и сбрасывает изменённые конкурсы: {contest_id: contest_type}"""
+        changed, self._dirty = self._dirty, {}
+        return changed
+
+    def publish(self, contest_id: int, event: dict) -> None:
+        """Рассылает одно и то же событие всем подписчикам конкурса без ожидания"""
+        for queue in list(self._subscribers.get(contest_id, ())):
+            if queue.full():
+                # Медленный клиент: выбрасываем самое старое событие
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                logger.warning(f"Очередь подписчика конкурса {contest_id} переполнена, событие пропущено")
+
+
+# Общая шина событий процесса веб-сервера
+contest_event_bus = ContestEventBus()
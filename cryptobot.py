@@ -1,60 +1,192 @@
 """
 Модуль для работы с CryptoBot API
+
+CryptoBotClient держит одну aiohttp-сессию на процесс (пул соединений с
+keep-alive), ограничивает время запросов, повторяет неудачные запросы с
+экспоненциальной паузой и случайным разбросом и проверяет много счетов одним
+запросом getInvoices. getMe и getCurrencies кэшируются в памяти.
+
+Функции модуля (create_invoice, verify_payment, ...) - обёртки над общим клиентом.
 """
 import aiohttp
+import asyncio
 import logging
 import json
+import random
+from cache import TTLCache
 from config import CRYPTOBOT_API_TOKEN, CRYPTOBOT_API_URL
 
 logger = logging.getLogger(__name__)
 
+REQUEST_TIMEOUT = 10  # секунды на весь запрос
+CONNECT_TIMEOUT = 5
+MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.5  # секунды, удваивается с каждой попыткой
+# Сколько счетов запрашивать одним getInvoices
+INVOICES_BATCH_SIZE = 100
+# Время жизни кэша getMe / getCurrencies (секунды)
+INFO_CACHE_TTL = 3600
+
+
+class CryptoBotError(Exception):
+    """Ошибка ответа CryptoBot API или сети"""
+
+
+class CryptoBotClient:
+    """
+    Клиент CryptoBot API с постоянной сессией
+
+    Args:
+        token: Токен Crypto Pay API
+        api_url: Базовый URL API
+    """
+
+    def __init__(self, token: str, api_url: str):
+        self.token = token
+        self.api_url = api_url.rstrip("/")
+        self._session = None
+        self._info_cache = TTLCache(ttl=INFO_CACHE_TTL, maxsize=16)
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={"Crypto-Pay-API-Token": self.token},
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _request(self, http_method: str, api_method: str, idempotent: bool = True, **kwargs):
+        """
+        Выполняет запрос к API и возвращает поле result
+
+        Повторяются ошибки сети, таймауты, 429 и 5xx. Неидемпотентные запросы
+        (создание счёта) повторяются, только если соединение не было установлено
+        или сервер ответил 429 (запрос отклонён без обработки): после 5xx и
+        таймаута счёт мог быть уже создан.
+
+        Raises:
+            CryptoBotError: ошибка API или исчерпаны попытки
+        """
+        url = f"{self.api_url}/{api_method}"
+        last_error = None
+        for attempt in range(MAX_ATTEMPTS):
+            if attempt:
+                delay = RETRY_BASE_DELAY * (2 ** (attempt - 1))
+                await asyncio.sleep(delay + random.uniform(0, delay))
+            try:
+                session = await self._get_session()
+                async with session.request(http_method, url, **kwargs) as response:
+                    if response.status == 429 or response.status >= 500:
+                        last_error = f"HTTP {response.status}"
+                        if not idempotent and response.status != 429:
+                            break
+                        continue
+                    result = await response.json(content_type=None)
+            except aiohttp.ClientConnectorError as e:
+                last_error = str(e) or type(e).__name__
+                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = str(e) or type(e).__name__
+                if not idempotent:
+                    break
+                continue
+            if result.get("ok"):
+                return result.get("result")
+            error_info = result.get("error", {})
+            error_name = error_info.get("name", "Unknown error") if isinstance(error_info, dict) else str(error_info)
+            raise CryptoBotError(error_name)
+        raise CryptoBotError(last_error or "Unknown error")
+
+    async def create_invoice(self, amount: float, currency: str = "TON", description: str = "", payload: str = None) -> dict:
+        data = {
+            "amount": str(amount),
+            "asset": currency,
+            "description": description
+        }
+        if payload:
+            data["payload"] = payload
+        return await self._request("POST", "createInvoice", idempotent=False, json=data)
+
+    async def get_invoices(self, invoice_ids: list) -> dict:
+        """
+        Счета по списку id (запросами по INVOICES_BATCH_SIZE штук)
+
+        Returns:
+            dict: {invoice_id: счёт}; отсутствующих в ответе счетов в словаре нет
+        """
+        invoices = {}
+        ids = [int(invoice_id) for invoice_id in dict.fromkeys(invoice_ids)]
+        for start in range(0, len(ids), INVOICES_BATCH_SIZE):
+            batch = ids[start:start + INVOICES_BATCH_SIZE]
+            result = await self._request(
+                "GET", "getInvoices",
+                params={"invoice_ids": ",".join(str(invoice_id) for invoice_id in batch), "count": len(batch)}
+            )
+            for invoice in (result or {}).get("items", []):
+                invoices[invoice.get("invoice_id")] = invoice
+        return invoices
+
+    async def get_me(self) -> dict:
+        cached = self._info_cache.get("me")
+        if cached is None:
+            cached = await self._request("GET", "getMe")
+            self._info_cache.set("me", cached)
+        return cached
+
+    async def get_currencies(self) -> list:
+        cached = self._info_cache.get("currencies")
+        if cached is None:
+            cached = await self._request("GET", "getCurrencies") or []
+            self._info_cache.set("currencies", cached)
+        return cached
+
+
+def parse_invoice(invoice: dict) -> dict:
+    """Результат проверки счёта: {"paid", "invoice", "payload"}"""
+    payload_str = invoice.get("payload")
+    payload_data = None
+    if payload_str:
+        try:
+            payload_data = json.loads(payload_str) if isinstance(payload_str, str) else payload_str
+        except (TypeError, ValueError):
+            payload_data = None
+    return {
+        "paid": invoice.get("status") == "paid",
+        "invoice": invoice,
+        "payload": payload_data
+    }
+
+
+# Общий клиент процесса (сессия закрывается при остановке веб-сервера)
+cryptobot_client = CryptoBotClient(CRYPTOBOT_API_TOKEN, CRYPTOBOT_API_URL)
+
 
 async def create_invoice(amount: float, currency: str = "TON", description: str = "", user_id: int = None, payload: str = None) -> dict:
     """
     Создать счет на оплату через CryptoBot
-    
+
     Args:
         amount: Сумма оплаты
         currency: Валюта (TON, BTC, ETH, USDT, USDC, BUSD)
         description: Описание платежа
-        user_id: ID пользователя Telegram (опционально)
+        user_id: ID пользователя Telegram (опционально, привязка идёт через payload)
         payload: Дополнительные данные для отслеживания платежа (опционально)
-    
+
     Returns:
         dict: Ответ от API с информацией о счете
     """
-    url = f"{CRYPTOBOT_API_URL}/createInvoice"
-    headers = {
-        "Crypto-Pay-API-Token": CRYPTOBOT_API_TOKEN
-    }
-    data = {
-        "amount": str(amount),
-        "asset": currency,
-        "description": description
-    }
-    
-    if payload:
-        data["payload"] = payload
-    
-    # Указываем, что счет должен быть оплачен конкретным пользователем
-    # CryptoBot автоматически привязывает счет к пользователю, который его оплачивает
-    if user_id:
-        # Можно использовать paid_btn_name для указания действия после оплаты
-        # Но главное - payload содержит user_id для проверки
-        pass
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data) as response:
-                result = await response.json()
-                if result.get("ok"):
-                    logger.info(f"✅ Счет создан: {result.get('result', {}).get('invoice_id')}")
-                    return result.get("result", {})
-                else:
-                    error_info = result.get("error", {})
-                    error_name = error_info.get("name", "Unknown error") if isinstance(error_info, dict) else str(error_info)
-                    logger.error(f"❌ Ошибка создания счета: {error_name}")
-                    return {"error": error_name}
+        invoice = await cryptobot_client.create_invoice(amount, currency, description, payload)
+        logger.info(f"✅ Счет создан: {invoice.get('invoice_id')}")
+        return invoice
+    except CryptoBotError as e:
+        logger.error(f"❌ Ошибка создания счета: {e}")
+        return {"error": str(e)}
     except Exception as e:
         logger.error(f"❌ Ошибка при создании счета: {e}", exc_info=True)
         return {"error": str(e)}
@@ -63,45 +195,32 @@ async def create_invoice(amount: float, currency: str = "TON", description: str
 async def get_invoice_status(invoice_id: int) -> dict:
     """
     Получить статус счета
-    
+
     Args:
         invoice_id: ID счета
-    
+
     Returns:
         dict: Информация о счете
     """
-    url = f"{CRYPTOBOT_API_URL}/getInvoices"
-    headers = {
-        "Crypto-Pay-API-Token": CRYPTOBOT_API_TOKEN
-    }
-    params = {
-        "invoice_ids": invoice_id
-    }
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params) as response:
-                result = await response.json()
-                if result.get("ok"):
-                    invoices = result.get("result", {}).get("items", [])
-                    if invoices:
-                        return invoices[0]
-                    return {"error": "Invoice not found"}
-                else:
-                    logger.error(f"❌ Ошибка получения статуса счета: {result.get('error', {}).get('name')}")
-                    return {"error": result.get("error", {}).get("name", "Unknown error")}
+        invoices = await cryptobot_client.get_invoices([invoice_id])
+    except CryptoBotError as e:
+        logger.error(f"❌ Ошибка получения статуса счета: {e}")
+        return {"error": str(e)}
     except Exception as e:
         logger.error(f"❌ Ошибка при получении статуса счета: {e}", exc_info=True)
         return {"error": str(e)}
+    invoice = invoices.get(int(invoice_id))
+    return invoice if invoice else {"error": "Invoice not found"}
 
 
 async def verify_payment(invoice_id: int) -> dict:
     """
     Проверить, оплачен ли счет и получить информацию о нем
-    
+
     Args:
         invoice_id: ID счета
-    
+
     Returns:
         dict: Информация о счете с полями:
             - paid: bool - оплачен ли счет
@@ -111,74 +230,54 @@ async def verify_payment(invoice_id: int) -> dict:
     invoice = await get_invoice_status(invoice_id)
     if "error" in invoice:
         return {"paid": False, "invoice": None, "payload": None, "error": invoice.get("error")}
-    
-    status = invoice.get("status")
-    is_paid = status == "paid"
-    
-    # Извлекаем payload из счета
-    payload_str = invoice.get("payload")
-    payload_data = None
-    if payload_str:
-        try:
-            payload_data = json.loads(payload_str) if isinstance(payload_str, str) else payload_str
-        except:
-            payload_data = None
-    
-    return {
-        "paid": is_paid,
-        "invoice": invoice,
-        "payload": payload_data
-    }
+    return parse_invoice(invoice)
+
+
+async def verify_payments(invoice_ids: list) -> dict:
+    """
+    Проверить много счетов пакетными запросами getInvoices
+
+    Returns:
+        dict: {invoice_id: результат как у verify_payment}
+    """
+    try:
+        invoices = await cryptobot_client.get_invoices(invoice_ids)
+    except Exception as e:
+        logger.error(f"❌ Ошибка при пакетной проверке счетов: {e}")
+        return {int(invoice_id): {"paid": False, "invoice": None, "payload": None, "error": str(e)} for invoice_id in invoice_ids}
+    results = {}
+    for invoice_id in invoice_ids:
+        invoice = invoices.get(int(invoice_id))
+        if invoice:
+            results[int(invoice_id)] = parse_invoice(invoice)
+        else:
+            results[int(invoice_id)] = {"paid": False, "invoice": None, "payload": None, "error": "Invoice not found"}
+    return results
 
 
 async def get_me() -> dict:
     """
     Получить информацию о боте CryptoBot
-    
+
     Returns:
         dict: Информация о боте
     """
-    url = f"{CRYPTOBOT_API_URL}/getMe"
-    headers = {
-        "Crypto-Pay-API-Token": CRYPTOBOT_API_TOKEN
-    }
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                result = await response.json()
-                if result.get("ok"):
-                    return result.get("result", {})
-                else:
-                    logger.error(f"❌ Ошибка получения информации о боте: {result.get('error', {}).get('name')}")
-                    return {"error": result.get("error", {}).get("name", "Unknown error")}
+        return await cryptobot_client.get_me()
     except Exception as e:
-        logger.error(f"❌ Ошибка при получении информации о боте: {e}", exc_info=True)
+        logger.error(f"❌ Ошибка при получении информации о боте: {e}")
         return {"error": str(e)}
 
 
 async def get_currencies() -> list:
     """
     Получить список доступных валют
-    
+
     Returns:
         list: Список валют
     """
-    url = f"{CRYPTOBOT_API_URL}/getCurrencies"
-    headers = {
-        "Crypto-Pay-API-Token": CRYPTOBOT_API_TOKEN
-    }
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                result = await response.json()
-                if result.get("ok"):
-                    return result.get("result", [])
-                else:
-                    logger.error(f"❌ Ошибка получения валют: {result.get('error', {}).get('name')}")
-                    return []
+        return await cryptobot_client.get_currencies()
     except Exception as e:
-        logger.error(f"❌ Ошибка при получении валют: {e}", exc_info=True)
+        logger.error(f"❌ Ошибка при получении валют: {e}")
         return []
-
@@ -1,12 +1,9 @@
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
 from config import DATABASE_URL
 import logging
 import asyncio
-
-# Базовый класс для моделей
-Base = declarative_base()
+import os
 
 # Создаём движок и сессию
 # Настройка пула соединений для PostgreSQL (предотвращает TooManyConnectionsError)
@@ -23,14 +20,91 @@ if not DATABASE_URL.startswith("sqlite"):
         "pool_recycle": 3600,     # Переиспользование соединений через 1 час
     }
 
+# Профиль SQLite для продакшена: бот, веб-сервер и сбор комментариев Telethon
+# пишут в один файл giveaway.db одновременно.
+# - WAL: читатели не блокируют писателя и наоборот
+# - synchronous=NORMAL: в режиме WAL безопасно и без fsync на каждый коммит
+# - busy_timeout: ждать освобождения блокировки вместо мгновенного "database is locked"
+# - foreign_keys: в SQLite выключены по умолчанию (нужны для ON DELETE CASCADE)
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000")),
+    "cache_size": -64000,  # в КБ (отрицательное значение), т.е. ~64 МБ
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+}
+# Размер пула соединений только для чтения (GET-эндпоинты)
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "5"))
+
 engine = create_async_engine(DATABASE_URL, echo=False, **pool_kwargs)
 async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 IS_SQLITE = engine.url.get_backend_name().startswith("sqlite")
 
+# insert с поддержкой on_conflict_do_nothing для текущего диалекта
+if IS_SQLITE:
+    from sqlalchemy.dialects.sqlite import insert as upsert_insert
+else:
+    from sqlalchemy.dialects.postgresql import insert as upsert_insert
+
+
+def _apply_sqlite_pragmas(dbapi_connection, pragmas: dict) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+# Отдельный пул соединений для чтения: длинные GET-запросы не занимают
+# соединения, через которые идут записи. Для PostgreSQL используется общий движок.
+read_engine = engine
+if IS_SQLITE:
+    from sqlalchemy import event
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _on_sqlite_connect(dbapi_connection, connection_record):
+        _apply_sqlite_pragmas(dbapi_connection, SQLITE_PRAGMAS)
+
+    # База в памяти у каждого движка своя - читать можно только через основной
+    if engine.url.database and engine.url.database != ":memory:":
+        read_engine = create_async_engine(
+            DATABASE_URL,
+            echo=False,
+            pool_size=SQLITE_READ_POOL_SIZE,
+            max_overflow=0,
+        )
+
+        @event.listens_for(read_engine.sync_engine, "connect")
+        def _on_sqlite_read_connect(dbapi_connection, connection_record):
+            pragmas = {name: value for name, value in SQLITE_PRAGMAS.items() if name != "journal_mode"}
+            # Соединение пула чтения не может случайно изменить данные
+            pragmas["query_only"] = "ON"
+            _apply_sqlite_pragmas(dbapi_connection, pragmas)
+
+read_session = sessionmaker(read_engine, expire_on_commit=False, class_=AsyncSession)
+
 # Блокировка для предотвращения одновременных вызовов init_db
 _init_db_lock = asyncio.Lock()
 _db_initialized = False
 
+# Кэш схемы БД: {имя таблицы: множество колонок}.
+# Заполняется один раз в init_db (по моделям и миграциям), чтобы горячие запросы
+# не выполняли PRAGMA table_info / information_schema при каждом вызове.
+_schema_columns = {}
+
+
+def get_table_columns(table_name: str) -> set:
+    """Возвращает множество колонок таблицы из кэша схемы (пустое, если init_db ещё не выполнялся)"""
+    return _schema_columns.get(table_name, set())
+
+
+def has_column(table_name: str, column_name: str) -> bool:
+    """Проверяет наличие колонки в таблице по кэшу схемы"""
+    return column_name in _schema_columns.get(table_name, ())
+
 
 async def get_session():
     async with async_session() as session:
@@ -39,7 +113,11 @@ async def get_session():
 
 # ✅ Добавляем функцию инициализации базы
 async def init_db():
-    """Создаёт все таблицы, если их ещё нет, и добавляет недостающие колонки"""
+    """
+    Приводит схему БД к актуальной версии (см. migrations.py)
+
+    Если версия схемы актуальна, выполняется только чтение schema_version.
+    """
     global _db_initialized
     
     # Если уже инициализировано, пропускаем
@@ -52,8 +130,7 @@ async def init_db():
         if _db_initialized:
             return
         
-        # Импорт моделей здесь, чтобы они зарегистрировались в Base.metadata
-        from models import User, Channel, Giveaway, Winner, History, Comment, Participant
+        from migrations import read_schema_version, apply_migrations, expected_schema_columns, LATEST_VERSION
         
         # Retry логика с экспоненциальной задержкой для TooManyConnectionsError
         max_retries = 3
@@ -61,333 +138,18 @@ async def init_db():
         
         for attempt in range(max_retries):
             try:
-                async with engine.begin() as conn:
-                    await conn.run_sync(Base.metadata.create_all)
-                    
-                    # Миграция для новых колонок Pro подписки (для PostgreSQL)
-                    if not IS_SQLITE:
-                        try:
-                            result = await conn.execute(text("""
-                                SELECT column_name 
-                                FROM information_schema.columns 
-                                WHERE table_name = 'users'
-                            """))
-                            existing_user_columns = [row[0] for row in result.fetchall()] if result else []
-                            
-                            if 'pro_subscription_start' not in existing_user_columns:
-                                await conn.execute(text("ALTER TABLE users ADD COLUMN pro_subscription_start TIMESTAMP"))
-                                print("✅ Добавлена колонка users.pro_subscription_start (PostgreSQL)")
-                            
-                            if 'pro_subscription_end' not in existing_user_columns:
-                                await conn.execute(text("ALTER TABLE users ADD COLUMN pro_subscription_end TIMESTAMP"))
-                                print("✅ Добавлена колонка users.pro_subscription_end (PostgreSQL)")
-                            
-                            if 'pro_contests_created' not in existing_user_columns:
-                                await conn.execute(text("ALTER TABLE users ADD COLUMN pro_contests_created INTEGER DEFAULT 0"))
-                                print("✅ Добавлена колонка users.pro_contests_created (PostgreSQL)")
-                            
-                            if 'pro_last_topup_required' not in existing_user_columns:
-                                await conn.execute(text("ALTER TABLE users ADD COLUMN pro_last_topup_required BOOLEAN DEFAULT FALSE"))
-                                print("✅ Добавлена колонка users.pro_last_topup_required (PostgreSQL)")
-
-                            # Migrate winners table for PostgreSQL
-                            try:
-                                result = await conn.execute(text("""
-                                    SELECT column_name
-                                    FROM information_schema.columns
-                                    WHERE table_name = 'winners'
-                                """))
-                                existing_winner_columns = [row[0] for row in result.fetchall()] if result else []
-
-                                if 'reroll_count' not in existing_winner_columns:
-                                    await conn.execute(text("ALTER TABLE winners ADD COLUMN reroll_count INTEGER DEFAULT 0"))
-                                    print("✅ Добавлена колонка winners.reroll_count (PostgreSQL)")
-                            except Exception as e:
-                                print(f"⚠️ Migration winners.reroll_count (PostgreSQL) error: {e}")
-                        except Exception as e:
-                            print(f"⚠️ Migration users (PostgreSQL) error: {e}")
-                    
-                    if IS_SQLITE:
-                        # Migrate: add missing columns to existing users table
-                        try:
-                            result = await conn.execute(text("PRAGMA table_info(users)"))
-                            existing_user_columns = [row[1] for row in result.fetchall()] if result else []
-                            
-                            if 'username' not in existing_user_columns:
-                                await conn.execute(text("ALTER TABLE users ADD COLUMN username VARCHAR"))
-                                print("✅ Добавлена колонка users.username")
-                            
-                            if 'channel_link' not in existing_user_columns:
-                                await conn.execute(text("ALTER TABLE users ADD COLUMN channel_link VARCHAR"))
-                                print("✅ Добавлена колонка users.channel_link")
-                            
-                            if 'chat_link' not in existing_user_columns:
-                                await conn.execute(text("ALTER TABLE users ADD COLUMN chat_link VARCHAR"))
-                                print("✅ Добавлена колонка users.chat_link")
-                            
-                            if 'experience' not in existing_user_columns:
-                                await conn.execute(text("ALTER TABLE users ADD COLUMN experience INTEGER DEFAULT 0"))
-                                print("✅ Добавлена колонка users.experience")
-                            
-                            if 'ton_wallet' not in existing_user_columns:
-                                await conn.execute(text("ALTER TABLE users ADD COLUMN ton_wallet VARCHAR"))
-                                print("✅ Добавлена колонка users.ton_wallet")
-                            
-                            if 'purchased_items' not in existing_user_columns:
-                                await conn.execute(text("ALTER TABLE users ADD COLUMN purchased_items TEXT"))
-                                print("✅ Добавлена колонка users.purchased_items")
-                            
-                            if 'pro_subscription_start' not in existing_user_columns:
-                                await conn.execute(text("ALTER TABLE users ADD COLUMN pro_subscription_start DATETIME"))
-                                print("✅ Добавлена колонка users.pro_subscription_start")
-                            
-                            if 'pro_subscription_end' not in existing_user_columns:
-                                await conn.execute(text("ALTER TABLE users ADD COLUMN pro_subscription_end DATETIME"))
-                                print("✅ Добавлена колонка users.pro_subscription_end")
-                            
-                            if 'pro_contests_created' not in existing_user_columns:
-                                await conn.execute(text("ALTER TABLE users ADD COLUMN pro_contests_created INTEGER DEFAULT 0"))
-                                print("✅ Добавлена колонка users.pro_contests_created")
-                            
-                            if 'pro_last_topup_required' not in existing_user_columns:
-                                await conn.execute(text("ALTER TABLE users ADD COLUMN pro_last_topup_required BOOLEAN DEFAULT 0"))
-                                print("✅ Добавлена колонка users.pro_last_topup_required")
-                        except Exception as e:
-                            print(f"⚠️ Migration users error: {e}")
-                        
-                        # Migrate: add missing columns to existing giveaways table
-                        try:
-                            # Try to query table structure
-                            result = await conn.execute(text("PRAGMA table_info(giveaways)"))
-                            existing_giveaway_columns = [row[1] for row in result.fetchall()] if result else []
-                            
-                            if 'name' not in existing_giveaway_columns:
-                                await conn.execute(text("ALTER TABLE giveaways ADD COLUMN name VARCHAR"))
-                                print("✅ Добавлена колонка giveaways.name")
-                            
-                            if 'prize' not in existing_giveaway_columns:
-                                await conn.execute(text("ALTER TABLE giveaways ADD COLUMN prize VARCHAR"))
-                                print("✅ Добавлена колонка giveaways.prize")
-                            
-                            if 'end_date' not in existing_giveaway_columns:
-                                await conn.execute(text("ALTER TABLE giveaways ADD COLUMN end_date DATETIME"))
-                                print("✅ Добавлена колонка giveaways.end_date")
-                            
-                            if 'conditions' not in existing_giveaway_columns:
-                                await conn.execute(text("ALTER TABLE giveaways ADD COLUMN conditions VARCHAR"))
-                                print("✅ Добавлена колонка giveaways.conditions")
-                            
-                            if 'created_by' not in existing_giveaway_columns:
-                                await conn.execute(text("ALTER TABLE giveaways ADD COLUMN created_by INTEGER"))
-                                print("✅ Добавлена колонка giveaways.created_by")
-                            
-                            if 'is_confirmed' not in existing_giveaway_columns:
-                                await conn.execute(text("ALTER TABLE giveaways ADD COLUMN is_confirmed BOOLEAN DEFAULT 0"))
-                                print("✅ Добавлена колонка giveaways.is_confirmed")
-                            
-                            if 'winners_selected_at' not in existing_giveaway_columns:
-                                await conn.execute(text("ALTER TABLE giveaways ADD COLUMN winners_selected_at DATETIME"))
-                                print("✅ Добавлена колонка giveaways.winners_selected_at")
-                            
-                            if 'discussion_group_link' not in existing_giveaway_columns:
-                                await conn.execute(text("ALTER TABLE giveaways ADD COLUMN discussion_group_link VARCHAR"))
-                                print("✅ Добавлена колонка giveaways.discussion_group_link")
-                            
-                            if 'channel_link' not in existing_giveaway_columns:
-                                await conn.execute(text("ALTER TABLE giveaways ADD COLUMN channel_link VARCHAR"))
-                                print("✅ Добавлена колонка giveaways.channel_link")
-                            
-                            if 'start_date' not in existing_giveaway_columns:
-                                await conn.execute(text("ALTER TABLE giveaways ADD COLUMN start_date DATETIME"))
-                                print("✅ Добавлена колонка giveaways.start_date")
-                            
-                            if 'prize_links' not in existing_giveaway_columns:
-                                await conn.execute(text("ALTER TABLE giveaways ADD COLUMN prize_links TEXT"))
-                                print("✅ Добавлена колонка giveaways.prize_links")
-                            
-                            if 'winners_count' not in existing_giveaway_columns:
-                                await conn.execute(text("ALTER TABLE giveaways ADD COLUMN winners_count INTEGER DEFAULT 1"))
-                                print("✅ Добавлена колонка giveaways.winners_count")
-                        except Exception as e:
-                            print(f"⚠️ Migration giveaways error: {e}")
-                        
-                        # Migrate: create messages table if it doesn't exist
-                        try:
-                            result = await conn.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name='messages'"))
-                            messages_table_exists = result.fetchone() is not None
-                            
-                            if not messages_table_exists:
-                                await conn.execute(text("""
-                                    CREATE TABLE messages (
-                                        id INTEGER PRIMARY KEY,
-                                        from_user_id INTEGER NOT NULL,
-                                        to_user_id INTEGER,
-                                        message_text VARCHAR NOT NULL,
-                                        status VARCHAR DEFAULT 'pending',
-                                        created_at DATETIME,
-                                        responded_at DATETIME
-                                    )
-                                """))
-                                print("✅ Создана таблица messages")
-                        except Exception as e:
-                            print(f"⚠️ Migration messages error: {e}")
-                        
-                        # Migrate: create comments table if it doesn't exist
-                        try:
-                            result = await conn.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name='comments'"))
-                            comments_table_exists = result.fetchone() is not None
-                            
-                            if not comments_table_exists:
-                                await conn.execute(text("""
-                                    CREATE TABLE comments (
-                                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                        chat_id VARCHAR NOT NULL,
-                                        post_message_id INTEGER NOT NULL,
-                                        comment_message_id INTEGER NOT NULL,
-                                        comment_chat_id VARCHAR NOT NULL,
-                                        comment_link VARCHAR NOT NULL,
-                                        user_id INTEGER,
-                                        username VARCHAR,
-                                        text VARCHAR,
-                                        created_at DATETIME
-                                    )
-                                """))
-                                # Создаём индексы для быстрого поиска
-                                await conn.execute(text("CREATE INDEX idx_comments_chat_post ON comments(chat_id, post_message_id)"))
-                                await conn.execute(text("CREATE INDEX idx_comments_comment_chat ON comments(comment_chat_id, post_message_id)"))
-                                print("✅ Создана таблица comments с индексами")
-                        except Exception as e:
-                            print(f"⚠️ Migration comments error: {e}")
-                        
-                        # Создаем таблицу participants если её нет
-                        try:
-                            result = await conn.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name='participants'"))
-                            if not result.fetchone():
-                                await conn.execute(text("""
-                                    CREATE TABLE participants (
-                                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                        giveaway_id INTEGER NOT NULL,
-                                        user_id INTEGER NOT NULL,
-                                        username VARCHAR,
-                                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                                        FOREIGN KEY (giveaway_id) REFERENCES giveaways(id)
-                                    )
-                                """))
-                                # Создаем уникальный индекс для предотвращения дубликатов
-                                await conn.execute(text("CREATE UNIQUE INDEX idx_participant_unique ON participants(giveaway_id, user_id)"))
-                                print("✅ Создана таблица participants")
-                        except Exception as e:
-                            print(f"⚠️ Migration participants error: {e}")
-                        
-                        # Migrate: add missing columns to existing winners table
-                        try:
-                            result = await conn.execute(text("PRAGMA table_info(winners)"))
-                            existing_winner_columns = [row[1] for row in result.fetchall()] if result else []
-                            
-                            if 'user_id' not in existing_winner_columns:
-                                await conn.execute(text("ALTER TABLE winners ADD COLUMN user_id INTEGER"))
-                                print("✅ Добавлена колонка winners.user_id")
-                            
-                            if 'user_username' not in existing_winner_columns:
-                                await conn.execute(text("ALTER TABLE winners ADD COLUMN user_username VARCHAR"))
-                                print("✅ Добавлена колонка winners.user_username")
-                            
-                            if 'prize_link' not in existing_winner_columns:
-                                await conn.execute(text("ALTER TABLE winners ADD COLUMN prize_link VARCHAR"))
-                                print("✅ Добавлена колонка winners.prize_link")
-                            
-                            if 'place' not in existing_winner_columns:
-                                await conn.execute(text("ALTER TABLE winners ADD COLUMN place INTEGER"))
-                                print("✅ Добавлена колонка winners.place")
-                            
-                            # Делаем comment_link nullable (для конкурса рисунков)
-                            # SQLite не поддерживает изменение NOT NULL на NULL напрямую, но если колонка уже nullable, ничего не делаем
-                            # Если нужно изменить существующую колонку, это требует пересоздания таблицы
-                            # Но так как мы уже указали nullable=True в модели, новые таблицы будут созданы правильно
-                            # Для существующих таблиц нужно проверить, есть ли уже колонка photo_link
-                            
-                            if 'photo_link' not in existing_winner_columns:
-                                await conn.execute(text("ALTER TABLE winners ADD COLUMN photo_link VARCHAR"))
-                                print("✅ Добавлена колонка winners.photo_link")
-                            
-                            if 'photo_message_id' not in existing_winner_columns:
-                                await conn.execute(text("ALTER TABLE winners ADD COLUMN photo_message_id INTEGER"))
-                                print("✅ Добавлена колонка winners.photo_message_id")
-
-                            if 'reroll_count' not in existing_winner_columns:
-                                await conn.execute(text("ALTER TABLE winners ADD COLUMN reroll_count INTEGER DEFAULT 0"))
-                                print("✅ Добавлена колонка winners.reroll_count")
-                        except Exception as e:
-                            print(f"⚠️ Migration winners error: {e}")
-                        
-                        # Migrate: add missing columns to existing participants table
-                        try:
-                            result = await conn.execute(text("PRAGMA table_info(participants)"))
-                            existing_participant_columns = [row[1] for row in result.fetchall()] if result else []
-                            
-                            if 'photo_link' not in existing_participant_columns:
-                                await conn.execute(text("ALTER TABLE participants ADD COLUMN photo_link VARCHAR"))
-                                print("✅ Добавлена колонка participants.photo_link")
-                            
-                            if 'photo_message_id' not in existing_participant_columns:
-                                await conn.execute(text("ALTER TABLE participants ADD COLUMN photo_message_id INTEGER"))
-                                print("✅ Добавлена колонка participants.photo_message_id")
-                            
-                            # Проверяем, существует ли уникальный индекс на (giveaway_id, user_id)
-                            try:
-                                index_result = await conn.execute(text("""
-                                    SELECT name FROM sqlite_master 
-                                    WHERE type='index' 
-                                    AND name='idx_participant_unique'
-                                """))
-                                if not index_result.fetchone():
-                                    # Если индекс не существует, создаем его
-                                    await conn.execute(text("CREATE UNIQUE INDEX idx_participant_unique ON participants(giveaway_id, user_id)"))
-                                    print("✅ Создан уникальный индекс idx_participant_unique на participants(giveaway_id, user_id)")
-                            except Exception as e:
-                                print(f"⚠️ Ошибка при создании уникального индекса: {e}")
-                        except Exception as e:
-                            print(f"⚠️ Migration participants error: {e}")
-                        
-                        # Migrate: add missing columns to existing giveaways table (contest_type, submission_end_date, jury)
-                        try:
-                            # Получаем список существующих колонок (разные запросы для SQLite и PostgreSQL)
-                            if IS_SQLITE:
-                                result = await conn.execute(text("PRAGMA table_info(giveaways)"))
-                                existing_giveaway_columns = [row[1] for row in result.fetchall()] if result else []
-                            else:
-                                # Для PostgreSQL
-                                result = await conn.execute(text("""
-                                    SELECT column_name 
-                                    FROM information_schema.columns 
-                                    WHERE table_name = 'giveaways'
-                                """))
-                                existing_giveaway_columns = [row[0] for row in result.fetchall()] if result else []
-                            
-                            if 'contest_type' not in existing_giveaway_columns:
-                                await conn.execute(text("ALTER TABLE giveaways ADD COLUMN contest_type VARCHAR DEFAULT 'random_comment'"))
-                                print("✅ Добавлена колонка giveaways.contest_type")
-                            
-                            if 'submission_end_date' not in existing_giveaway_columns:
-                                if IS_SQLITE:
-                                    await conn.execute(text("ALTER TABLE giveaways ADD COLUMN submission_end_date DATETIME"))
-                                else:
-                                    await conn.execute(text("ALTER TABLE giveaways ADD COLUMN submission_end_date TIMESTAMP"))
-                                print("✅ Добавлена колонка giveaways.submission_end_date")
-                            
-                            if 'jury' not in existing_giveaway_columns:
-                                # Для SQLite JSON хранится как TEXT, для PostgreSQL как JSONB
-                                if IS_SQLITE:
-                                    await conn.execute(text("ALTER TABLE giveaways ADD COLUMN jury TEXT"))
-                                else:
-                                    await conn.execute(text("ALTER TABLE giveaways ADD COLUMN jury JSONB"))
-                                print("✅ Добавлена колонка giveaways.jury")
-                        except Exception as e:
-                            print(f"⚠️ Migration giveaways (contest_type, submission_end_date, jury) error: {e}")
+                version = await read_schema_version(engine)
+                if version < LATEST_VERSION:
+                    print(f"🔄 Схема БД версии {version}, применяются миграции до {LATEST_VERSION}")
+                    version = await apply_migrations(engine)
+                
+                # При актуальной версии структура таблиц известна из моделей и миграций
+                _schema_columns.clear()
+                _schema_columns.update(expected_schema_columns())
                 
                 # Если успешно, помечаем как инициализированную
                 _db_initialized = True
-                print("✅ База данных инициализирована")
+                print(f"✅ База данных инициализирована (версия схемы {version})")
                 return
                 
             except Exception as e:
@@ -39,12 +39,28 @@ FILES=(
     "bot.py"
     "web_server.py"
     "db.py"
+    "migrations.py"
+    "payments.py"
+    "ledger.py"
+    "user_items.py"
+    "auth_session.py"
+    "webapp_auth.py"
     "models.py"
     "config.py"
     "helpers.py"
     "giveaway.py"
     "creator.py"
     "cryptobot.py"
+    "cache.py"
+    "drawing_votes.py"
+    "contest_events.py"
+    "image_pipeline.py"
+    "blob_store.py"
+    "telegram_sender.py"
+    "shared_state.py"
+    "telegram_webhook.py"
+    "fake_updates.py"
+    "build_static.py"
     "collection.py"
     "picture.py"
     "post_parser.py"
@@ -147,7 +163,8 @@ echo "4. Активируйте его: source venv/bin/activate"
 echo "5. Установите зависимости: pip install -r requirements.txt"
 echo "6. Настройте .env файл (BOT_TOKEN, CREATOR_ID, WEBAPP_URL)"
 echo "7. Создайте SSL сертификат: python generate_ssl.py ваш_ip"
-echo "8. Запустите бота: python bot.py"
+echo "8. Соберите статику (сжатие и кэширование): python build_static.py"
+echo "9. Запустите бота: python bot.py"
 echo ""
 echo -e "${GREEN}📚 Подробные инструкции в файле DEPLOYMENT.md${NC}"
 
@@ -0,0 +1,347 @@
+"""
+Буфер голосов конкурсов рисунков и коллекций и индексы голосования
+
+Голоса не переписывают drawing_contests.json / collection_contests.json при каждой оценке:
+- каждый голос дописывается строкой в журнал (append-only JSONL)
+- для проверки повторной оценки, подсчёта оставшихся работ и выдачи очереди
+  голосования используется индекс в памяти (VoteIndex): владельцы работ,
+  отсортированная очередь, оценки по голосующим и текущие суммы/количества
+  оценок по работам (для итогов и таблицы лидеров без перебора голосов)
+- журнал периодически "сжимается" в основной документ и очищается
+
+Запись голоса в документе - присваивание work[category][str(user_id)] = score,
+поэтому повторное применение журнала к документу безопасно.
+Журнал конкурса рисунков ссылается на работы по work_number, коллекций - по
+collection_number (см. VoteLog.for_drawing / VoteLog.for_collection).
+"""
+import bisect
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Категории голосов в документе работы
+VOTE_CATEGORIES = ("jury_votes", "audience_votes", "votes")
+
+
+def parse_score(score):
+    """Оценка из документа как int (пустые и некорректные значения не учитываются)"""
+    if not score:
+        return None
+    try:
+        return int(score)
+    except (TypeError, ValueError):
+        return None
+
+
+def average_score(score_sum: int, count: int) -> float:
+    return round(score_sum / count, 2) if count else 0.0
+
+
+def rank_results(results: list, number_key: str) -> list:
+    """
+    Сортирует результаты по среднему баллу и проставляет места (in-place)
+
+    Общая функция ранжирования для итогов конкурсов рисунков и коллекций.
+    При равном среднем балле выше работа с большим числом оценок, затем -
+    отправленная раньше (меньший номер). Места идут подряд (1, 2, 3, ...),
+    чтобы каждому месту соответствовал один приз.
+    """
+    results.sort(key=lambda r: (-r["average_score"], -r["votes_count"], r.get(number_key) or 0))
+    for idx, result in enumerate(results):
+        result["place"] = idx + 1
+    return results
+
+
+class VoteLog:
+    """
+    Журнал ещё не сжатых в документ голосов
+
+    Args:
+        path: Путь к файлу журнала (JSONL)
+        items_key: Ключ списка работ конкурса в документе ("works", "collections")
+        number_key: Ключ номера работы ("work_number", "collection_number")
+        categories: Допустимые категории голосов
+
+    Журнал могут дописывать несколько процессов (под общей блокировкой документа):
+    при каждом обращении дочитываются только новые строки после запомненного
+    смещения, а после сжатия (файл заменён - сменился inode) журнал читается заново.
+    """
+
+    def __init__(self, path: str, items_key: str, number_key: str, categories: tuple):
+        self.path = path
+        self.items_key = items_key
+        self.number_key = number_key
+        self.categories = categories
+        self._pending = None
+        self._offset = 0
+        self._inode = None
+        # Записи других процессов, ещё не отданные через refresh()
+        self._unseen = []
+
+    @classmethod
+    def for_drawing(cls, path: str) -> "VoteLog":
+        return cls(path, "works", "work_number", VOTE_CATEGORIES)
+
+    @classmethod
+    def for_collection(cls, path: str) -> "VoteLog":
+        return cls(path, "collections", "collection_number", ("votes",))
+
+    def _read_tail(self) -> list:
+        entries = []
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        # Незаконченную последнюю строку (её ещё дописывают) оставляем на следующий раз
+        complete = data[:data.rfind(b"\n") + 1]
+        self._offset += len(complete)
+        for line in complete.decode("utf-8", errors="replace").splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Оборванная строка (например, после сбоя) - пропускаем
+                logger.warning(f"Пропущена повреждённая строка журнала голосов: {line[:100]}")
+        return entries
+
+    def _load(self) -> list:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None
+        except Exception as e:
+            logger.error(f"Не удалось прочитать журнал голосов {self.path}: {e}")
+            return self._pending if self._pending is not None else []
+
+        if self._pending is None or stat is None or stat.st_ino != self._inode or stat.st_size < self._offset:
+            # Первое чтение или журнал сжат/заменён - читаем с начала
+            self._pending = []
+            self._offset = 0
+            self._inode = stat.st_ino if stat else None
+        if stat is None or stat.st_size == self._offset:
+            return self._pending
+        try:
+            entries = self._read_tail()
+        except Exception as e:
+            logger.error(f"Не удалось прочитать журнал голосов {self.path}: {e}")
+            return self._pending
+        self._pending.extend(entries)
+        self._unseen.extend(entries)
+        return self._pending
+
+    def pending(self) -> list:
+        return self._load()
+
+    def refresh(self) -> list:
+        """Дочитывает журнал и возвращает записи, которые ещё не отдавались (в т.ч. других процессов)"""
+        self._load()
+        entries, self._unseen = self._unseen, []
+        return entries
+
+    def append(self, contest_id: int, number: int, category: str, user_id: int, score: int) -> None:
+        entry = {
+            "contest_id": contest_id,
+            self.number_key: number,
+            "category": category,
+            "user_id": user_id,
+            "score": score,
+        }
+        pending = self._load()
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            self._offset = f.tell()
+        if self._inode is None:
+            self._inode = os.stat(self.path).st_ino
+        pending.append(entry)
+
+    def apply(self, data: dict) -> dict:
+        """Применяет несжатые голоса к документу конкурсов (in-place) и возвращает его"""
+        pending = self._load()
+        if not pending:
+            return data
+        works_by_contest = {}
+        for entry in pending:
+            contest_key = str(entry.get("contest_id"))
+            if contest_key not in works_by_contest:
+                contest_entry = data.get(contest_key) or {}
+                works_by_contest[contest_key] = {
+                    w.get(self.number_key): w for w in contest_entry.get(self.items_key, [])
+                }
+            work = works_by_contest[contest_key].get(entry.get(self.number_key))
+            if work is None:
+                # Работа удалена (отменена) после голосования
+                continue
+            category = entry.get("category")
+            if category not in self.categories:
+                continue
+            votes = work.get(category)
+            if not isinstance(votes, dict):
+                votes = {}
+                work[category] = votes
+            votes[str(entry.get("user_id"))] = entry.get("score")
+        return data
+
+    def clear(self) -> None:
+        """
+        Очищает журнал (вызывается под блокировкой документа)
+
+        Журнал заменяется новым пустым файлом, а не обрезается на месте: другие
+        процессы замечают сжатие по смене inode, даже если после него в журнал
+        уже дописали больше, чем они успели прочитать.
+        """
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8"):
+                pass
+            os.replace(tmp_path, self.path)
+            self._inode = os.stat(self.path).st_ino
+        except Exception as e:
+            logger.error(f"Не удалось очистить журнал голосов {self.path}: {e}")
+            return
+        self._pending = []
+        self._offset = 0
+        self._unseen = []
+
+
+class VoteIndex:
+    """
+    Индекс голосования одного конкурса (рисунков или коллекций)
+
+    Хранит владельцев работ, очередь работ для голосования (отсортирована один раз
+    при построении) и для каждой пары (категория, голосующий) оценки пользователя
+    по номерам работ. Проверка повторной оценки и подсчёт оставшихся работ - O(1),
+    страница очереди - O(размер страницы + пропущенные оценённые работы).
+
+    Для каждой пары (категория, работа) поддерживается сумма и количество оценок
+    (totals), поэтому средний балл работы считается без перебора голосов.
+    """
+
+    def __init__(self, items: list, number_key: str, categories: tuple, is_queueable, payload=None):
+        self.number_key = number_key
+        self.categories = categories
+        self.work_owners = {}
+        self.owned_counts = {}
+        self.rated = {}
+        self.payloads = {}
+        self.totals = {}
+        queue = []
+        for item in items:
+            number = item.get(number_key)
+            owner = item.get("participant_user_id")
+            self.work_owners[number] = owner
+            self.owned_counts[owner] = self.owned_counts.get(owner, 0) + 1
+            for category in categories:
+                for voter, score in (item.get(category) or {}).items():
+                    self.rated.setdefault((category, str(voter)), {})[number] = score
+                    self._add_to_totals(category, number, score, 1)
+            if is_queueable(item):
+                queue.append(number)
+                if payload:
+                    self.payloads[number] = payload(item)
+        self.queue = sorted(queue)
+
+    @classmethod
+    def for_drawing(cls, works: list) -> "VoteIndex":
+        return cls(
+            works,
+            "work_number",
+            VOTE_CATEGORIES,
+            lambda w: bool(w.get("work_number") and w.get("local_path") and w.get("participant_user_id")),
+            payload=lambda w: {"local_path": w.get("local_path"), "derivatives": w.get("derivatives") or {}},
+        )
+
+    @classmethod
+    def for_collection(cls, collections: list) -> "VoteIndex":
+        return cls(
+            collections,
+            "collection_number",
+            ("votes",),
+            lambda c: bool(
+                c.get("collection_number") and c.get("participant_user_id")
+                and c.get("nft_links") and len(c.get("nft_links")) == 9
+            ),
+            payload=lambda c: {"nft_links": c.get("nft_links", [])},
+        )
+
+    def has_work(self, work_number: int) -> bool:
+        return work_number in self.work_owners
+
+    def work_owner(self, work_number: int):
+        return self.work_owners.get(work_number)
+
+    def is_rated(self, category: str, user_id: int, work_number: int) -> bool:
+        return work_number in self.rated.get((category, str(user_id)), ())
+
+    def _add_to_totals(self, category: str, work_number: int, score, sign: int) -> None:
+        score = parse_score(score)
+        if score is None:
+            return
+        total = self.totals.setdefault((category, work_number), [0, 0])
+        total[0] += sign * score
+        total[1] += sign
+
+    def add_vote(self, category: str, user_id: int, work_number: int, score: int) -> None:
+        user_ratings = self.rated.setdefault((category, str(user_id)), {})
+        if work_number in user_ratings:
+            # Повторная запись голоса заменяет старую оценку
+            self._add_to_totals(category, work_number, user_ratings[work_number], -1)
+        user_ratings[work_number] = score
+        self._add_to_totals(category, work_number, score, 1)
+
+    def aggregate(self, category: str, work_number: int) -> tuple:
+        """Возвращает (сумма оценок, количество оценок) работы в категории"""
+        total = self.totals.get((category, work_number))
+        return (total[0], total[1]) if total else (0, 0)
+
+    def standings(self, category: str) -> list:
+        """
+        Текущая таблица лидеров категории по работам из очереди голосования
+
+        Returns:
+            list: [{<number_key>, "average_score", "votes_count", "place"}, ...]
+        """
+        results = []
+        for number in self.queue:
+            score_sum, count = self.aggregate(category, number)
+            results.append({
+                self.number_key: number,
+                "average_score": average_score(score_sum, count),
+                "votes_count": count,
+            })
+        return rank_results(results, self.number_key)
+
+    def remaining(self, category: str, user_id: int) -> int:
+        """Сколько работ (кроме собственных) пользователь ещё не оценил в категории"""
+        eligible = len(self.work_owners) - self.owned_counts.get(user_id, 0)
+        return max(0, eligible - len(self.rated.get((category, str(user_id)), ())))
+
+    def queue_page(self, category: str, user_id: int, cursor: int = None, limit: int = None,
+                   unrated_only: bool = False) -> tuple:
+        """
+        Возвращает страницу очереди голосования пользователя
+
+        Args:
+            cursor: номер работы, после которой начинается страница
+            limit: размер страницы (None - вся очередь)
+            unrated_only: только ещё не оценённые работы ("следующая неоценённая")
+
+        Returns:
+            tuple: ([(номер работы, оценка пользователя или None), ...], номер следующей работы или None)
+        """
+        user_ratings = self.rated.get((category, str(user_id)), {})
+        start = bisect.bisect_right(self.queue, cursor) if cursor is not None else 0
+        page = []
+        for position in range(start, len(self.queue)):
+            number = self.queue[position]
+            # Пропускаем собственную работу пользователя
+            if self.work_owners.get(number) == user_id:
+                continue
+            if unrated_only and number in user_ratings:
+                continue
+            if limit is not None and len(page) >= limit:
+                return page, number
+            page.append((number, user_ratings.get(number)))
+        return page, None
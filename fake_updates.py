@@ -0,0 +1,161 @@
+"""
+Генератор фейковых обновлений Telegram для нагрузочной проверки приёма обновлений
+
+Два режима:
+    python fake_updates.py dispatcher --count 20000 --workers 8 [--handler-delay 0.005]
+        обновления подаются прямо в WebhookUpdateQueue с диспетчером aiogram и
+        обработчиками-заглушками (без сети и без Telegram) - пропускная
+        способность очереди и диспетчера
+
+    python fake_updates.py http --url http://127.0.0.1:8000/telegram/webhook --secret SECRET --count 5000
+        обновления отправляются POST-запросами на webhook запущенного бота
+        (BOT_UPDATES_MODE=webhook, WEBHOOK_SECRET=SECRET); обработчики бота
+        будут обращаться к Telegram API и БД, поэтому запускайте на тестовом боте
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+
+# Токен правильного формата для режима dispatcher (запросы к Telegram не выполняются)
+FAKE_BOT_TOKEN = "123456789:AAFakeTokenForLoadTestingOnly000000000"
+
+_update_ids = itertools.count(1)
+
+
+def fake_message_update(user_id: int, text: str = "/start") -> dict:
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": "Load"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Load", "username": f"load_{user_id}"},
+            "text": text,
+        },
+    }
+
+
+def fake_callback_update(user_id: int, data: str = "check_subscription") -> dict:
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": str(user_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "Load", "username": f"load_{user_id}"},
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private", "first_name": "Load"},
+                "text": "fake",
+            },
+            "data": data,
+        },
+    }
+
+
+def fake_updates(count: int, users: int, callback_share: float = 0.3):
+    """Смесь сообщений и нажатий кнопок от users разных пользователей"""
+    for _ in range(count):
+        user_id = random.randint(1, users) + 10_000_000
+        if random.random() < callback_share:
+            yield fake_callback_update(user_id)
+        else:
+            yield fake_message_update(user_id)
+
+
+async def run_dispatcher_benchmark(count: int, workers: int, queue_size: int, users: int, handler_delay: float) -> None:
+    from aiogram import Bot, Dispatcher, types
+    from telegram_webhook import WebhookUpdateQueue
+
+    bot = Bot(token=FAKE_BOT_TOKEN)
+    dp = Dispatcher(bot)
+    handled = {"messages": 0, "callbacks": 0}
+
+    async def on_message(message: types.Message):
+        handled["messages"] += 1
+        if handler_delay:
+            await asyncio.sleep(handler_delay)
+
+    async def on_callback(callback_query: types.CallbackQuery):
+        handled["callbacks"] += 1
+        if handler_delay:
+            await asyncio.sleep(handler_delay)
+
+    dp.register_message_handler(on_message)
+    dp.register_callback_query_handler(on_callback)
+
+    update_queue = WebhookUpdateQueue(dp, workers=workers, queue_size=queue_size)
+    update_queue.start()
+    started = time.perf_counter()
+    for update_data in fake_updates(count, users):
+        # Как и webhook-эндпоинт, не ждём места в очереди: при переполнении - отказ (503)
+        while not update_queue.put_nowait(update_data):
+            await asyncio.sleep(0)
+    await update_queue.queue.join()
+    elapsed = time.perf_counter() - started
+    await update_queue.stop()
+    session = await bot.get_session()
+    if session:
+        await session.close()
+
+    print(f"Обработано: {update_queue.processed} (ошибок: {update_queue.failed}, "
+          f"отказов при заполненной очереди: {update_queue.rejected})")
+    print(f"Сообщений: {handled['messages']}, нажатий: {handled['callbacks']}")
+    print(f"Время: {elapsed:.2f} с, {update_queue.processed / elapsed:.0f} обновлений/с")
+
+
+async def run_http_load(url: str, secret: str, count: int, concurrency: int, users: int) -> None:
+    import aiohttp
+    from telegram_webhook import SECRET_HEADER
+
+    statuses = {}
+    updates = iter(fake_updates(count, users))
+
+    async def sender(session):
+        for update_data in updates:
+            try:
+                async with session.post(url, json=update_data, headers={SECRET_HEADER: secret}) as response:
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+            except aiohttp.ClientError as e:
+                statuses[type(e).__name__] = statuses.get(type(e).__name__, 0) + 1
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(sender(session) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    print(f"Отправлено: {count} за {elapsed:.2f} с, {count / elapsed:.0f} запросов/с")
+    print(f"Ответы: {statuses}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Фейковые обновления Telegram для нагрузочной проверки")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    dispatcher_parser = subparsers.add_parser("dispatcher", help="очередь и диспетчер в этом процессе")
+    dispatcher_parser.add_argument("--count", type=int, default=20000)
+    dispatcher_parser.add_argument("--workers", type=int, default=8)
+    dispatcher_parser.add_argument("--queue-size", type=int, default=1000)
+    dispatcher_parser.add_argument("--users", type=int, default=5000)
+    dispatcher_parser.add_argument("--handler-delay", type=float, default=0.0,
+                                   help="имитация I/O в обработчике, секунды")
+
+    http_parser = subparsers.add_parser("http", help="POST-запросы на webhook запущенного бота")
+    http_parser.add_argument("--url", required=True)
+    http_parser.add_argument("--secret", required=True)
+    http_parser.add_argument("--count", type=int, default=5000)
+    http_parser.add_argument("--concurrency", type=int, default=50)
+    http_parser.add_argument("--users", type=int, default=5000)
+
+    args = parser.parse_args()
+    if args.mode == "dispatcher":
+        asyncio.run(run_dispatcher_benchmark(args.count, args.workers, args.queue_size, args.users, args.handler_delay))
+    else:
+        asyncio.run(run_http_load(args.url, args.secret, args.count, args.concurrency, args.users))
+
+
+if __name__ == "__main__":
+    main()
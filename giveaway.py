@@ -1,13 +1,15 @@
 from aiogram import Dispatcher, types, Bot
 from aiogram.types import Message
 from aiogram.utils.exceptions import ChatNotFound, MessageNotModified
-from db import get_session, async_session, IS_SQLITE
+from db import get_session, async_session, IS_SQLITE, init_db, has_column
 from models import Giveaway, Winner, Comment
 from telethon_comments import collect_comments_via_telethon, get_comments_file_path, pick_random_winners_from_file
 from helpers import log_action
+from cache import profile_stats_cache
+from telegram_sender import outbound_queue, photo_file_id_from_link
 from post_parser import parse_telegram_link, parse_telegram_chat_link, get_message_link
 from sqlalchemy.future import select
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, literal_column
 from config import BOT_TOKEN, TELEGRAM_API_ID, TELEGRAM_API_HASH
 from datetime import datetime, timezone
 import logging
@@ -326,6 +328,8 @@ async def fetch_all_comments_from_discussion_group(
                 if saved_count > 0:
                     await db_session.commit()
                     logger.info(f"💾 Telethon: Финальный коммит: сохранено {saved_count} комментариев")
+                    # Комментарии - участия в рандом соо: сбрасываем кэш статистики профилей
+                    profile_stats_cache.clear()
             
             logger.info(f"✅ Telethon: Сбор завершен. Сохранено {saved_count} комментариев")
             return saved_count
@@ -978,7 +982,17 @@ async def reroll_single_winner(contest_id: int, old_winner_link: str, bot: Bot)
             }
 
 
-async def award_experience_for_contest(contest_id: int, session) -> None:
+# Размер пачки для запросов с IN (...): SQLite ограничивает число bind-параметров
+BULK_CHUNK_SIZE = 500
+
+
+def _chunked(items: list, size: int = BULK_CHUNK_SIZE):
+    """Разбивает список на пачки фиксированного размера"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+async def award_experience_for_contest(contest_id: int, session) -> dict:
     """
     Начисляет опыт пользователям за участие и победы в конкурсе
     
@@ -989,8 +1003,18 @@ async def award_experience_for_contest(contest_id: int, session) -> None:
     - Рисунки/Коллекции (drawing/collection):
       * Победы: 1 место - 50, 2 место - 40, 3 место - 30, 4+ место - 20
       * Участие: 5 опыта (для всех участников, которые не победили)
+    
+    Начисление выполняется пачками: один запрос на поиск существующих пользователей
+    и по одному UPDATE на каждое значение опыта (вместо запроса на каждого участника).
+    
+    Замер на 50 000 участников: python bench_experience.py
+    
+    Returns:
+        dict: {telegram_id: начисленный опыт} для пользователей, которым начислен опыт
+        (confirm_winners записывает итог в журнал действий)
     """
     from models import User, Winner, Participant
+    from sqlalchemy import update, func
     
     # Получаем конкурс
     result = await session.execute(
@@ -1000,7 +1024,7 @@ async def award_experience_for_contest(contest_id: int, session) -> None:
     
     if not giveaway:
         logger.warning(f"Конкурс {contest_id} не найден для начисления опыта")
-        return
+        return {}
     
     contest_type = getattr(giveaway, 'contest_type', 'random_comment')
     
@@ -1028,68 +1052,45 @@ async def award_experience_for_contest(contest_id: int, session) -> None:
         }
         participation_experience = 5
     
-    # Начисляем опыт победителям
-    winner_user_ids = set()
+    # Для рандом соо одним запросом находим user_id победителей без user_id по comment_link
+    comment_user_ids = {}
+    if contest_type == 'random_comment':
+        missing_links = [w.comment_link for w in winners if w.place and not w.user_id and w.comment_link]
+        for chunk in _chunked(missing_links):
+            comments_result = await session.execute(
+                select(Comment.comment_link, Comment.user_id).where(
+                    Comment.comment_link.in_(chunk),
+                    Comment.user_id.isnot(None)
+                )
+            )
+            for comment_link, comment_user_id in comments_result.all():
+                comment_user_ids.setdefault(comment_link, comment_user_id)
+    
+    # Опыт победителей (до проверки наличия пользователя в боте)
+    winner_deltas = {}
     for winner in winners:
         if not winner.place:
             continue
-            
-        # Определяем user_id победителя
-        user_id = None
         
-        if contest_type == 'random_comment':
-            # Для рандом соо проверяем user_id из Winner или извлекаем из comment_link через Comment
-            if winner.user_id:
-                user_id = winner.user_id
-            elif winner.comment_link:
-                # Пытаемся найти user_id в таблице Comment
-                from models import Comment as CommentModel
-                comment_result = await session.execute(
-                    select(CommentModel).where(CommentModel.comment_link == winner.comment_link)
-                )
-                comment = comment_result.scalars().first()
-                if comment and comment.user_id:
-                    user_id = comment.user_id
-                    # Обновляем Winner с найденным user_id
-                    winner.user_id = user_id
-        else:
-            # Для рисунков/коллекций используем user_id из Winner
-            user_id = winner.user_id
+        user_id = winner.user_id
+        if not user_id and contest_type == 'random_comment' and winner.comment_link:
+            user_id = comment_user_ids.get(winner.comment_link)
+            if user_id:
+                # Обновляем Winner с найденным user_id
+                winner.user_id = user_id
         
         if not user_id:
             logger.warning(f"Не найден user_id для победителя {winner.id} конкурса {contest_id}")
             continue
         
-        # Проверяем, есть ли пользователь в боте
-        user_result = await session.execute(
-            select(User).where(User.telegram_id == user_id)
-        )
-        user = user_result.scalars().first()
-        
-        if not user:
-            logger.info(f"Пользователь {user_id} не найден в боте, пропускаем начисление опыта")
-            continue
-        
-        winner_user_ids.add(user_id)
-        
-        # Определяем опыт за место
-        place = winner.place
-        if place in experience_by_place:
-            experience = experience_by_place[place]
-        else:
-            # Для мест 4+ используем меньшее значение
-            experience = 40 if contest_type == 'random_comment' else 20
-        
-        # Начисляем опыт
-        if user.experience is None:
-            user.experience = 0
-        user.experience += experience
-        logger.info(f"✅ Начислено {experience} опыта пользователю {user_id} (место {place}) в конкурсе {contest_id}")
+        # Для мест 4+ используем меньшее значение
+        default_experience = 40 if contest_type == 'random_comment' else 20
+        winner_deltas[user_id] = winner_deltas.get(user_id, 0) + experience_by_place.get(winner.place, default_experience)
     
-    # Начисляем опыт за участие (для всех участников, которые не победили)
+    # Участники (для всех, кто не победил)
+    participant_ids = set()
     if contest_type == 'random_comment':
         # Для рандом соо начисляем опыт всем, кто оставил комментарий (из таблицы Comment)
-        # Получаем post_link для поиска комментариев
         if giveaway.post_link:
             parsed = parse_telegram_link(giveaway.post_link)
             if parsed:
@@ -1099,76 +1100,69 @@ async def award_experience_for_contest(contest_id: int, session) -> None:
                 if channel_id_str.startswith('@'):
                     channel_id_str = channel_id_str[1:]  # Убираем @
                 
-                # Ищем все комментарии к этому посту
                 # Пробуем разные варианты channel_id
-                from models import Comment as CommentModel
                 comments_result = await session.execute(
-                    select(CommentModel).where(
+                    select(Comment.user_id).distinct().where(
                         and_(
                             or_(
-                                CommentModel.chat_id == channel_id_str,
-                                CommentModel.chat_id == str(channel_id),
-                                CommentModel.chat_id == f"@{channel_id_str}"
+                                Comment.chat_id == channel_id_str,
+                                Comment.chat_id == str(channel_id),
+                                Comment.chat_id == f"@{channel_id_str}"
                             ),
-                            CommentModel.post_message_id == post_message_id
+                            Comment.post_message_id == post_message_id,
+                            Comment.user_id.isnot(None)
                         )
                     )
                 )
-                comments = comments_result.scalars().all()
-                
-                for comment in comments:
-                    if not comment.user_id:
-                        continue
-                    
-                    # Пропускаем победителей (они уже получили опыт)
-                    if comment.user_id in winner_user_ids:
-                        continue
-                    
-                    # Проверяем, есть ли пользователь в боте
-                    user_result = await session.execute(
-                        select(User).where(User.telegram_id == comment.user_id)
-                    )
-                    user = user_result.scalars().first()
-                    
-                    if not user:
-                        logger.info(f"Пользователь {comment.user_id} не найден в боте, пропускаем начисление опыта за участие")
-                        continue
-                    
-                    # Начисляем опыт за участие
-                    if user.experience is None:
-                        user.experience = 0
-                    user.experience += participation_experience
-                    logger.info(f"✅ Начислено {participation_experience} опыта за участие пользователю {comment.user_id} в конкурсе {contest_id}")
+                participant_ids = set(comments_result.scalars().all())
     
     elif contest_type in ['drawing', 'collection']:
         # Для конкурсов рисунков/коллекций начисляем опыт всем участникам
         participants_result = await session.execute(
-            select(Participant).where(Participant.giveaway_id == contest_id)
+            select(Participant.user_id).where(Participant.giveaway_id == contest_id)
         )
-        participants = participants_result.scalars().all()
-        
-        for participant in participants:
-            if participant.user_id in winner_user_ids:
-                # Победители уже получили опыт, пропускаем
-                continue
-            
-            # Проверяем, есть ли пользователь в боте
-            user_result = await session.execute(
-                select(User).where(User.telegram_id == participant.user_id)
+        participant_ids = set(participants_result.scalars().all())
+    
+    candidate_deltas = dict(winner_deltas)
+    for user_id in participant_ids:
+        # Победители уже получили опыт за место
+        if user_id not in candidate_deltas:
+            candidate_deltas[user_id] = participation_experience
+    
+    # Одним запросом (по пачкам) находим пользователей, которые есть в боте
+    existing_ids = set()
+    candidate_ids = list(candidate_deltas.keys())
+    for chunk in _chunked(candidate_ids):
+        users_result = await session.execute(
+            select(User.telegram_id).where(User.telegram_id.in_(chunk))
+        )
+        existing_ids.update(users_result.scalars().all())
+    
+    deltas = {user_id: delta for user_id, delta in candidate_deltas.items() if user_id in existing_ids}
+    skipped = len(candidate_deltas) - len(deltas)
+    if skipped:
+        logger.info(f"Пропущено {skipped} пользователей конкурса {contest_id}, которых нет в боте")
+    
+    # Группируем по величине опыта: значений мало (места + участие), поэтому UPDATE'ов тоже мало
+    ids_by_delta = {}
+    for user_id, delta in deltas.items():
+        ids_by_delta.setdefault(delta, []).append(user_id)
+    
+    for delta, user_ids in ids_by_delta.items():
+        for chunk in _chunked(user_ids):
+            await session.execute(
+                update(User)
+                .where(User.telegram_id.in_(chunk))
+                .values(experience=func.coalesce(User.experience, 0) + delta)
+                .execution_options(synchronize_session=False)
             )
-            user = user_result.scalars().first()
-            
-            if not user:
-                continue
-            
-            # Начисляем опыт за участие
-            if user.experience is None:
-                user.experience = 0
-            user.experience += participation_experience
-            logger.info(f"✅ Начислено {participation_experience} опыта за участие пользователю {participant.user_id} в конкурсе {contest_id}")
     
     await session.commit()
-    logger.info(f"✅ Опыт начислен для конкурса {contest_id}")
+    logger.info(
+        f"✅ Опыт начислен для конкурса {contest_id}: победителей {len([u for u in winner_deltas if u in existing_ids])}, "
+        f"всего пользователей {len(deltas)}"
+    )
+    return deltas
 
 
 async def confirm_winners(contest_id: int) -> bool:
@@ -1188,15 +1182,20 @@ async def confirm_winners(contest_id: int) -> bool:
             return True  # Уже подтвержден
         
         # Начисляем опыт перед подтверждением
+        experience_deltas = {}
         try:
-            await award_experience_for_contest(contest_id, session)
+            experience_deltas = await award_experience_for_contest(contest_id, session)
         except Exception as e:
             logger.error(f"Ошибка при начислении опыта для конкурса {contest_id}: {e}", exc_info=True)
             # Продолжаем подтверждение даже если начисление опыта не удалось
         
         giveaway.is_confirmed = True
         await session.commit()
-        await log_action(session, None, f"Подтверждены победители для конкурса {contest_id}")
+        await log_action(
+            session, None,
+            f"Подтверждены победители для конкурса {contest_id}; опыт начислен {len(experience_deltas)} "
+            f"пользователям (всего {sum(experience_deltas.values())})"
+        )
         
         # Удаляем файл с комментариями после подтверждения победителей
         try:
@@ -1212,9 +1211,13 @@ async def confirm_winners(contest_id: int) -> bool:
         return True
 
 
-async def send_congratulations_messages(contest_id: int, bot: Bot) -> None:
+async def send_congratulations_messages(contest_id: int, bot: Bot, photo_file_ids: dict = None) -> None:
     """
     Отправляет поздравительные сообщения победителям конкурса в группу обсуждения
+
+    Args:
+        photo_file_ids: {telegram_id участника: file_id фото работы} для конкурса рисунков -
+            поздравление отправляется с фото работы без повторной загрузки файла
     """
     try:
         async with async_session() as session:
@@ -1311,7 +1314,10 @@ async def send_congratulations_messages(contest_id: int, bot: Bot) -> None:
                 logger.error(f"Бот не имеет доступа к группе {group_chat_id}: {e}")
                 return
 
-            # Отправляем поздравления для каждого победителя
+            # Поздравления собираются и отправляются через общую очередь сообщений:
+            # короткие тексты объединяются, фото - альбомами, с соблюдением лимитов Telegram
+            announcements = []
+            photo_announcements = []
             for winner in winners:
                 try:
                     if contest_type == 'random_comment':
@@ -1355,32 +1361,7 @@ async def send_congratulations_messages(contest_id: int, bot: Bot) -> None:
                         if reroll_count > 0:
                             congratulation_text += f"\n🔄 Реролов: {reroll_count}"
 
-                        # Отправляем сообщение в группу обсуждения в ответ на пост
-                        try:
-                            if reply_to_message_id:
-                                await bot.send_message(
-                                    chat_id=group_chat_id,
-                                    text=congratulation_text,
-                                    reply_to_message_id=reply_to_message_id
-                                )
-                                logger.info(f"✅ Отправлено поздравление победителю конкурса {contest_id}: {username_display} (reply_to: {reply_to_message_id})")
-                            else:
-                                await bot.send_message(
-                                    chat_id=group_chat_id,
-                                    text=congratulation_text
-                                )
-                                logger.info(f"✅ Отправлено поздравление победителю конкурса {contest_id}: {username_display} (без reply_to)")
-                        except Exception as send_error:
-                            logger.error(f"❌ Ошибка при отправке поздравления победителю {winner.id}: {send_error}")
-                            # Пробуем отправить без reply_to_message_id
-                            try:
-                                await bot.send_message(
-                                    chat_id=group_chat_id,
-                                    text=f"{congratulation_text}\n\n❌ Не удалось ответить на пост"
-                                )
-                                logger.info(f"✅ Отправлено поздравление без reply_to для победителя конкурса {contest_id}: {username_display}")
-                            except Exception as fallback_error:
-                                logger.error(f"❌ Ошибка при отправке fallback поздравления победителю {winner.id}: {fallback_error}")
+                        announcements.append(congratulation_text)
 
                     else:
                         # Для конкурсов рисунков
@@ -1394,8 +1375,12 @@ async def send_congratulations_messages(contest_id: int, bot: Bot) -> None:
                         else:
                             username_display = f"@{username}"
 
+                        file_id = (photo_file_ids or {}).get(winner.user_id) or photo_file_id_from_link(winner.photo_link)
+
                         congratulation_text = f"🎉 Поздравляем победителя конкурса рисунков!\n\n"
-                        congratulation_text += f"🏆 {winner.photo_link}\n"
+                        if not file_id:
+                            # Если фото отправляется вместе с поздравлением, ссылка на него не нужна
+                            congratulation_text += f"🏆 {winner.photo_link}\n"
                         congratulation_text += f"👤 {username_display}"
 
                         if winner.prize_link:
@@ -1419,18 +1404,24 @@ async def send_congratulations_messages(contest_id: int, bot: Bot) -> None:
                         if reroll_count > 0:
                             congratulation_text += f"\n🔄 Реролов: {reroll_count}"
 
-                        await bot.send_message(
-                            chat_id=group_chat_id,
-                            text=congratulation_text
-                        )
-
-                        logger.info(f"✅ Отправлено поздравление победителю конкурса рисунков {contest_id}: {username_display}")
+                        if file_id:
+                            # Фото уже загружено в Telegram при приёме работы - отправляем по file_id
+                            photo_announcements.append({"photo": file_id, "caption": congratulation_text})
+                        else:
+                            announcements.append(congratulation_text)
 
                 except Exception as e:
                     logger.error(f"❌ Ошибка при отправке поздравления победителю {winner.id}: {e}")
                     continue
 
-            logger.info(f"✅ Отправлены поздравления для всех победителей конкурса {contest_id}")
+            send_params = {}
+            if reply_to_message_id:
+                # Если пост недоступен, сообщение уйдёт без ответа
+                send_params = {"reply_to_message_id": reply_to_message_id, "allow_sending_without_reply": True}
+            outbound_queue.enqueue_photo_announcements(group_chat_id, photo_announcements)
+            outbound_queue.enqueue_announcements(group_chat_id, announcements, **send_params)
+
+            logger.info(f"✅ Поздравления для {len(announcements) + len(photo_announcements)} победителей конкурса {contest_id} поставлены в очередь")
 
     except Exception as e:
         logger.error(f"❌ Ошибка при отправке поздравительных сообщений для конкурса {contest_id}: {e}")
@@ -1446,44 +1437,20 @@ async def check_all_giveaways_historical_comments(bot: Bot):
         current_time_msk = datetime.now(msk_tz)
         
         async with async_session() as session:
-            # Получаем все конкурсы, которые еще не закончились
-            # Используем text() для безопасного запроса
-            from sqlalchemy import text
-            
-            # Проверяем наличие колонки discussion_group_link
-            if IS_SQLITE:
-                result = await session.execute(text("PRAGMA table_info(giveaways)"))
-                columns_info = result.fetchall()
-                existing_columns = [row[1] for row in columns_info]
-            else:
-                result = await session.execute(text("""
-                    SELECT column_name 
-                    FROM information_schema.columns 
-                    WHERE table_name = 'giveaways'
-                """))
-                columns_info = result.fetchall()
-                existing_columns = [row[0] for row in columns_info]
-            has_discussion_group_link = 'discussion_group_link' in existing_columns
-            
-            # Формируем запрос с учетом наличия колонки
-            if has_discussion_group_link:
-                query = text("""
-                    SELECT id, post_link, discussion_group_link, end_date 
-                    FROM giveaways 
-                    WHERE end_date > :current_time 
-                    AND post_link IS NOT NULL 
-                    AND post_link != ''
-                """)
-            else:
-                query = text("""
-                    SELECT id, post_link, NULL as discussion_group_link, end_date 
-                    FROM giveaways 
-                    WHERE end_date > :current_time 
-                    AND post_link IS NOT NULL 
-                    AND post_link != ''
-                """)
-            
-            result = await session.execute(query, {"current_time": current_time_msk})
+            # Получаем все конкурсы, которые еще не закончились.
+            # Наличие колонки discussion_group_link берём из кэша схемы (заполняется в init_db)
+            await init_db()
+            discussion_group_column = (
+                Giveaway.discussion_group_link if has_column('giveaways', 'discussion_group_link')
+                else literal_column("NULL").label("discussion_group_link")
+            )
+            result = await session.execute(
+                select(Giveaway.id, Giveaway.post_link, discussion_group_column, Giveaway.end_date).where(
+                    Giveaway.end_date > current_time_msk.replace(tzinfo=None),
+                    Giveaway.post_link.isnot(None),
+                    Giveaway.post_link != ''
+                )
+            )
             giveaways = result.fetchall()
             
             logger.info(f"🔍 Проверка исторических комментариев для {len(giveaways)} активных конкурсов...")
@@ -0,0 +1,299 @@
+"""
+Конвейер обработки загружаемых изображений
+
+- загруженный файл копируется на диск блоками (spool_upload), без чтения целиком в память
+- декодирование, ресайз и перекодирование выполняются в ProcessPoolExecutor,
+  поэтому event loop (веб-сервер и polling бота) не блокируется
+- число одновременных задач ограничено (IMAGE_QUEUE_SIZE): при переполнении
+  запрос ждёт свободного места не дольше IMAGE_QUEUE_TIMEOUT секунд
+- качество JPEG подбирается бинарным поиском вместо перебора с шагом
+- при загрузке один раз строятся уменьшенные копии (миниатюра и средний размер,
+  WebP если Pillow его поддерживает, иначе JPEG)
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 МБ
+MAX_DIMENSION = 10000  # Максимальный размер стороны для Telegram API
+MAX_ENCODED_SIZE = 50 * 1024 * 1024  # 50 МБ
+MIN_QUALITY = 30  # Не ниже 30 для читаемости
+MAX_QUALITY = 85
+
+# Уменьшенные копии работ: имя -> максимальная сторона в пикселях
+DERIVATIVE_SIZES = {"thumb": 320, "mid": 1280}
+DERIVATIVE_QUALITY = 80
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_QUEUE_SIZE = int(os.getenv("IMAGE_QUEUE_SIZE", "8"))
+IMAGE_QUEUE_TIMEOUT = 30  # секунды ожидания места в очереди
+
+_executor = None
+_slots = None
+
+
+class UploadTooLarge(Exception):
+    """Загружаемый файл превышает допустимый размер"""
+
+
+class ImageQueueFull(Exception):
+    """Очередь обработки изображений переполнена"""
+
+
+async def spool_upload(upload, dest_dir: str, max_size: int) -> tuple:
+    """
+    Копирует загруженный файл во временный файл в dest_dir блоками по UPLOAD_CHUNK_SIZE
+
+    Returns:
+        tuple: (путь к временному файлу, размер в байтах)
+
+    Raises:
+        UploadTooLarge: если размер превышает max_size (временный файл удаляется)
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="upload_", dir=dest_dir)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge(f"Файл больше {max_size} байт")
+                f.write(chunk)
+    except BaseException:
+        remove_quietly(path)
+        raise
+    return path, size
+
+
+def remove_quietly(path: str) -> None:
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except Exception:
+            pass
+
+
+def _encode(img, format_ext: str, quality: int) -> bytes:
+    output = io.BytesIO()
+    if format_ext == "JPEG":
+        img.save(output, format="JPEG", quality=quality, optimize=True)
+    else:
+        img.save(output, format=format_ext, optimize=True)
+    return output.getvalue()
+
+
+def encode_with_quality_search(img, format_ext: str, max_size: int) -> tuple:
+    """
+    Кодирует изображение с максимальным качеством, при котором размер <= max_size
+
+    Для JPEG качество ищется бинарным поиском в [MIN_QUALITY, MAX_QUALITY]:
+    не больше ~7 кодирований вместо до 20 при линейном шаге.
+    Если даже MIN_QUALITY не помещается, возвращается результат с MIN_QUALITY.
+
+    Returns:
+        tuple: (байты, качество или None для форматов без качества)
+    """
+    if format_ext != "JPEG":
+        return _encode(img, format_ext, MAX_QUALITY), None
+
+    data = _encode(img, format_ext, MAX_QUALITY)
+    if len(data) <= max_size:
+        return data, MAX_QUALITY
+
+    best = None
+    smallest = None
+    low, high = MIN_QUALITY, MAX_QUALITY - 1
+    while low <= high:
+        quality = (low + high) // 2
+        candidate = _encode(img, format_ext, quality)
+        if len(candidate) <= max_size:
+            best = (candidate, quality)
+            low = quality + 1
+        else:
+            smallest = (candidate, quality)
+            high = quality - 1
+    return best or smallest
+
+
+def _resize(img, new_size: tuple):
+    from PIL import Image
+    try:
+        # Для новых версий PIL
+        return img.resize(new_size, Image.Resampling.LANCZOS)
+    except AttributeError:
+        # Для старых версий PIL
+        return img.resize(new_size, Image.LANCZOS)
+
+
+def process_image_file(src_path: str, dst_path: str) -> dict:
+    """
+    Нормализует изображение для отправки в Telegram (выполняется в процессе-воркере)
+
+    Ресайз до MAX_DIMENSION, конвертация прозрачности в белый фон для не-PNG,
+    подбор качества так, чтобы файл был не больше MAX_ENCODED_SIZE.
+
+    Returns:
+        dict: {"format", "quality", "size", "width", "height"}
+    """
+    from PIL import Image
+
+    with Image.open(src_path) as opened:
+        original_format = opened.format
+        img = opened
+        img.load()
+
+        # Конвертируем RGBA в RGB для JPEG (если нужно)
+        if img.mode in ('RGBA', 'LA', 'P') and original_format != 'PNG':
+            # Создаем белый фон для изображений с прозрачностью
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            if img.mode == 'P':
+                img = img.convert('RGBA')
+            background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
+            img = background
+
+        if img.width > MAX_DIMENSION or img.height > MAX_DIMENSION:
+            ratio = min(MAX_DIMENSION / img.width, MAX_DIMENSION / img.height)
+            img = _resize(img, (int(img.width * ratio), int(img.height * ratio)))
+
+        # Определяем формат для сохранения
+        if original_format == 'PNG' and img.mode == 'RGBA':
+            format_ext = 'PNG'
+        else:
+            format_ext = 'JPEG'
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+
+        data, quality = encode_with_quality_search(img, format_ext, MAX_ENCODED_SIZE)
+        if len(data) > MAX_ENCODED_SIZE:
+            # Файл все еще слишком большой - уменьшаем размер изображения на 20%
+            img = _resize(img, (int(img.width * 0.8), int(img.height * 0.8)))
+            data, quality = encode_with_quality_search(img, format_ext, MAX_ENCODED_SIZE)
+
+        with open(dst_path, "wb") as f:
+            f.write(data)
+        return {
+            "format": format_ext,
+            "quality": quality,
+            "size": len(data),
+            "width": img.width,
+            "height": img.height,
+        }
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_derivatives_file(src_path: str, dst_dir: str) -> dict:
+    """
+    Строит уменьшенные копии изображения (выполняется в процессе-воркере)
+
+    Копии пишутся в dst_dir рядом с именем исходного файла; etag - хэш содержимого
+    копии, поэтому её можно отдавать с Cache-Control: immutable.
+    Копия не создаётся, если оригинал и так не больше нужного размера.
+
+    Returns:
+        dict: {"original": {"etag", "width", "height"},
+               "<имя>": {"path", "etag", "width", "height", "media_type"}, ...}
+    """
+    from PIL import Image, features
+
+    if features.check("webp"):
+        save_format, ext, media_type = "WEBP", ".webp", "image/webp"
+    else:
+        save_format, ext, media_type = "JPEG", ".jpg", "image/jpeg"
+
+    os.makedirs(dst_dir, exist_ok=True)
+    with Image.open(src_path) as img:
+        img.load()
+        result = {
+            "original": {
+                "etag": file_sha256(src_path)[:16],
+                "width": img.width,
+                "height": img.height,
+            }
+        }
+        if img.mode not in ("RGB", "RGBA") or (save_format == "JPEG" and img.mode != "RGB"):
+            img = img.convert("RGB")
+        for name, max_side in DERIVATIVE_SIZES.items():
+            if max(img.width, img.height) <= max_side:
+                continue
+            derivative = img.copy()
+            try:
+                derivative.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            except AttributeError:
+                derivative.thumbnail((max_side, max_side), Image.LANCZOS)
+            output = io.BytesIO()
+            derivative.save(output, format=save_format, quality=DERIVATIVE_QUALITY)
+            data = output.getvalue()
+            etag = hashlib.sha256(data).hexdigest()[:16]
+            path = os.path.join(dst_dir, f"{os.path.basename(src_path)}.{name}{ext}")
+            with open(path, "wb") as f:
+                f.write(data)
+            result[name] = {
+                "path": path,
+                "etag": etag,
+                "width": derivative.width,
+                "height": derivative.height,
+                "media_type": media_type,
+            }
+        return result
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def run_image_job(func, *args):
+    """
+    Выполняет функцию обработки изображения в пуле процессов
+
+    Raises:
+        ImageQueueFull: если место в очереди не освободилось за IMAGE_QUEUE_TIMEOUT
+    """
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(IMAGE_QUEUE_SIZE)
+    try:
+        await asyncio.wait_for(_slots.acquire(), timeout=IMAGE_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise ImageQueueFull("Очередь обработки изображений переполнена")
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), func, *args)
+    finally:
+        _slots.release()
+
+
+async def process_image(src_path: str, dst_path: str) -> dict:
+    """Асинхронная обёртка над process_image_file (см. run_image_job)"""
+    return await run_image_job(process_image_file, src_path, dst_path)
+
+
+async def make_derivatives(src_path: str, dst_dir: str) -> dict:
+    """Асинхронная обёртка над make_derivatives_file (см. run_image_job)"""
+    return await run_image_job(make_derivatives_file, src_path, dst_dir)
@@ -0,0 +1,118 @@
+"""
+Журнал Monkey Coins (coin_ledger) и атомарное изменение баланса
+
+- каждое изменение баланса - строка в coin_ledger (только дозапись), сумма delta
+  по пользователю равна users.monkey_coins; сам столбец - проекция журнала,
+  из которой баланс читается одним запросом
+- баланс меняется одним условным UPDATE
+  (monkey_coins = monkey_coins + :delta WHERE monkey_coins + :delta >= 0),
+  без чтения в Python и записи обратно: параллельные пополнения и списания
+  не теряют друг друга, а строка пользователя заблокирована только до конца
+  короткой транзакции
+- операция с idempotency_key применяется один раз: повтор (второй вебхук,
+  повторный запрос клиента) упирается в уникальный индекс журнала и баланс
+  не меняет
+
+apply_coin_delta выполняется в транзакции вызывающего кода: журнал и баланс
+фиксируются вместе с остальными изменениями (покупка темы, создание конкурса).
+"""
+import logging
+
+from sqlalchemy import delete, func, insert, update
+from sqlalchemy.future import select
+
+from db import read_session, upsert_insert
+from models import CoinTransaction, User, utcnow_naive
+
+logger = logging.getLogger(__name__)
+
+
+class LedgerError(Exception):
+    """Операцию с балансом нельзя применить"""
+
+
+class InsufficientCoins(LedgerError):
+    """Недостаточно Monkey Coins для списания"""
+
+    def __init__(self, balance: int, required: int):
+        super().__init__(f"Недостаточно Monkey Coins: {balance}, нужно {required}")
+        self.balance = balance
+        self.required = required
+
+
+async def apply_coin_delta(session, user_id: int, delta: int, reason: str, idempotency_key: str = None) -> tuple:
+    """
+    Записывает операцию в журнал и атомарно меняет баланс
+
+    Args:
+        session: Сессия, в транзакции которой выполняется операция (commit - за вызывающим)
+        user_id: telegram_id пользователя
+        delta: Изменение баланса (> 0 - начисление, < 0 - списание)
+        reason: Причина операции
+        idempotency_key: Ключ операции; операция с уже записанным ключом не применяется
+
+    Returns:
+        tuple: (баланс после операции, True - применена сейчас / False - уже была применена)
+
+    Raises:
+        InsufficientCoins: баланс стал бы отрицательным
+        LedgerError: пользователь не найден
+    """
+    user_id = int(user_id)
+    delta = int(delta)
+    values = {
+        "user_id": user_id,
+        "delta": delta,
+        "reason": reason,
+        "idempotency_key": idempotency_key,
+        "created_at": utcnow_naive(),
+    }
+    if idempotency_key:
+        statement = upsert_insert(CoinTransaction).values(**values).on_conflict_do_nothing(index_elements=["idempotency_key"])
+    else:
+        statement = insert(CoinTransaction).values(**values)
+    entry_id = (await session.execute(statement.returning(CoinTransaction.id))).scalar()
+    if entry_id is None:
+        # Операция с этим ключом уже в журнале
+        return await _current_balance(session, user_id), False
+
+    new_balance = func.coalesce(User.monkey_coins, 0) + delta
+    result = await session.execute(
+        update(User)
+        .where(User.telegram_id == user_id, new_balance >= 0)
+        .values(monkey_coins=new_balance)
+        .returning(User.monkey_coins)
+        .execution_options(synchronize_session=False)
+    )
+    balance = result.scalar()
+    if balance is None:
+        # Операция не применена - убираем её запись, остальная транзакция остаётся целой
+        await session.execute(delete(CoinTransaction).where(CoinTransaction.id == entry_id))
+        current = await _current_balance(session, user_id)
+        if current is None:
+            raise LedgerError(f"Пользователь {user_id} не найден")
+        raise InsufficientCoins(current, -delta)
+    return balance, True
+
+
+async def _current_balance(session, user_id: int):
+    result = await session.execute(select(User.monkey_coins).where(User.telegram_id == user_id))
+    row = result.first()
+    if row is None:
+        return None
+    return row[0] or 0
+
+
+async def get_balance(user_id: int) -> int:
+    """Баланс пользователя из проекции users.monkey_coins (0, если пользователя нет)"""
+    async with read_session() as session:
+        return await _current_balance(session, int(user_id)) or 0
+
+
+async def ledger_balance(user_id: int) -> int:
+    """Баланс, пересчитанный по журналу (для сверки с проекцией)"""
+    async with read_session() as session:
+        result = await session.execute(
+            select(func.coalesce(func.sum(CoinTransaction.delta), 0)).where(CoinTransaction.user_id == int(user_id))
+        )
+        return result.scalar() or 0
@@ -0,0 +1,282 @@
+"""
+Версионные миграции схемы БД (SQLite и PostgreSQL)
+
+- текущая версия схемы хранится в таблице schema_version (одна строка)
+- шаги миграций упорядочены по номеру версии и идемпотентны: колонка или индекс
+  добавляются, только если их ещё нет, поэтому шаг можно безопасно повторить
+  после сбоя
+- проверка и изменение схемы не атомарны, поэтому миграции выполняются под
+  блокировкой, общей для всех процессов (shared_state.FileLock): при старте
+  нескольких воркеров uvicorn мигрирует первый, остальные после ожидания
+  перечитывают версию и видят её актуальной
+- каждый шаг выполняется в своей транзакции вместе с обновлением версии
+- при "тёплом" старте (версия актуальна) выполняется одно чтение версии
+
+Новая миграция добавляется в конец MIGRATIONS со следующим номером версии;
+уже выпущенные шаги не меняются.
+"""
+import json
+import logging
+
+from sqlalchemy import inspect, text
+
+from shared_state import FileLock, shared_path
+
+logger = logging.getLogger(__name__)
+
+
+def _column_type(conn, sqlite_type: str, postgres_type: str = None) -> str:
+    if conn.dialect.name == "sqlite":
+        return sqlite_type
+    return postgres_type or sqlite_type
+
+
+async def _existing_columns(conn, table_name: str) -> set:
+    def read(sync_conn):
+        inspector = inspect(sync_conn)
+        if not inspector.has_table(table_name):
+            return set()
+        return {column["name"] for column in inspector.get_columns(table_name)}
+    return await conn.run_sync(read)
+
+
+async def _add_columns(conn, table_name: str, columns: list) -> None:
+    """
+    Добавляет отсутствующие колонки
+
+    Args:
+        columns: [(имя, тип SQLite, тип PostgreSQL или None - как в SQLite), ...]
+    """
+    existing = await _existing_columns(conn, table_name)
+    for name, sqlite_type, postgres_type in columns:
+        if name in existing:
+            continue
+        column_type = _column_type(conn, sqlite_type, postgres_type)
+        await conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {column_type}"))
+        print(f"✅ Добавлена колонка {table_name}.{name}")
+
+
+# Колонки, добавленные в таблицы после их первого выпуска
+USERS_COLUMNS = [
+    ("username", "VARCHAR", None),
+    ("channel_link", "VARCHAR", None),
+    ("chat_link", "VARCHAR", None),
+    ("experience", "INTEGER DEFAULT 0", None),
+    ("ton_wallet", "VARCHAR", None),
+    ("monkey_coins", "INTEGER DEFAULT 0", None),
+    ("purchased_items", "TEXT", "JSON"),
+    ("pro_subscription_start", "DATETIME", "TIMESTAMP"),
+    ("pro_subscription_end", "DATETIME", "TIMESTAMP"),
+    ("pro_contests_created", "INTEGER DEFAULT 0", None),
+    ("pro_last_topup_required", "BOOLEAN DEFAULT 0", "BOOLEAN DEFAULT FALSE"),
+]
+
+GIVEAWAYS_COLUMNS = [
+    ("name", "VARCHAR", None),
+    ("prize", "VARCHAR", None),
+    ("end_date", "DATETIME", "TIMESTAMP"),
+    ("conditions", "VARCHAR", None),
+    ("created_by", "INTEGER", "BIGINT"),
+    ("is_confirmed", "BOOLEAN DEFAULT 0", "BOOLEAN DEFAULT FALSE"),
+    ("winners_selected_at", "DATETIME", "TIMESTAMP"),
+    ("post_link", "VARCHAR", None),
+    ("discussion_group_link", "VARCHAR", None),
+    ("channel_link", "VARCHAR", None),
+    ("start_date", "DATETIME", "TIMESTAMP"),
+    ("prize_links", "TEXT", "JSON"),
+    ("winners_count", "INTEGER DEFAULT 1", None),
+    ("contest_type", "VARCHAR DEFAULT 'random_comment'", None),
+    ("submission_end_date", "DATETIME", "TIMESTAMP"),
+    ("jury", "TEXT", "JSONB"),
+]
+
+WINNERS_COLUMNS = [
+    ("user_id", "INTEGER", "BIGINT"),
+    ("user_username", "VARCHAR", None),
+    ("prize_link", "VARCHAR", None),
+    ("place", "INTEGER", None),
+    ("photo_link", "VARCHAR", None),
+    ("photo_message_id", "INTEGER", None),
+    ("reroll_count", "INTEGER DEFAULT 0", None),
+]
+
+PARTICIPANTS_COLUMNS = [
+    ("photo_link", "VARCHAR", None),
+    ("photo_message_id", "INTEGER", None),
+]
+
+
+async def _create_tables(conn) -> None:
+    """Создаёт отсутствующие таблицы по моделям"""
+    from models import Base
+    await conn.run_sync(Base.metadata.create_all)
+
+
+async def _migrate_users(conn) -> None:
+    await _add_columns(conn, "users", USERS_COLUMNS)
+
+
+async def _migrate_giveaways(conn) -> None:
+    await _add_columns(conn, "giveaways", GIVEAWAYS_COLUMNS)
+
+
+async def _migrate_winners(conn) -> None:
+    await _add_columns(conn, "winners", WINNERS_COLUMNS)
+
+
+async def _migrate_participants(conn) -> None:
+    await _add_columns(conn, "participants", PARTICIPANTS_COLUMNS)
+    if conn.dialect.name == "sqlite":
+        # Старые таблицы participants создавались без уникального ограничения
+        await conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_participant_unique ON participants(giveaway_id, user_id)"
+        ))
+
+
+async def _create_comments_indexes(conn) -> None:
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_comments_chat_post ON comments(chat_id, post_message_id)"
+    ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_comments_comment_chat ON comments(comment_chat_id, post_message_id)"
+    ))
+
+
+async def _create_payments_table(conn) -> None:
+    from models import Payment
+    await conn.run_sync(lambda sync_conn: Payment.__table__.create(sync_conn, checkfirst=True))
+
+
+async def _create_coin_ledger(conn) -> None:
+    from models import CoinTransaction
+    await conn.run_sync(lambda sync_conn: CoinTransaction.__table__.create(sync_conn, checkfirst=True))
+    # Начальные записи журнала: сумма delta по пользователю должна совпадать с users.monkey_coins
+    await conn.execute(text(
+        "INSERT INTO coin_ledger (user_id, delta, reason, idempotency_key, created_at) "
+        "SELECT telegram_id, monkey_coins, 'opening_balance', 'opening:' || CAST(telegram_id AS VARCHAR), CURRENT_TIMESTAMP "
+        "FROM users WHERE telegram_id IS NOT NULL AND COALESCE(monkey_coins, 0) != 0 "
+        "AND NOT EXISTS (SELECT 1 FROM coin_ledger WHERE coin_ledger.user_id = users.telegram_id)"
+    ))
+
+
+async def _create_user_items(conn) -> None:
+    from models import UserItem
+    await conn.run_sync(lambda sync_conn: UserItem.__table__.create(sync_conn, checkfirst=True))
+    # Перенос покупок из JSON-столбца users.purchased_items
+    result = await conn.execute(text(
+        "SELECT telegram_id, purchased_items FROM users "
+        "WHERE telegram_id IS NOT NULL AND purchased_items IS NOT NULL"
+    ))
+    rows = []
+    for telegram_id, purchased_items in result.all():
+        # Столбец встречается как dict, JSON-строка и JSON-строка внутри JSON
+        while isinstance(purchased_items, str):
+            try:
+                purchased_items = json.loads(purchased_items)
+            except ValueError:
+                purchased_items = None
+        if not isinstance(purchased_items, dict):
+            continue
+        for category, item_ids in purchased_items.items():
+            if not isinstance(item_ids, list):
+                continue
+            for item_id in dict.fromkeys(str(item_id) for item_id in item_ids if item_id is not None):
+                rows.append({"user_id": telegram_id, "category": category, "item_id": item_id})
+    if rows:
+        await conn.execute(
+            text(
+                "INSERT INTO user_items (user_id, category, item_id, created_at) "
+                "VALUES (:user_id, :category, :item_id, CURRENT_TIMESTAMP) ON CONFLICT DO NOTHING"
+            ),
+            rows
+        )
+        print(f"✅ Перенесено покупок в user_items: {len(rows)}")
+
+
+# (версия, описание, шаг) - строго по возрастанию версии
+MIGRATIONS = [
+    (1, "создание таблиц по моделям", _create_tables),
+    (2, "колонки users", _migrate_users),
+    (3, "колонки giveaways", _migrate_giveaways),
+    (4, "колонки winners", _migrate_winners),
+    (5, "колонки и уникальный индекс participants", _migrate_participants),
+    (6, "индексы comments", _create_comments_indexes),
+    (7, "таблица payments", _create_payments_table),
+    (8, "журнал Monkey Coins с начальными балансами", _create_coin_ledger),
+    (9, "таблица user_items с покупками из users.purchased_items", _create_user_items),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def expected_schema_columns() -> dict:
+    """
+    Колонки таблиц после применения всех миграций: {имя таблицы: множество колонок}
+
+    Используется как кэш схемы при актуальной версии, чтобы не читать
+    структуру таблиц из БД при каждом старте.
+    """
+    from models import Base
+    schema = {
+        table_name: {column.name for column in table.columns}
+        for table_name, table in Base.metadata.tables.items()
+    }
+    for table_name, columns in (
+        ("users", USERS_COLUMNS),
+        ("giveaways", GIVEAWAYS_COLUMNS),
+        ("winners", WINNERS_COLUMNS),
+        ("participants", PARTICIPANTS_COLUMNS),
+    ):
+        schema.setdefault(table_name, set()).update(name for name, _, _ in columns)
+    schema["schema_version"] = {"version"}
+    return schema
+
+
+async def read_schema_version(engine) -> int:
+    """Текущая версия схемы (0 - таблицы schema_version ещё нет)"""
+    try:
+        async with engine.connect() as conn:
+            result = await conn.execute(text("SELECT version FROM schema_version"))
+            row = result.first()
+            return row[0] if row else 0
+    except Exception:
+        return 0
+
+
+async def apply_migrations(engine) -> int:
+    """
+    Применяет миграции, номер которых больше текущей версии схемы
+
+    Returns:
+        int: версия схемы после применения миграций
+    """
+    async with FileLock(shared_path("migrations.lock")):
+        return await _apply_migrations_locked(engine)
+
+
+async def _apply_migrations_locked(engine) -> int:
+    # Версию читаем под блокировкой: другой процесс мог уже применить миграции
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+        result = await conn.execute(text("SELECT version FROM schema_version"))
+        row = result.first()
+        if row is None:
+            await conn.execute(text("INSERT INTO schema_version (version) VALUES (0)"))
+            version = 0
+        else:
+            version = row[0]
+
+    for step_version, description, step in MIGRATIONS:
+        if step_version <= version:
+            continue
+        async with engine.begin() as conn:
+            await step(conn)
+            # Версия только растёт
+            await conn.execute(
+                text("UPDATE schema_version SET version = :version WHERE version < :version"),
+                {"version": step_version}
+            )
+        version = step_version
+        logger.info(f"Применена миграция схемы {step_version}: {description}")
+        print(f"✅ Миграция схемы {step_version}: {description}")
+    return version
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, DateTime, Boolean, JSON, UniqueConstraint
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, DateTime, Boolean, JSON, UniqueConstraint, Index
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime, timezone
 
@@ -21,7 +21,7 @@ class User(Base):
     experience = Column(Integer, default=0)  # Опыт пользователя
     ton_wallet = Column(String, nullable=True)  # TON кошелек пользователя
     monkey_coins = Column(Integer, default=0)  # Monkey Coins - внутренняя валюта
-    purchased_items = Column(JSON, nullable=True)  # Купленные товары: {"themes": ["kitty", "mario"], "avatarStars": [], "nftGifts": []}
+    purchased_items = Column(JSON, nullable=True)  # Устарело: покупки хранятся в user_items (перенесены миграцией 9)
 
 class Channel(Base):
     __tablename__ = "channels"
@@ -121,3 +121,54 @@ class Participant(Base):
         UniqueConstraint('giveaway_id', 'user_id', name='uq_participant_giveaway_user'),
         {'sqlite_autoincrement': True},
     )
+
+
+class Payment(Base):
+    """Платежи через CryptoBot: счёт создаётся в статусе pending, сверку со статусом в CryptoBot делает payments.py"""
+    __tablename__ = "payments"
+    id = Column(Integer, primary_key=True)
+    invoice_id = Column(String, nullable=False)  # ID счёта у платёжного провайдера
+    provider = Column(String, nullable=False, default="cryptobot")
+    user_id = Column(BigInteger, nullable=False)  # telegram_id плательщика
+    payment_type = Column(String, nullable=False)  # topup (пополнение Monkey Coins) / purchase (покупка товара)
+    status = Column(String, nullable=False, default="pending")  # pending, paid, expired, needs_attention (оплачен, но не начислен)
+    payload = Column(JSON, nullable=True)  # Данные счёта: monkey_coins или category/item_id, сумма и валюта
+    created_at = Column(DateTime, default=utcnow_naive)
+    updated_at = Column(DateTime, default=utcnow_naive)
+    paid_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint('provider', 'invoice_id', name='uq_payment_provider_invoice'),
+        Index('idx_payments_status', 'status'),
+    )
+
+
+class CoinTransaction(Base):
+    """Журнал изменений баланса Monkey Coins (только дозапись); users.monkey_coins - его проекция, см. ledger.py"""
+    __tablename__ = "coin_ledger"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, nullable=False)  # telegram_id пользователя
+    delta = Column(Integer, nullable=False)  # Изменение баланса: > 0 - начисление, < 0 - списание
+    reason = Column(String, nullable=False)  # topup_cryptobot, topup_stars, theme_purchase, contest_fee, ...
+    idempotency_key = Column(String, nullable=True)  # Повторная операция с тем же ключом не применяется
+    created_at = Column(DateTime, default=utcnow_naive)
+
+    __table_args__ = (
+        UniqueConstraint('idempotency_key', name='uq_coin_ledger_idempotency_key'),
+        Index('idx_coin_ledger_user', 'user_id'),
+    )
+
+
+class UserItem(Base):
+    """Купленный товар пользователя (тема, звезда аватара, NFT-подарок), см. user_items.py"""
+    __tablename__ = "user_items"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, nullable=False)  # telegram_id владельца
+    category = Column(String, nullable=False)  # themes / avatarStars / nftGifts
+    item_id = Column(String, nullable=False)
+    created_at = Column(DateTime, default=utcnow_naive)
+
+    __table_args__ = (
+        # Уникальность покупки и индекс для выборки товаров пользователя и проверки владения
+        UniqueConstraint('user_id', 'category', 'item_id', name='uq_user_item'),
+    )
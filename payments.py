@@ -0,0 +1,316 @@
+"""
+Учёт платежей CryptoBot и фоновая сверка их статусов
+
+- при создании счёта в таблицу payments записывается платёж в статусе pending
+  (тип topup - пополнение Monkey Coins, purchase - покупка товара)
+- фоновая задача раз в PAYMENTS_RECONCILE_INTERVAL секунд запрашивает статусы
+  всех ожидающих счетов пакетными getInvoices и применяет оплаченные
+- оплата применяется ровно один раз: переход pending -> paid выполняется
+  условным UPDATE в той же транзакции, что и начисление, поэтому сверка,
+  webhook CryptoBot и параллельные процессы не начисляют повторно
+- если начислить оплату не удалось (пользователь не найден, нет товара в payload),
+  транзакция откатывается и платёж получает статус needs_attention: такие платежи
+  повторяются раз в PAYMENTS_RETRY_INTERVAL секунд и видны в /api/payment/verify
+- о результате пользователь узнаёт из сообщения бота (очередь outbound_queue),
+  а /api/payment/verify читает статус из БД без обращения к CryptoBot
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import update
+from sqlalchemy.future import select
+
+import cryptobot
+from db import async_session, read_session
+from ledger import LedgerError, apply_coin_delta
+from models import Payment, User
+from telegram_sender import outbound_queue
+from user_items import add_user_item
+
+logger = logging.getLogger(__name__)
+
+PROVIDER = "cryptobot"
+PAYMENTS_RECONCILE_INTERVAL = 10  # секунды между сверками ожидающих счетов
+# Сколько ожидающих платежей сверять за один проход (остальные - в следующий)
+PAYMENTS_RECONCILE_LIMIT = 1000
+# Счёт, которого CryptoBot не возвращает дольше этого срока, считается просроченным
+PAYMENT_PENDING_MAX_AGE = timedelta(days=2)
+# Секунды между повторами платежей, оплаченных, но не начисленных (needs_attention)
+PAYMENTS_RETRY_INTERVAL = 600
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _parse_payload(payload):
+    if isinstance(payload, str):
+        try:
+            return json.loads(payload)
+        except (TypeError, ValueError):
+            return None
+    return payload
+
+
+async def record_invoice(invoice_id, user_id: int, payment_type: str, payload: dict) -> None:
+    """Сохраняет созданный счёт как ожидающий оплаты"""
+    async with async_session() as session:
+        session.add(Payment(
+            invoice_id=str(invoice_id),
+            provider=PROVIDER,
+            user_id=int(user_id),
+            payment_type=payment_type,
+            status="pending",
+            payload=payload,
+        ))
+        await session.commit()
+
+
+async def get_payment(invoice_id):
+    """Платёж по id счёта (чтение из пула только для чтения) или None"""
+    async with read_session() as session:
+        result = await session.execute(
+            select(Payment).where(Payment.provider == PROVIDER, Payment.invoice_id == str(invoice_id))
+        )
+        return result.scalars().first()
+
+
+async def _credit_topup(session, invoice_id, payment_user_id: int, payload: dict):
+    try:
+        balance, _ = await apply_coin_delta(
+            session, payment_user_id, int(payload.get("monkey_coins") or 0),
+            "topup_cryptobot", idempotency_key=f"cryptobot:{invoice_id}"
+        )
+    except LedgerError:
+        return None
+    return balance
+
+
+async def _add_purchased_item(session, payment_user_id: int, payload: dict) -> bool:
+    category = payload.get("category")
+    item_id = payload.get("item_id")
+    if not category or not item_id:
+        return False
+    result = await session.execute(select(User.id).where(User.telegram_id == payment_user_id))
+    if result.first() is None:
+        return False
+    await add_user_item(session, payment_user_id, category, item_id)
+    return True
+
+
+async def apply_paid_payment(invoice_id) -> bool:
+    """
+    Переводит платёж в paid и начисляет оплату
+
+    Если начислить не удалось, изменения откатываются, а платёж переводится
+    в needs_attention (оплачен у провайдера, но не начислен) для повтора.
+
+    Returns:
+        bool: True, если оплата применена этим вызовом (False - уже применена
+        ранее, платежа нет, он не ожидает начисления или начислить не удалось)
+    """
+    now = _utcnow()
+    async with async_session() as session:
+        result = await session.execute(
+            update(Payment)
+            .where(
+                Payment.provider == PROVIDER,
+                Payment.invoice_id == str(invoice_id),
+                Payment.status.in_(("pending", "needs_attention")),
+            )
+            .values(status="paid", paid_at=now, updated_at=now)
+        )
+        if result.rowcount != 1:
+            await session.rollback()
+            return False
+
+        payment_result = await session.execute(
+            select(Payment).where(Payment.provider == PROVIDER, Payment.invoice_id == str(invoice_id))
+        )
+        payment = payment_result.scalars().first()
+        payload = _parse_payload(payment.payload) or {}
+        payment_user_id = payment.user_id
+        notification = None
+        if payment.payment_type == "topup":
+            balance = await _credit_topup(session, invoice_id, payment_user_id, payload)
+            if balance is None:
+                logger.error(f"❌ Пользователь {payment_user_id} не найден, пополнение по счёту {invoice_id} не начислено")
+            else:
+                monkey_coins = payload.get("monkey_coins", 0)
+                logger.info(f"✅ Баланс пополнен через CryptoBot: invoice_id {invoice_id}, пользователь {payment_user_id}, добавлено {monkey_coins} Monkey Coins, новый баланс: {balance}")
+                notification = f"✅ **Баланс пополнен!**\n\nПолучено: {monkey_coins} Monkey Coins\nВаш баланс: {balance} Monkey Coins"
+        else:
+            if await _add_purchased_item(session, payment_user_id, payload):
+                logger.info(f"✅ Успешная оплата через CryptoBot: invoice_id {invoice_id}, пользователь {payment_user_id}, товар {payload.get('category')}/{payload.get('item_id')}")
+                notification = "✅ **Оплата получена!**\n\nПокупка добавлена в ваш профиль."
+            else:
+                logger.error(f"❌ Не удалось добавить покупку по счёту {invoice_id}: пользователь {payment_user_id}, payload {payload}")
+
+        if notification is None:
+            # Оплата не начислена - статус paid не фиксируем
+            await session.rollback()
+            await _mark_needs_attention(invoice_id)
+            return False
+        await session.commit()
+
+    try:
+        outbound_queue.enqueue(payment_user_id, "send_message", text=notification, parse_mode="Markdown")
+    except Exception as e:
+        logger.error(f"Ошибка отправки уведомления об оплате: {e}")
+    return True
+
+
+async def _mark_needs_attention(invoice_id) -> None:
+    async with async_session() as session:
+        result = await session.execute(
+            update(Payment)
+            .where(
+                Payment.provider == PROVIDER,
+                Payment.invoice_id == str(invoice_id),
+                Payment.status.in_(("pending", "needs_attention")),
+            )
+            .values(status="needs_attention", updated_at=_utcnow())
+        )
+        await session.commit()
+    if result.rowcount:
+        logger.error(f"⚠️ Счет {invoice_id} оплачен, но не начислен - статус needs_attention, повтор через {PAYMENTS_RETRY_INTERVAL} с")
+
+
+async def _mark_expired(invoice_ids: list) -> None:
+    if not invoice_ids:
+        return
+    async with async_session() as session:
+        await session.execute(
+            update(Payment)
+            .where(
+                Payment.provider == PROVIDER,
+                Payment.invoice_id.in_([str(invoice_id) for invoice_id in invoice_ids]),
+                Payment.status == "pending",
+            )
+            .values(status="expired", updated_at=_utcnow())
+        )
+        await session.commit()
+
+
+async def record_legacy_invoice(invoice_id, verification_result: dict) -> bool:
+    """
+    Создаёт запись для оплаченного счёта, выставленного до появления таблицы payments
+
+    Returns:
+        bool: True, если запись есть (создана сейчас или уже была)
+    """
+    if await get_payment(invoice_id):
+        return True
+    payload = _parse_payload(verification_result.get("payload"))
+    if not isinstance(payload, dict) or not payload.get("user_id"):
+        logger.warning(f"⚠️ Payload отсутствует или без user_id в счете: invoice_id {invoice_id}")
+        return False
+    try:
+        await record_invoice(
+            invoice_id,
+            int(payload["user_id"]),
+            "topup" if payload.get("type") == "topup" else "purchase",
+            payload,
+        )
+    except Exception:
+        # Запись мог создать параллельный вызов (уникальный индекс provider + invoice_id)
+        return await get_payment(invoice_id) is not None
+    return True
+
+
+async def reconcile_invoices(invoice_ids: list) -> dict:
+    """
+    Сверяет статусы счетов с CryptoBot и применяет изменения
+
+    Returns:
+        dict: {invoice_id: статус после сверки} для счетов, которые вернул CryptoBot
+    """
+    if not invoice_ids:
+        return {}
+    results = await cryptobot.verify_payments(invoice_ids)
+    statuses = {}
+    expired = []
+    for invoice_id, verification_result in results.items():
+        invoice = verification_result.get("invoice")
+        if not invoice:
+            continue
+        if verification_result.get("paid"):
+            await apply_paid_payment(invoice_id)
+            payment = await get_payment(invoice_id)
+            statuses[invoice_id] = payment.status if payment else "paid"
+        elif invoice.get("status") == "expired":
+            expired.append(invoice_id)
+            statuses[invoice_id] = "expired"
+        else:
+            statuses[invoice_id] = "pending"
+    await _mark_expired(expired)
+    return statuses
+
+
+async def reconcile_pending_payments() -> int:
+    """
+    Одна сверка всех ожидающих платежей
+
+    Returns:
+        int: количество проверенных счетов
+    """
+    async with read_session() as session:
+        result = await session.execute(
+            select(Payment.invoice_id, Payment.created_at)
+            .where(Payment.provider == PROVIDER, Payment.status == "pending")
+            .order_by(Payment.id)
+            .limit(PAYMENTS_RECONCILE_LIMIT)
+        )
+        pending = result.all()
+    if not pending:
+        return 0
+
+    statuses = await reconcile_invoices([int(invoice_id) for invoice_id, _ in pending])
+    # Счета, которых CryptoBot так и не вернул, не сверяем бесконечно
+    deadline = _utcnow() - PAYMENT_PENDING_MAX_AGE
+    stale = [
+        invoice_id for invoice_id, created_at in pending
+        if int(invoice_id) not in statuses and created_at and created_at < deadline
+    ]
+    await _mark_expired(stale)
+    return len(pending)
+
+
+async def retry_unapplied_payments() -> int:
+    """
+    Повторяет начисление платежей в статусе needs_attention
+
+    Оплата уже подтверждена CryptoBot, поэтому к API не обращаемся.
+
+    Returns:
+        int: количество начисленных платежей
+    """
+    async with read_session() as session:
+        result = await session.execute(
+            select(Payment.invoice_id)
+            .where(Payment.provider == PROVIDER, Payment.status == "needs_attention")
+            .order_by(Payment.id)
+            .limit(PAYMENTS_RECONCILE_LIMIT)
+        )
+        invoice_ids = result.scalars().all()
+    applied = 0
+    for invoice_id in invoice_ids:
+        if await apply_paid_payment(invoice_id):
+            applied += 1
+    return applied
+
+
+async def payments_reconcile_loop() -> None:
+    loop = asyncio.get_running_loop()
+    last_retry = loop.time()
+    while True:
+        await asyncio.sleep(PAYMENTS_RECONCILE_INTERVAL)
+        try:
+            await reconcile_pending_payments()
+            if loop.time() - last_retry >= PAYMENTS_RETRY_INTERVAL:
+                last_retry = loop.time()
+                await retry_unapplied_payments()
+        except Exception as e:
+            logger.error(f"Ошибка при сверке платежей: {e}", exc_info=True)
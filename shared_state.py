@@ -0,0 +1,171 @@
+"""
+Состояние, общее для нескольких процессов приложения
+
+Бот (polling) и несколько воркеров uvicorn (APP_ROLE=bot / APP_ROLE=web, см. bot.py)
+работают с одними и теми же JSON-документами и журналами на диске:
+- FileLock - блокировка документа между процессами (asyncio.Lock внутри процесса
+  + flock на файл блокировки), заменяет asyncio.Lock для drawing/collection данных
+- file_lock_sync - короткая синхронная блокировка для дозаписи в журналы
+- SharedVersion - счётчик версии в файле: по нему процессы узнают, что кэш
+  (список конкурсов, статистика профиля) нужно сбросить
+- file_signature - "подпись" файла (inode, размер, mtime) для проверки,
+  не изменил ли документ другой процесс
+
+Без модуля fcntl (Windows) блокировки работают только внутри процесса.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR", os.path.join(ROOT_DIR, "shared_state"))
+
+# Пауза между попытками взять занятую блокировку (секунды)
+LOCK_POLL_MIN = 0.002
+LOCK_POLL_MAX = 0.05
+
+
+def shared_path(name: str) -> str:
+    """Путь к служебному файлу общего состояния"""
+    os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+    return os.path.join(SHARED_STATE_DIR, name)
+
+
+def file_signature(path: str):
+    """(inode, размер, mtime) файла или None, если файла нет"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class FileLock:
+    """
+    Асинхронная блокировка, общая для всех процессов
+
+    Внутри процесса корутины ждут на asyncio.Lock, между процессами - на flock.
+    Занятый flock опрашивается неблокирующими попытками, поэтому ожидание
+    не занимает поток и корректно отменяется.
+
+    Args:
+        path: Файл блокировки
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = asyncio.Lock()
+        self._fd = None
+
+    def _try_lock_file(self) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        return True
+
+    async def acquire(self) -> None:
+        await self._lock.acquire()
+        if fcntl is None:
+            return
+        try:
+            delay = LOCK_POLL_MIN
+            while not self._try_lock_file():
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LOCK_POLL_MAX)
+        except BaseException:
+            self._lock.release()
+            raise
+
+    def release(self) -> None:
+        if self._fd is not None:
+            fd, self._fd = self._fd, None
+            try:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            finally:
+                os.close(fd)
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+@contextlib.contextmanager
+def file_lock_sync(path: str):
+    """Синхронная блокировка между процессами (для коротких операций с файлами)"""
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+
+class SharedVersion:
+    """
+    Версия, общая для всех процессов (хранится в файле)
+
+    Значение - время изменения в наносекундах, поэтому одновременные bump()
+    из разных процессов не требуют блокировки: версия в любом случае меняется.
+    Чтение - один stat, файл перечитывается только после изменения.
+
+    Args:
+        path: Файл версии
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._signature = None
+        self._value = 0
+
+    def get(self) -> int:
+        signature = file_signature(self.path)
+        if signature != self._signature:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._value = int(f.read().strip() or 0)
+            except (OSError, ValueError):
+                self._value = 0
+            self._signature = signature
+        return self._value
+
+    def bump(self) -> int:
+        value = max(time.time_ns(), self._value + 1)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(str(value))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Не удалось обновить версию {self.path}: {e}")
+        self._value = value
+        self._signature = file_signature(self.path)
+        return value
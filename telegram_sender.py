@@ -0,0 +1,441 @@
+"""
+Отправка сообщений и фотографий в Telegram с ограничением скорости
+
+- TokenBucket ограничивает число запросов в секунду (Telegram допускает ~30 сообщений/с)
+- send_photo_batch отправляет одну фотографию нескольким получателям: байты
+  загружаются в Telegram один раз, остальные получатели получают её по file_id
+- OutboundQueue - общая очередь исходящих уведомлений: общий и по-чатовый лимиты,
+  пауза по RetryAfter, сохранение неотправленного на диск (переживает перезапуск)
+  и объединение объявлений в один чат в меньшее число сообщений
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from urllib.parse import parse_qs, urlparse
+
+from shared_state import file_lock_sync
+
+logger = logging.getLogger(__name__)
+
+try:
+    from aiogram.utils.exceptions import RetryAfter, BotBlocked, ChatNotFound, UserDeactivated, BadRequest
+    PERMANENT_ERRORS = (BotBlocked, ChatNotFound, UserDeactivated, BadRequest)
+except ImportError:
+    RetryAfter = None
+    PERMANENT_ERRORS = ()
+
+# Лимиты Telegram: ~30 сообщений/с всего, ~1/с в личный чат, ~20/мин в группу
+GLOBAL_RATE = 25
+PRIVATE_CHAT_RATE = 1
+GROUP_CHAT_RATE = 20 / 60
+MAX_MESSAGE_LENGTH = 4096
+MAX_CAPTION_LENGTH = 1024
+MEDIA_GROUP_SIZE = 10
+MAX_SEND_ATTEMPTS = 5
+# Как часто воркер очереди проверяет задания, добавленные другими процессами (секунды)
+OUTBOUND_POLL_INTERVAL = 0.5
+
+
+class TokenBucket:
+    """
+    Token bucket: в среднем не больше rate операций в секунду, пачкой - не больше capacity
+
+    Args:
+        rate: Скорость пополнения (токенов в секунду)
+        capacity: Максимальный запас токенов
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self) -> float:
+        """Забирает токен без ожидания; возвращает 0 или сколько секунд ждать до токена"""
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                wait = self.try_acquire()
+                if not wait:
+                    return
+                await asyncio.sleep(wait)
+
+
+# Общий лимит исходящих запросов бота
+telegram_rate_limiter = TokenBucket(rate=GLOBAL_RATE, capacity=GLOBAL_RATE)
+
+
+def photo_file_id_from_link(photo_link: str):
+    """Достаёт file_id из ссылки вида tg://photo?file_id=... (формат photo_link работ)"""
+    if not photo_link or not photo_link.startswith("tg://photo"):
+        return None
+    values = parse_qs(urlparse(photo_link).query).get("file_id")
+    return values[0] if values else None
+
+
+async def call_with_retry(method, *args, attempts: int = 3, **kwargs):
+    """Вызывает метод бота, соблюдая общий лимит и паузу RetryAfter от Telegram"""
+    for attempt in range(attempts):
+        await telegram_rate_limiter.acquire()
+        try:
+            return await method(*args, **kwargs)
+        except Exception as e:
+            if RetryAfter is None or not isinstance(e, RetryAfter) or attempt == attempts - 1:
+                raise
+            logger.warning(f"⏳ Flood control Telegram: ждём {e.timeout} с")
+            await asyncio.sleep(e.timeout)
+
+
+async def send_photo_batch(bot, chat_ids: list, photo=None, file_id: str = None, caption: str = None, **kwargs) -> tuple:
+    """
+    Отправляет фотографию нескольким получателям
+
+    Если file_id известен, байты не отправляются вовсе. Иначе photo (файл/InputFile)
+    загружается первому получателю, а остальным отправляется полученный file_id.
+
+    Returns:
+        tuple: (file_id, {chat_id: Message или Exception})
+    """
+    results = {}
+    for chat_id in chat_ids:
+        try:
+            message = await call_with_retry(
+                bot.send_photo, chat_id=chat_id, photo=file_id or photo, caption=caption, **kwargs
+            )
+            results[chat_id] = message
+            if not file_id and getattr(message, "photo", None):
+                file_id = message.photo[-1].file_id
+        except Exception as e:
+            logger.error(f"❌ Не удалось отправить фото в чат {chat_id}: {e}")
+            results[chat_id] = e
+    return file_id, results
+
+
+def _is_group_chat(chat_id) -> bool:
+    try:
+        return int(chat_id) < 0
+    except (TypeError, ValueError):
+        # @username - канал или группа
+        return True
+
+
+def join_announcements(texts: list, limit: int = MAX_MESSAGE_LENGTH, separator: str = "\n\n") -> list:
+    """Склеивает короткие объявления в сообщения не длиннее limit символов"""
+    messages = []
+    current = ""
+    for text in texts:
+        if current and len(current) + len(separator) + len(text) <= limit:
+            current += separator + text
+        else:
+            if current:
+                messages.append(current)
+            current = text[:limit]
+    if current:
+        messages.append(current)
+    return messages
+
+
+class OutboundQueue:
+    """
+    Очередь исходящих сообщений бота
+
+    Задания сохраняются в JSONL-журнал (строка задания при постановке, строка
+    {"id", "done": true} после отправки), поэтому неотправленное переживает
+    перезапуск. Воркер соблюдает общий лимит и лимит каждого чата: пока один чат
+    ждёт своего токена, сообщения в другие чаты продолжают уходить.
+
+    Ставить задания может любой процесс (дозапись в журнал под flock), а отправляет
+    их единственный процесс с запущенным воркером: он дочитывает новые строки журнала.
+
+    Args:
+        path: Файл журнала заданий
+    """
+
+    METHODS = ("send_message", "send_photo", "send_media_group")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.global_bucket = telegram_rate_limiter
+        self._chat_buckets = {}
+        self._queues = {}
+        self._paused_until = {}
+        self._wakeup = None
+        self._task = None
+        self._bot = None
+        self._lock_path = path + ".lock"
+        # Позиция, до которой журнал уже прочитан воркером, и id заданий в памяти
+        self._offset = 0
+        self._inode = None
+        self._known_ids = set()
+
+    # --- журнал заданий ---
+
+    def _add_job(self, job: dict) -> None:
+        if job["id"] in self._known_ids:
+            return
+        self._known_ids.add(job["id"])
+        self._queues.setdefault(job["chat_id"], deque()).append(job)
+
+    def _read_log(self) -> list:
+        """Дочитывает журнал с запомненной позиции (только законченные строки)"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            self._offset = 0
+            self._inode = stat.st_ino
+        if stat.st_size == self._offset:
+            return []
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        complete = data[:data.rfind(b"\n") + 1]
+        self._offset += len(complete)
+        entries = []
+        for line in complete.decode("utf-8", errors="replace").splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"Пропущена повреждённая строка очереди сообщений: {line[:100]}")
+        return entries
+
+    def _load(self) -> None:
+        """Восстанавливает неотправленные задания и сжимает журнал (при запуске воркера)"""
+        jobs = {}
+        try:
+            with file_lock_sync(self._lock_path):
+                self._offset, self._inode = 0, None
+                for entry in self._read_log():
+                    if entry.get("done"):
+                        jobs.pop(entry.get("id"), None)
+                    else:
+                        jobs[entry.get("id")] = entry
+                # Переписываем журнал только с незавершёнными заданиями
+                self._rewrite_log(list(jobs.values()))
+        except Exception as e:
+            logger.error(f"Не удалось прочитать очередь сообщений {self.path}: {e}")
+            return
+        for job in jobs.values():
+            self._add_job(job)
+        if jobs:
+            logger.info(f"📬 Восстановлено неотправленных сообщений: {len(jobs)}")
+
+    def _poll_log(self) -> None:
+        """Забирает задания, поставленные другими процессами"""
+        try:
+            entries = self._read_log()
+        except Exception as e:
+            logger.error(f"Не удалось прочитать очередь сообщений {self.path}: {e}")
+            return
+        jobs = {}
+        for entry in entries:
+            if entry.get("done"):
+                # Задание уже отправлено (в т.ч. поставленное этим же процессом)
+                jobs.pop(entry.get("id"), None)
+            else:
+                jobs[entry.get("id")] = entry
+        for job in jobs.values():
+            self._add_job(job)
+
+    def _rewrite_log(self, jobs: list) -> None:
+        """Переписывает журнал (вызывается под блокировкой файла журнала)"""
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for job in jobs:
+                    f.write(json.dumps(job, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+            stat = os.stat(self.path)
+            self._offset, self._inode = stat.st_size, stat.st_ino
+        except Exception as e:
+            logger.error(f"Не удалось переписать очередь сообщений {self.path}: {e}")
+
+    def _append_log(self, entries: list) -> None:
+        try:
+            with file_lock_sync(self._lock_path):
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for entry in entries:
+                        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except Exception as e:
+            logger.error(f"Не удалось записать очередь сообщений {self.path}: {e}")
+
+    # --- постановка в очередь ---
+
+    def enqueue(self, chat_id, method: str, **params) -> str:
+        """
+        Ставит отправку в очередь (параметры должны сериализоваться в JSON)
+
+        Returns:
+            str: id задания
+        """
+        return self.enqueue_many([(chat_id, method, params)])[0]
+
+    def enqueue_many(self, items: list) -> list:
+        """Ставит в очередь несколько отправок одной записью в журнал: [(chat_id, method, params), ...]"""
+        jobs = []
+        for chat_id, method, params in items:
+            if method not in self.METHODS:
+                raise ValueError(f"Неподдерживаемый метод очереди: {method}")
+            jobs.append({"id": uuid.uuid4().hex, "chat_id": chat_id, "method": method, "params": params, "attempts": 0})
+        self._append_log(jobs)
+        if self._task is not None:
+            # Воркер в этом процессе - ставим сразу, не дожидаясь чтения журнала
+            for job in jobs:
+                self._add_job(job)
+            self._wakeup.set()
+        return [job["id"] for job in jobs]
+
+    def enqueue_announcements(self, chat_id, texts: list, **params) -> list:
+        """Объединяет текстовые объявления в один чат в минимальное число сообщений"""
+        return self.enqueue_many([
+            (chat_id, "send_message", dict(params, text=text)) for text in join_announcements(texts)
+        ])
+
+    def enqueue_photo_announcements(self, chat_id, photos: list, **params) -> list:
+        """
+        Объявления с фото (по file_id) - альбомами по MEDIA_GROUP_SIZE фото
+
+        Args:
+            photos: [{"photo": file_id, "caption": текст}, ...]
+        """
+        items = []
+        for start in range(0, len(photos), MEDIA_GROUP_SIZE):
+            group = [
+                {"photo": p["photo"], "caption": (p.get("caption") or "")[:MAX_CAPTION_LENGTH]}
+                for p in photos[start:start + MEDIA_GROUP_SIZE]
+            ]
+            if len(group) == 1:
+                items.append((chat_id, "send_photo", dict(params, **group[0])))
+            else:
+                items.append((chat_id, "send_media_group", dict(params, media=group)))
+        return self.enqueue_many(items)
+
+    def pending_count(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    # --- воркер ---
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            rate = GROUP_CHAT_RATE if _is_group_chat(chat_id) else PRIVATE_CHAT_RATE
+            bucket = TokenBucket(rate=rate, capacity=1)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _call(self, job: dict):
+        params = dict(job["params"])
+        if job["method"] == "send_media_group":
+            from aiogram.types import InputMediaPhoto
+            params["media"] = [InputMediaPhoto(media=m["photo"], caption=m.get("caption")) for m in params["media"]]
+        method = getattr(self._bot, job["method"])
+        return await method(chat_id=job["chat_id"], **params)
+
+    def _next_ready(self):
+        """Выбирает чат, в который можно отправить сейчас; иначе - сколько ждать"""
+        now = time.monotonic()
+        wait = None
+        for chat_id, queue in self._queues.items():
+            if not queue:
+                continue
+            paused = self._paused_until.get(chat_id, 0) - now
+            chat_wait = paused if paused > 0 else self._chat_bucket(chat_id).try_acquire()
+            if not chat_wait:
+                return chat_id, 0
+            wait = chat_wait if wait is None else min(wait, chat_wait)
+        return None, wait
+
+    async def _send(self, chat_id) -> None:
+        queue = self._queues[chat_id]
+        job = queue[0]
+        await self.global_bucket.acquire()
+        try:
+            await self._call(job)
+        except Exception as e:
+            if RetryAfter is not None and isinstance(e, RetryAfter):
+                logger.warning(f"⏳ Flood control Telegram для чата {chat_id}: пауза {e.timeout} с")
+                self._paused_until[chat_id] = time.monotonic() + e.timeout
+                return
+            job["attempts"] = job.get("attempts", 0) + 1
+            if isinstance(e, PERMANENT_ERRORS) or job["attempts"] >= MAX_SEND_ATTEMPTS:
+                logger.error(f"❌ Сообщение в чат {chat_id} не отправлено ({job['method']}): {e}")
+            else:
+                # Временная ошибка (сеть и т.п.) - повторим позже с нарастающей паузой
+                logger.warning(f"⚠️ Ошибка отправки в чат {chat_id}, попытка {job['attempts']}: {e}")
+                self._paused_until[chat_id] = time.monotonic() + 2 ** job["attempts"]
+                return
+        queue.popleft()
+        if not queue:
+            del self._queues[chat_id]
+        self._known_ids.discard(job["id"])
+        self._append_log([{"id": job["id"], "done": True}])
+        if not self._queues:
+            with file_lock_sync(self._lock_path):
+                # Другой процесс мог дописать задания - очищаем журнал, только если их нет
+                self._poll_log()
+                if not self._queues:
+                    self._rewrite_log([])
+
+    async def _run(self) -> None:
+        while True:
+            chat_id, wait = self._next_ready()
+            if chat_id is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(wait or OUTBOUND_POLL_INTERVAL, OUTBOUND_POLL_INTERVAL))
+                except asyncio.TimeoutError:
+                    pass
+                self._poll_log()
+                continue
+            try:
+                await self._send(chat_id)
+            except Exception as e:
+                logger.error(f"Ошибка воркера очереди сообщений: {e}", exc_info=True)
+
+    def start(self, bot) -> None:
+        """Запускает воркер (ровно в одном процессе, вызывается один раз при старте)"""
+        self._load()
+        self._bot = bot
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="outbound-messages")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            session = await self._bot.get_session()
+            if session:
+                await session.close()
+        except Exception:
+            pass
+
+
+# Общая очередь исходящих уведомлений (воркер запускается в процессе с фоновыми задачами, см. bot.py)
+outbound_queue = OutboundQueue(os.path.join(os.path.dirname(os.path.abspath(__file__)), "outbound_messages.jsonl"))
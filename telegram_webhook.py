@@ -0,0 +1,110 @@
+"""
+Приём обновлений Telegram через webhook (альтернатива long polling)
+
+- обновления приходят POST-запросом на WEBHOOK_PATH того же FastAPI-приложения
+- запрос принимается, только если заголовок X-Telegram-Bot-Api-Secret-Token
+  совпадает с секретом, переданным в setWebhook
+- обработчик запроса только кладёт обновление в ограниченную очередь и сразу
+  отвечает 200; обновления обрабатывает фиксированный пул воркеров dp.process_update
+- если очередь заполнена, отвечаем 503 - Telegram повторит доставку позже
+
+Порядок обработки обновлений разных воркеров не гарантируется (как и при
+параллельной обработке в polling-режиме aiogram).
+"""
+import asyncio
+import hmac
+import logging
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookUpdateQueue:
+    """
+    Очередь обновлений и пул воркеров, передающих их в диспетчер aiogram
+
+    Args:
+        dp: Dispatcher aiogram
+        workers: Количество воркеров (одновременно обрабатываемых обновлений)
+        queue_size: Максимальное количество ожидающих обработки обновлений
+    """
+
+    def __init__(self, dp, workers: int = 8, queue_size: int = 1000):
+        self.dp = dp
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def put_nowait(self, update_data: dict) -> bool:
+        """Ставит обновление в очередь; False - очередь заполнена"""
+        try:
+            self.queue.put_nowait(update_data)
+            return True
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+
+    async def _process(self, update_data: dict) -> None:
+        from aiogram import Bot, Dispatcher, types
+        # Воркеры - отдельные задачи: контекст бота и диспетчера задаём явно
+        Bot.set_current(self.dp.bot)
+        Dispatcher.set_current(self.dp)
+        await self.dp.process_update(types.Update(**update_data))
+
+    async def _worker(self) -> None:
+        while True:
+            update_data = await self.queue.get()
+            try:
+                await self._process(update_data)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ошибка обработки обновления {update_data.get('update_id')}: {e}", exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    def start(self) -> None:
+        for number in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"webhook-worker-{number}"))
+
+    async def stop(self, drain_timeout: float = 10) -> None:
+        """Дожидается обработки принятых обновлений (не дольше drain_timeout) и останавливает воркеры"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не обработано обновлений при остановке: {self.queue.qsize()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def register_webhook_route(app, path: str, secret: str, update_queue: WebhookUpdateQueue) -> None:
+    """Добавляет в FastAPI-приложение эндпоинт приёма обновлений"""
+    from fastapi import Request
+    from fastapi.responses import Response
+
+    @app.post(path, include_in_schema=False)
+    async def telegram_webhook(request: Request):
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token, secret):
+            return Response(status_code=403)
+        try:
+            update_data = await request.json()
+        except Exception:
+            return Response(status_code=400)
+        if not update_queue.put_nowait(update_data):
+            logger.warning("⚠️ Очередь обновлений webhook заполнена, Telegram повторит доставку")
+            return Response(status_code=503)
+        return Response(status_code=200)
+
+
+async def setup_webhook(bot, url: str, secret: str, allowed_updates: list) -> None:
+    """Регистрирует webhook в Telegram"""
+    await bot.set_webhook(url, secret_token=secret, allowed_updates=allowed_updates)
+    logger.info(f"🔗 Webhook установлен: {url}")
+
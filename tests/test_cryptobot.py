@@ -0,0 +1,147 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import cryptobot
+from cryptobot import CryptoBotClient, CryptoBotError
+
+
+class FakeCryptoBot:
+    """
+    Локальный сервер Crypto Pay API: createInvoice, getInvoices, getMe, getCurrencies
+
+    failures - очередь ответов, которые сервер вернёт вместо успешных
+    (HTTP-статус или "timeout" - ответ дольше таймаута клиента).
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.failures = []
+        self.invoices = {}
+        app = web.Application()
+        app.router.add_route("*", "/api/{method}", self.handle)
+        self.server = TestServer(app)
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.calls.append(method)
+        if self.failures:
+            failure = self.failures.pop(0)
+            if failure == "timeout":
+                await asyncio.sleep(1)
+            else:
+                return web.Response(status=failure)
+        if method == "createInvoice":
+            data = await request.json()
+            invoice_id = len(self.invoices) + 1
+            self.invoices[invoice_id] = {"invoice_id": invoice_id, "status": "active", "amount": data["amount"]}
+            return web.json_response({"ok": True, "result": self.invoices[invoice_id]})
+        if method == "getInvoices":
+            ids = [int(invoice_id) for invoice_id in request.query["invoice_ids"].split(",")]
+            items = [self.invoices[invoice_id] for invoice_id in ids if invoice_id in self.invoices]
+            return web.json_response({"ok": True, "result": {"items": items}})
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {"app_id": 1, "name": "test"}})
+        if method == "getCurrencies":
+            return web.json_response({"ok": True, "result": [{"code": "TON"}]})
+        return web.json_response({"ok": False, "error": {"name": "METHOD_NOT_FOUND"}})
+
+
+def run_with_server(test, monkeypatch):
+    monkeypatch.setattr(cryptobot, "RETRY_BASE_DELAY", 0)
+
+    async def main():
+        fake = FakeCryptoBot()
+        await fake.server.start_server()
+        client = CryptoBotClient("token", str(fake.server.make_url("/api")))
+        try:
+            await test(fake, client)
+        finally:
+            await client.close()
+            await fake.server.close()
+
+    asyncio.run(main())
+
+
+def test_get_invoices_is_batched(monkeypatch):
+    async def test(fake, client):
+        fake.invoices = {invoice_id: {"invoice_id": invoice_id, "status": "paid"} for invoice_id in range(1, 251)}
+        invoices = await client.get_invoices(list(range(1, 251)) + [999])
+        assert len(invoices) == 250
+        assert fake.calls == ["getInvoices"] * 3
+
+    run_with_server(test, monkeypatch)
+
+
+def test_idempotent_request_is_retried_on_429_and_5xx(monkeypatch):
+    async def test(fake, client):
+        fake.failures = [429, 502]
+        assert (await client.get_me())["name"] == "test"
+        assert fake.calls == ["getMe"] * 3
+
+    run_with_server(test, monkeypatch)
+
+
+def test_retries_are_limited(monkeypatch):
+    async def test(fake, client):
+        fake.failures = [500] * cryptobot.MAX_ATTEMPTS
+        try:
+            await client.get_currencies()
+        except CryptoBotError as e:
+            assert "HTTP 500" in str(e)
+        else:
+            raise AssertionError("CryptoBotError expected")
+        assert len(fake.calls) == cryptobot.MAX_ATTEMPTS
+
+    run_with_server(test, monkeypatch)
+
+
+def test_create_invoice_is_retried_on_429(monkeypatch):
+    async def test(fake, client):
+        fake.failures = [429]
+        invoice = await client.create_invoice(1.5)
+        assert invoice["invoice_id"] == 1
+        assert fake.calls == ["createInvoice"] * 2
+
+    run_with_server(test, monkeypatch)
+
+
+def test_create_invoice_is_not_retried_after_5xx(monkeypatch):
+    async def test(fake, client):
+        fake.failures = [500]
+        try:
+            await client.create_invoice(1.5)
+        except CryptoBotError:
+            pass
+        else:
+            raise AssertionError("CryptoBotError expected")
+        assert fake.calls == ["createInvoice"]
+
+    run_with_server(test, monkeypatch)
+
+
+def test_create_invoice_is_not_retried_after_timeout(monkeypatch):
+    monkeypatch.setattr(cryptobot, "REQUEST_TIMEOUT", 0.2)
+
+    async def test(fake, client):
+        fake.failures = ["timeout"]
+        try:
+            await client.create_invoice(1.5)
+        except CryptoBotError:
+            pass
+        else:
+            raise AssertionError("CryptoBotError expected")
+        assert fake.calls == ["createInvoice"]
+
+    run_with_server(test, monkeypatch)
+
+
+def test_info_requests_are_cached(monkeypatch):
+    async def test(fake, client):
+        for _ in range(3):
+            await client.get_me()
+            await client.get_currencies()
+        assert sorted(fake.calls) == ["getCurrencies", "getMe"]
+
+    run_with_server(test, monkeypatch)
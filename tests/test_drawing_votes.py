@@ -0,0 +1,72 @@
+from drawing_votes import VoteIndex, average_score, rank_results
+
+
+def _result(number, average, votes):
+    return {"work_number": number, "average_score": average, "votes_count": votes}
+
+
+def test_rank_results_orders_by_average_then_votes_then_number():
+    results = [
+        _result(1, 4.0, 2),
+        _result(2, 4.5, 1),
+        _result(3, 4.0, 5),
+        _result(4, 4.0, 2),
+    ]
+    ranked = rank_results(results, "work_number")
+    assert [r["work_number"] for r in ranked] == [2, 3, 1, 4]
+
+
+def test_rank_results_places_are_sequential_for_ties():
+    results = [_result(3, 5.0, 1), _result(1, 5.0, 1), _result(2, 5.0, 1)]
+    ranked = rank_results(results, "work_number")
+    assert [(r["work_number"], r["place"]) for r in ranked] == [(1, 1), (2, 2), (3, 3)]
+
+
+def test_rank_results_puts_works_without_votes_last():
+    results = [
+        _result(1, average_score(0, 0), 0),
+        _result(2, average_score(3, 1), 1),
+        _result(3, average_score(0, 0), 0),
+    ]
+    ranked = rank_results(results, "work_number")
+    assert [(r["work_number"], r["place"]) for r in ranked] == [(2, 1), (1, 2), (3, 3)]
+    assert ranked[1]["average_score"] == 0.0
+
+
+def test_rank_results_uses_number_key():
+    results = [
+        {"collection_number": 2, "average_score": 3.0, "votes_count": 1},
+        {"collection_number": 1, "average_score": 3.0, "votes_count": 1},
+    ]
+    ranked = rank_results(results, "collection_number")
+    assert [r["collection_number"] for r in ranked] == [1, 2]
+
+
+def _drawing_index():
+    works = [
+        {"work_number": 1, "local_path": "a.jpg", "participant_user_id": 10, "votes": {"20": 4}},
+        {"work_number": 2, "local_path": "b.jpg", "participant_user_id": 11},
+    ]
+    return VoteIndex.for_drawing(works)
+
+
+def test_vote_index_builds_totals_from_document():
+    vote_index = _drawing_index()
+    assert vote_index.aggregate("votes", 1) == (4, 1)
+    assert vote_index.aggregate("votes", 2) == (0, 0)
+
+
+def test_vote_index_add_vote_replaces_previous_score_in_totals():
+    vote_index = _drawing_index()
+    vote_index.add_vote("votes", 21, 1, 2)
+    assert vote_index.aggregate("votes", 1) == (6, 2)
+
+    vote_index.add_vote("votes", 21, 1, 5)
+    assert vote_index.aggregate("votes", 1) == (9, 2)
+    assert vote_index.is_rated("votes", 21, 1)
+
+
+def test_vote_index_standings_rank_zero_vote_works_last():
+    vote_index = _drawing_index()
+    standings = vote_index.standings("votes")
+    assert [(r["work_number"], r["place"], r["votes_count"]) for r in standings] == [(1, 1, 1), (2, 2, 0)]
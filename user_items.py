@@ -0,0 +1,107 @@
+"""
+Купленные товары пользователей (таблица user_items)
+
+Каждая покупка - отдельная строка с уникальным индексом (user_id, category, item_id):
+- добавление - INSERT ... ON CONFLICT DO NOTHING, поэтому параллельные покупки
+  не перезаписывают друг друга, а повторная покупка ничего не меняет
+- проверка владения - выборка по индексу, без разбора JSON
+- список покупок отдаётся в прежнем формате {"themes": [...], "avatarStars": [...], "nftGifts": [...]}
+
+Раньше покупки хранились JSON-документом в users.purchased_items; миграция 9
+переносит их в user_items, столбец больше не записывается.
+"""
+import json
+
+from sqlalchemy.future import select
+
+from db import read_session, upsert_insert
+from models import UserItem, utcnow_naive
+
+ITEM_CATEGORIES = ("themes", "avatarStars", "nftGifts")
+
+
+def empty_purchased_items() -> dict:
+    return {category: [] for category in ITEM_CATEGORIES}
+
+
+def parse_purchased_items(value) -> dict:
+    """Покупки из старого JSON-столбца users.purchased_items (строка или dict)"""
+    while isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except (TypeError, ValueError):
+            return {}
+    return value if isinstance(value, dict) else {}
+
+
+async def add_user_item(session, user_id: int, category: str, item_id) -> bool:
+    """
+    Добавляет покупку в транзакции вызывающего кода
+
+    Returns:
+        bool: True - товар добавлен, False - уже был куплен
+    """
+    result = await session.execute(
+        upsert_insert(UserItem)
+        .values(user_id=int(user_id), category=category, item_id=str(item_id), created_at=utcnow_naive())
+        .on_conflict_do_nothing(index_elements=["user_id", "category", "item_id"])
+    )
+    return result.rowcount == 1
+
+
+async def has_user_item(session, user_id: int, category: str, item_id) -> bool:
+    result = await session.execute(
+        select(UserItem.id).where(
+            UserItem.user_id == int(user_id),
+            UserItem.category == category,
+            UserItem.item_id == str(item_id),
+        )
+    )
+    return result.first() is not None
+
+
+async def get_purchased_items(user_id: int, session=None) -> dict:
+    """Покупки пользователя: {категория: [item_id, ...]}"""
+    items = await get_purchased_items_bulk([user_id], session=session)
+    return items[int(user_id)]
+
+
+async def get_purchased_items_bulk(user_ids: list, session=None) -> dict:
+    """
+    Покупки нескольких пользователей одним запросом
+
+    Returns:
+        dict: {user_id: {категория: [item_id, ...]}} для каждого переданного user_id
+    """
+    user_ids = [int(user_id) for user_id in dict.fromkeys(user_ids)]
+    items = {user_id: empty_purchased_items() for user_id in user_ids}
+    if not user_ids:
+        return items
+    statement = (
+        select(UserItem.user_id, UserItem.category, UserItem.item_id)
+        .where(UserItem.user_id.in_(user_ids))
+        .order_by(UserItem.id)
+    )
+    if session is None:
+        async with read_session() as read:
+            rows = (await read.execute(statement)).all()
+    else:
+        rows = (await session.execute(statement)).all()
+    for user_id, category, item_id in rows:
+        items[user_id].setdefault(category, []).append(item_id)
+    return items
+
+
+async def owned_items(user_id: int, category: str, item_ids: list) -> set:
+    """Какие из item_ids категории уже куплены пользователем (одним запросом)"""
+    if not item_ids:
+        return set()
+    async with read_session() as session:
+        result = await session.execute(
+            select(UserItem.item_id).where(
+                UserItem.user_id == int(user_id),
+                UserItem.category == category,
+                UserItem.item_id.in_([str(item_id) for item_id in item_ids]),
+            )
+        )
+        return {row[0] for row in result.all()}
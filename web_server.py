@@ -1,19 +1,32 @@
 from models import User, Giveaway, Message, Winner, Participant
-from sqlalchemy import insert, update, text, func
+from sqlalchemy import insert, update, text, func, or_
 from datetime import datetime, timezone
-from fastapi import Request, HTTPException
+from fastapi import Request, HTTPException, Depends
 from fastapi import FastAPI, Query
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi import UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import contextlib
 from typing import Optional, Union
 import hashlib
 from sqlalchemy.future import select
-from db import async_session, init_db, IS_SQLITE
+from db import async_session, read_session, init_db, IS_SQLITE, has_column
 from models import User
-from config import CREATOR_ID, BOT_TOKEN, TON_WALLET, CRYPTOBOT_API_TOKEN, CRYPTOBOT_API_URL, SEE_TG_API_KEY
+from cache import profile_stats_cache, get_contests_version, bump_contests_version
+from shared_state import FileLock, shared_path, file_signature
+from config import APP_ROLE, CREATOR_ID, BOT_TOKEN, TON_WALLET, CRYPTOBOT_API_TOKEN, CRYPTOBOT_API_URL, SEE_TG_API_KEY
 import cryptobot
+import payments
+from ledger import LedgerError, InsufficientCoins, apply_coin_delta, get_balance
+import user_items
+import auth_session
+from webapp_auth import WebAppUser, current_user
+from drawing_votes import VoteIndex, VoteLog, average_score, rank_results
+from contest_events import contest_event_bus
+from blob_store import BlobStore, referenced_paths
+from telegram_sender import send_photo_batch, outbound_queue
+from image_pipeline import spool_upload, process_image, make_derivatives, remove_quietly, shutdown_executor, UploadTooLarge, ImageQueueFull
 import pytz
 import os
 import json
@@ -39,12 +52,50 @@ except ImportError:
 logger = logging.getLogger(__name__)
 MSK_TZ = pytz.timezone('Europe/Moscow')
 
+async def start_background_jobs() -> list:
+    """
+    Фоновые задачи, которые должны работать ровно в одном процессе
+
+    Запускаются в lifespan при APP_ROLE=all и в процессе бота при APP_ROLE=bot;
+    воркеры uvicorn (APP_ROLE=web) их не запускают.
+    """
+    tasks = [
+        asyncio.create_task(votes_compaction_loop(), name="votes-compaction"),
+        asyncio.create_task(drawing_blobs_maintenance_loop(), name="drawing-blobs-maintenance"),
+        asyncio.create_task(payments.payments_reconcile_loop(), name="payments-reconcile"),
+    ]
+    # Очередь исходящих уведомлений (досылает и сохранённые до перезапуска)
+    outbound_queue.start(Bot(token=BOT_TOKEN))
+    return tasks
+
+
+async def stop_background_jobs(tasks: list) -> None:
+    await outbound_queue.stop()
+    for task in tasks:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    await compact_drawing_votes()
+    await compact_collection_votes()
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan-хук для инициализации БД при старте FastAPI"""
     await init_db()
     logger.info("✅ База данных инициализирована при запуске веб-сервера")
+    # Live-таблицы лидеров обслуживает каждый воркер для своих подписчиков
+    events_task = asyncio.create_task(contest_events_loop(), name="contest-events")
+    background_tasks = await start_background_jobs() if APP_ROLE == "all" else []
     yield
+    if APP_ROLE == "all":
+        await stop_background_jobs(background_tasks)
+    events_task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await events_task
+    shutdown_executor()
+    await cryptobot.cryptobot_client.close()
+    await auth_session.close_bot()
 
 app = FastAPI(lifespan=lifespan)
 # ВАЖНО: Для загрузки больших файлов нужно:
@@ -65,47 +116,133 @@ app.add_middleware(
 
 # ------------------- WEB -------------------
 
-def get_file_with_no_cache(file_path: str) -> FileResponse:
-    """Возвращает FileResponse с заголовками для предотвращения кэширования"""
-    response = FileResponse(file_path)
-    # Добавляем заголовки для предотвращения кэширования
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate, max-age=0"
-    response.headers["Pragma"] = "no-cache"
-    response.headers["Expires"] = "0"
-    # Добавляем ETag на основе времени изменения файла
-    if os.path.exists(file_path):
+# Собранная статика (см. build_static.py). Если сборки нет - отдаём исходные файлы.
+STATIC_BUILD_DIR = os.path.join(ROOT_DIR, "static_build")
+STATIC_MANIFEST_FILE = os.path.join(STATIC_BUILD_DIR, "manifest.json")
+_static_manifest = {"mtime": None, "entries": {}}
+# ETag исходных файлов (когда сборки нет): {путь: (mtime, etag)}
+_source_etags = {}
+
+
+def _get_static_manifest() -> dict:
+    """Читает manifest.json сборки статики (перечитывается только при изменении файла)"""
+    try:
+        mtime = os.path.getmtime(STATIC_MANIFEST_FILE)
+    except OSError:
+        return {}
+    if _static_manifest["mtime"] != mtime:
+        try:
+            with open(STATIC_MANIFEST_FILE, "r", encoding="utf-8") as f:
+                _static_manifest["entries"] = json.load(f)
+            _static_manifest["mtime"] = mtime
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось прочитать манифест статики: {e}")
+            return {}
+    return _static_manifest["entries"]
+
+
+def _source_file_etag(file_path: str) -> Optional[str]:
+    """ETag исходного файла по содержимому (пересчитывается только при изменении mtime)"""
+    try:
         mtime = os.path.getmtime(file_path)
-        etag = hashlib.md5(f"{file_path}{mtime}".encode()).hexdigest()
-        response.headers["ETag"] = etag
-    return response
+    except OSError:
+        return None
+    cached = _source_etags.get(file_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(file_path, "rb") as f:
+        etag = hashlib.md5(f.read()).hexdigest()
+    _source_etags[file_path] = (mtime, etag)
+    return etag
+
+
+def _pick_encoding(request: Request, encodings: list) -> Optional[str]:
+    """Выбирает предсжатый вариант по Accept-Encoding (brotli предпочтительнее gzip)"""
+    accept_encoding = request.headers.get("accept-encoding", "")
+    for encoding in ("br", "gzip"):
+        if encoding in encodings and encoding in accept_encoding:
+            return encoding
+    return None
+
+
+def serve_static_file(request: Request, file_path: str, etag: Optional[str], cache_control: str,
+                      encodings: Optional[list] = None) -> Response:
+    """
+    Отдаёт статический файл с ETag, обработкой If-None-Match (304)
+    и предсжатым вариантом (.br / .gz), если он есть
+    """
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    headers = {"Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if etag:
+        headers["ETag"] = f'"{etag}"'
+        if_none_match = request.headers.get("if-none-match", "")
+        if headers["ETag"] in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+    media_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+    encoding = _pick_encoding(request, encodings or [])
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        suffix = ".br" if encoding == "br" else ".gz"
+        return FileResponse(file_path + suffix, media_type=media_type, headers=headers)
+    return FileResponse(file_path, media_type=media_type, headers=headers)
+
+
+def serve_page(request: Request, file_name: str) -> Response:
+    """
+    Отдаёт HTML-оболочку (или style.css/script.js) с дешёвой ревалидацией:
+    браузер хранит копию, но каждый раз проверяет ETag и получает 304, если файл не менялся
+    """
+    entry = _get_static_manifest().get(file_name)
+    if entry:
+        return serve_static_file(
+            request,
+            os.path.join(STATIC_BUILD_DIR, entry["file"]),
+            entry.get("etag"),
+            "no-cache",
+            entry.get("encodings"),
+        )
+    file_path = os.path.join(ROOT_DIR, file_name)
+    return serve_static_file(request, file_path, _source_file_etag(file_path), "no-cache")
 
 @app.get("/")
-async def root():
+async def root(request: Request):
     """Главная страница WebApp"""
-    index_path = os.path.join(ROOT_DIR, "index.html")
-    return get_file_with_no_cache(index_path)
+    return serve_page(request, "index.html")
 
 @app.get("/creator.html")
-async def get_creator():
-    return get_file_with_no_cache(os.path.join(ROOT_DIR, "creator.html"))
+async def get_creator(request: Request):
+    return serve_page(request, "creator.html")
 
 @app.get("/admin.html")
-async def get_admin():
-    return get_file_with_no_cache(os.path.join(ROOT_DIR, "admin.html"))
+async def get_admin(request: Request):
+    return serve_page(request, "admin.html")
 
 @app.get("/user.html")
-async def get_user():
-    return get_file_with_no_cache(os.path.join(ROOT_DIR, "user.html"))
+async def get_user(request: Request):
+    return serve_page(request, "user.html")
 
 @app.get("/style.css")
-async def get_css():
+async def get_css(request: Request):
     """CSS напрямую из корня"""
-    return get_file_with_no_cache(os.path.join(ROOT_DIR, "style.css"))
+    return serve_page(request, "style.css")
 
 @app.get("/script.js")
-async def get_js():
+async def get_js(request: Request):
     """JS напрямую из корня"""
-    return get_file_with_no_cache(os.path.join(ROOT_DIR, "script.js"))
+    return serve_page(request, "script.js")
+
+@app.get("/assets/{asset_name}")
+async def get_asset(asset_name: str, request: Request):
+    """Вынесенные при сборке CSS/JS: имя содержит хэш содержимого, поэтому кэшируются навсегда"""
+    if "/" in asset_name or "\\" in asset_name or asset_name.startswith("."):
+        raise HTTPException(status_code=404, detail="File not found")
+    asset_path = os.path.join(STATIC_BUILD_DIR, "assets", asset_name)
+    encodings = [encoding for encoding, suffix in (("br", ".br"), ("gzip", ".gz")) if os.path.exists(asset_path + suffix)]
+    # Хэш содержимого уже в имени файла: "<страница>-<n>.<хэш>.<ext>"
+    name_parts = asset_name.split(".")
+    etag = name_parts[-2] if len(name_parts) >= 3 else None
+    return serve_static_file(request, asset_path, etag, "public, max-age=31536000, immutable", encodings)
 
 @app.get("/monkeyscoin.png")
 async def get_monkeyscoin():
@@ -174,63 +311,30 @@ def to_datetime_local(value: Optional[Union[str, datetime]]) -> Optional[str]:
 async def health_check():
     return {"status": "ok", "message": "FastAPI работает 🚀"}
 
-async def check_subscription_to_channel_web(user_id: int, channel_username: str) -> bool:
-    """Проверяет подписку пользователя на канал (для веб-сервера)"""
-    bot = None
-    try:
-        bot = Bot(token=BOT_TOKEN)
-        # Добавляем таймаут 5 секунд для проверки подписки
-        try:
-            member = await asyncio.wait_for(
-                bot.get_chat_member(channel_username, user_id),
-                timeout=5.0
-            )
-            return member.status in ['member', 'administrator', 'creator']
-        except asyncio.TimeoutError:
-            logger.warning(f"Таймаут при проверке подписки на {channel_username} для пользователя {user_id}")
-            # При таймауте считаем, что пользователь подписан (чтобы не блокировать доступ)
-            return True
-    except Exception as e:
-        logger.warning(f"Ошибка проверки подписки на {channel_username}: {e}")
-        # При ошибке считаем, что пользователь подписан (чтобы не блокировать доступ)
-        return True
-    finally:
-        if bot:
-            try:
-                session = await bot.get_session()
-                if session:
-                    await session.close()
-            except Exception as e:
-                logger.warning(f"Ошибка при закрытии сессии бота: {e}")
-
 @app.get("/api/auth")
-async def auth_user(tg_id: int = Query(...)):
+async def auth_user(tg_id: int = Query(...), session_token: Optional[str] = Query(None)):
+    """
+    Авторизация при запуске WebApp
+    
+    При действующем токене сессии (выдаётся в ответе) и данных в кэше ответ
+    собирается без запросов к Telegram и БД; username и подписка обновляются в фоне
+    (см. auth_session.py).
+    """
     try:
-        logger.info(f"🔐 Запрос авторизации для пользователя {tg_id}")
+        token_data = auth_session.verify_session_token(session_token) if session_token else None
+        has_session = token_data is not None and token_data.get("uid") == tg_id
         
-        # Получаем username из Telegram Bot API
-        username = None
-        bot = None
-        try:
-            bot = Bot(token=BOT_TOKEN)
-            # Для пользователей используем get_chat_member или get_chat
-            try:
-                user_info = await asyncio.wait_for(bot.get_chat(tg_id), timeout=5.0)
-                username = getattr(user_info, 'username', None) or getattr(user_info, 'first_name', None)
-            except asyncio.TimeoutError:
-                logger.warning(f"Таймаут получения данных пользователя {tg_id} через Bot API, пропускаем username")
-            except Exception as inner_exc:
-                logger.warning(f"Не удалось получить username пользователя {tg_id}: {inner_exc}")
-        except Exception as e:
-            logger.warning(f"Не удалось инициализировать бота для пользователя {tg_id}: {e}")
-        finally:
-            if bot:
-                try:
-                    session_bot = await bot.get_session()
-                    if session_bot:
-                        await session_bot.close()
-                except Exception as close_exc:
-                    logger.warning(f"Ошибка при закрытии сессии бота (auth_user): {close_exc}")
+        if has_session:
+            profile = auth_session.get_cached_profile(tg_id, check_channel=tg_id != CREATOR_ID)
+            if profile is not None:
+                return {
+                    "authorized": True,
+                    "telegram_id": tg_id,
+                    "role": profile["role"],
+                    "session_token": auth_session.issue_session_token(tg_id, profile["role"]),
+                }
+        
+        logger.info(f"🔐 Запрос авторизации для пользователя {tg_id}")
         
         async with async_session() as session:
             result = await session.execute(select(User).where(User.telegram_id == tg_id))
@@ -239,57 +343,47 @@ async def auth_user(tg_id: int = Query(...)):
             # Bootstrap creator on first login if needed
             if not user and tg_id == CREATOR_ID:
                 logger.info(f"👤 Создание пользователя-создателя {tg_id}")
-                user = User(telegram_id=tg_id, role="creator", username=username, created_at=datetime.now(timezone.utc))
+                user = User(telegram_id=tg_id, role="creator", created_at=datetime.now(timezone.utc))
                 session.add(user)
                 await session.commit()
 
             if not user:
                 logger.warning(f"❌ Пользователь {tg_id} не найден")
                 return {"authorized": False, "message": "Пользователь не найден"}
+            
+            role = user.role
+            username = user.username
 
-            # Обновляем username если он изменился или отсутствует
-            if username and (not user.username or user.username != username):
-                user.username = username
-                await session.commit()
-                logger.info(f"✅ Обновлен username для пользователя {tg_id}: {username}")
-
-            logger.info(f"✅ Пользователь {tg_id} найден, роль: {user.role}")
+        logger.info(f"✅ Пользователь {tg_id} найден, роль: {role}")
 
-            # Проверяем подписку на обязательный канал (кроме создателя)
-            channel_username = "@monkeys_giveaways"
-            is_subscribed = True  # По умолчанию для создателя
-            
-            if tg_id != CREATOR_ID:
-                logger.info(f"🔍 Проверка подписки для пользователя {tg_id} при входе в приложение")
-                try:
-                    # Добавляем общий таймаут для всей проверки подписки
-                    is_subscribed = await asyncio.wait_for(
-                        check_subscription_to_channel_web(tg_id, channel_username),
-                        timeout=5.0  # Уменьшаем таймаут до 5 секунд
-                    )
-                    logger.info(f"📊 Результат проверки подписки при входе в приложение для {tg_id}: {is_subscribed}")
-                    
-                    if not is_subscribed:
-                        logger.warning(f"⚠️ Пользователь {tg_id} не подписан на канал {channel_username}")
-                        return {
-                            "authorized": False,
-                            "message": f"Для пользования приложением необходимо подписаться на канал {channel_username}. Пожалуйста, подпишитесь и отправьте команду /start в боте."
-                        }
-                except asyncio.TimeoutError:
-                    logger.warning(f"⏰ Таймаут при проверке подписки для пользователя {tg_id}, разрешаем доступ")
-                    # При таймауте разрешаем доступ, чтобы не блокировать пользователя
-                    is_subscribed = True
-                except Exception as e:
-                    logger.error(f"❌ Критическая ошибка при проверке подписки для {tg_id}: {e}", exc_info=True)
-                    # При критической ошибке разрешаем доступ
-                    is_subscribed = True
+        if has_session:
+            # Подписка проверялась при выдаче токена - обновляем данные в фоне
+            auth_session.cache_profile(tg_id, role, username)
+            auth_session.schedule_refresh(tg_id, check_channel=tg_id != CREATOR_ID)
+        else:
+            # Проверяем подписку на обязательный канал (кроме создателя) и получаем username
+            telegram_username, is_subscribed = await auth_session.fetch_telegram_profile(
+                tg_id, check_channel=tg_id != CREATOR_ID
+            )
+            if not is_subscribed:
+                channel_username = auth_session.REQUIRED_CHANNEL
+                logger.warning(f"⚠️ Пользователь {tg_id} не подписан на канал {channel_username}")
+                return {
+                    "authorized": False,
+                    "message": f"Для пользования приложением необходимо подписаться на канал {channel_username}. Пожалуйста, подпишитесь и отправьте команду /start в боте."
+                }
+            if telegram_username and telegram_username != username:
+                await auth_session.save_username(tg_id, telegram_username)
+                username = telegram_username
+            auth_session.cache_profile(tg_id, role, username)
 
-            logger.info(f"✅ Авторизация успешна для пользователя {tg_id}, роль: {user.role}")
-            return {
-                "authorized": True,
-                "telegram_id": user.telegram_id,
-                "role": user.role,
-            }
+        logger.info(f"✅ Авторизация успешна для пользователя {tg_id}, роль: {role}")
+        return {
+            "authorized": True,
+            "telegram_id": tg_id,
+            "role": role,
+            "session_token": auth_session.issue_session_token(tg_id, role),
+        }
     except Exception as e:
         logger.error(f"❌ Критическая ошибка в auth_user для {tg_id}: {e}", exc_info=True)
         # В случае критической ошибки возвращаем отказ в доступе
@@ -302,7 +396,7 @@ async def auth_user(tg_id: int = Query(...)):
 
 @app.get("/api/admins")
 async def list_admins():
-    async with async_session() as session:
+    async with read_session() as session:
         result = await session.execute(select(User).where(User.role == "admin"))
         admins = result.scalars().all()
         return [{"id": u.telegram_id, "role": u.role} for u in admins]
@@ -353,10 +447,70 @@ async def add_admin(request: Request):
                 )
                 session.add(user)
             await session.commit()
+        bump_contests_version()
+        auth_session.invalidate_profile(tg_id)
         return {"success": True, "message": f"Admin {tg_id} added successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+async def _load_profile_stats(session, telegram_id: int) -> tuple:
+    """
+    Считает (участия, победы) пользователя фиксированным числом запросов
+    
+    - участия в рисунках/коллекциях: один COUNT с JOIN на giveaways
+    - участия в рандом соо: уникальные посты из комментариев пользователя
+      сопоставляются с post_link конкурсов (один запрос на каждую сторону)
+    - победы: один COUNT по winners
+    """
+    from models import Comment
+    from post_parser import parse_telegram_link
+    
+    # Для рисунков/коллекций считаем участие только если есть фото/коллекция
+    drawing_result = await session.execute(
+        select(func.count(Participant.id))
+        .join(Giveaway, Giveaway.id == Participant.giveaway_id)
+        .where(
+            Participant.user_id == telegram_id,
+            Participant.photo_link.isnot(None),
+            Giveaway.contest_type.in_(['drawing', 'collection'])
+        )
+    )
+    contests_participated = drawing_result.scalar() or 0
+    
+    # Для рандом соо считаем участие по комментариям в таблице Comment
+    posts_result = await session.execute(
+        select(Comment.chat_id, Comment.post_message_id).distinct().where(
+            Comment.user_id == telegram_id,
+            Comment.chat_id.isnot(None),
+            Comment.post_message_id.isnot(None)
+        )
+    )
+    commented_posts = {(str(chat_id), post_message_id) for chat_id, post_message_id in posts_result.all()}
+    
+    if commented_posts:
+        giveaways_result = await session.execute(
+            select(Giveaway.id, Giveaway.post_link).where(
+                Giveaway.contest_type == 'random_comment',
+                Giveaway.post_link.isnot(None)
+            )
+        )
+        commented_contest_ids = set()
+        for giveaway_id, post_link in giveaways_result.all():
+            parsed = parse_telegram_link(post_link) if post_link else None
+            if parsed:
+                channel_id, post_message_id = parsed
+                if (str(channel_id), post_message_id) in commented_posts:
+                    commented_contest_ids.add(giveaway_id)
+        contests_participated += len(commented_contest_ids)
+    
+    # Подсчитываем победы
+    winners_result = await session.execute(
+        select(func.count(Winner.id)).where(Winner.user_id == telegram_id)
+    )
+    contests_won = winners_result.scalar() or 0
+    
+    return contests_participated, contests_won
+
 @app.get("/api/profile")
 async def get_profile(tg_id: int = Query(None)):
     """Получить профиль пользователя с опытом из базы данных"""
@@ -374,83 +528,19 @@ async def get_profile(tg_id: int = Query(None)):
         # Получаем опыт из базы данных
         experience = user.experience if hasattr(user, 'experience') and user.experience is not None else 0
         
-        # Подсчитываем статистику участий и побед
-        from models import Participant, Winner
+        # Подсчитываем статистику участий и побед (кэшируется до участия/победы пользователя)
         contests_participated = 0
         contests_won = 0
         
-        # Подсчитываем участия и победы
         if user.role == 'user':
-            # Для пользователей считаем участия в конкурсах рисунков/коллекций
-            participants_result = await session.execute(
-                select(Participant).where(Participant.user_id == user.telegram_id)
-            )
-            participants = participants_result.scalars().all()
-            
-            # Получаем типы конкурсов для каждого участия
-            for participant in participants:
-                giveaway_result = await session.execute(
-                    select(Giveaway).where(Giveaway.id == participant.giveaway_id)
-                )
-                giveaway = giveaway_result.scalars().first()
-                if giveaway:
-                    contest_type = getattr(giveaway, 'contest_type', 'random_comment')
-                    # Для рисунков/коллекций считаем участие только если есть фото/коллекция
-                    if contest_type in ['drawing', 'collection']:
-                        if participant.photo_link:
-                            contests_participated += 1
-            
-            # Для рандом соо считаем участие по комментариям в таблице Comment
-            from models import Comment
-            comments_result = await session.execute(
-                select(Comment).where(Comment.user_id == user.telegram_id)
-            )
-            comments = comments_result.scalars().all()
-            
-            # Получаем уникальные конкурсы, в которых пользователь оставил комментарий
-            commented_contest_ids = set()
-            for comment in comments:
-                # Находим конкурс по post_link
-                if comment.chat_id and comment.post_message_id:
-                    # Ищем конкурс с таким post_link
-                    giveaways_result = await session.execute(
-                        select(Giveaway).where(
-                            Giveaway.contest_type == 'random_comment'
-                        )
-                    )
-                    all_giveaways = giveaways_result.scalars().all()
-                    
-                    for giveaway in all_giveaways:
-                        if not giveaway.post_link:
-                            continue
-                        # Парсим post_link конкурса
-                        from post_parser import parse_telegram_link
-                        parsed = parse_telegram_link(giveaway.post_link)
-                        if parsed:
-                            channel_id, post_message_id = parsed
-                            if str(channel_id) == str(comment.chat_id) and post_message_id == comment.post_message_id:
-                                commented_contest_ids.add(giveaway.id)
-            
-            contests_participated += len(commented_contest_ids)
-            
-            # Подсчитываем победы
-            winners_result = await session.execute(
-                select(Winner).where(Winner.user_id == user.telegram_id)
-            )
-            contests_won = len(winners_result.scalars().all())
+            cached_stats = profile_stats_cache.get(user.telegram_id)
+            if cached_stats is None:
+                cached_stats = await _load_profile_stats(session, user.telegram_id)
+                profile_stats_cache.set(user.telegram_id, cached_stats)
+            contests_participated, contests_won = cached_stats
         
         # Получаем купленные товары
-        purchased_items = None
-        if hasattr(user, 'purchased_items') and user.purchased_items:
-            try:
-                if isinstance(user.purchased_items, str):
-                    purchased_items = json.loads(user.purchased_items)
-                else:
-                    purchased_items = user.purchased_items
-            except:
-                purchased_items = {"themes": [], "avatarStars": [], "nftGifts": []}
-        else:
-            purchased_items = {"themes": [], "avatarStars": [], "nftGifts": []}
+        purchased_items = await user_items.get_purchased_items(user.telegram_id, session=session)
         
         return {
             "id": user.telegram_id,
@@ -472,7 +562,7 @@ async def get_profile(tg_id: int = Query(None)):
 async def get_ton_wallet(tg_id: int = Query(None)):
     """Получить адрес TON кошелька пользователя или креатора"""
     if tg_id:
-        async with async_session() as session:
+        async with read_session() as session:
             result = await session.execute(
                 select(User).where(User.telegram_id == tg_id)
             )
@@ -569,8 +659,8 @@ async def create_stars_invoice(request: Request):
         unique_payload = f"{json.dumps(payload_data)}_{int(time.time())}"
         start_param = f"shop_{category}_{item_id}_stars_{int(time.time())}"
         
-        # Создаем invoice через бота - отправляем счет пользователю в чат
-        bot = Bot(token=BOT_TOKEN)
+        # Создаем invoice через общий экземпляр бота - отправляем счет пользователю в чат
+        bot = auth_session.get_bot()
         try:
             from aiogram.types import LabeledPrice
             
@@ -620,36 +710,12 @@ async def create_stars_invoice(request: Request):
             
             logger.info(f"✅ Возвращаем успешный ответ: {final_result}")
             
-            # Закрываем сессию перед возвратом, чтобы избежать проблем с async
-            try:
-                session = await bot.get_session()
-                if session:
-                    await session.close()
-                    logger.debug("✅ Сессия бота закрыта успешно")
-            except Exception as close_error:
-                # Игнорируем ошибки закрытия сессии - счет уже отправлен
-                logger.debug(f"⚠️ Ошибка при закрытии сессии бота (не критично): {close_error}")
-            
             return final_result
             
-        except HTTPException as http_ex:
-            # Закрываем сессию перед повторным выбросом
-            try:
-                session = await bot.get_session()
-                if session:
-                    await session.close()
-            except:
-                pass
-            raise http_ex
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"❌ Ошибка при отправке invoice пользователю {user_id}: {e}", exc_info=True)
-            # Закрываем сессию перед возвратом ошибки
-            try:
-                session = await bot.get_session()
-                if session:
-                    await session.close()
-            except:
-                pass
             raise HTTPException(status_code=500, detail=f"Ошибка при отправке счета: {str(e)}")
             
     except HTTPException:
@@ -712,9 +778,10 @@ async def create_invoice(request: Request):
         if "error" in invoice:
             raise HTTPException(status_code=500, detail=f"Ошибка создания счета: {invoice.get('error')}")
         
-        # Сохраняем информацию о счете для последующей проверки
+        # Сохраняем счет для фоновой сверки статуса
         invoice_id = invoice.get("invoice_id")
         invoice_url = invoice.get("pay_url")
+        await payments.record_invoice(invoice_id, user_id, "purchase", payload_data)
         
         return {
             "success": True,
@@ -732,9 +799,11 @@ async def create_invoice(request: Request):
 @app.post("/api/payment/verify")
 async def verify_payment(request: Request):
     """
-    Проверка оплаты на сервере через CryptoBot
+    Проверка оплаты по таблице payments
     
-    Принимает invoice_id и проверяет его статус и принадлежность пользователю
+    Принимает invoice_id и проверяет его статус и принадлежность пользователю.
+    Статус обновляет фоновая сверка (payments.py), поэтому запрос читает только БД;
+    к CryptoBot обращаемся лишь для счетов, созданных до появления таблицы payments.
     """
     try:
         data = await request.json()
@@ -746,21 +815,29 @@ async def verify_payment(request: Request):
         if not invoice_id or not user_id:
             raise HTTPException(status_code=400, detail="Необходимо указать invoice_id и userId")
         
-        # Проверяем статус счета через CryptoBot API
-        verification_result = await cryptobot.verify_payment(invoice_id)
-        
-        if "error" in verification_result:
-            logger.warning(f"❌ Ошибка получения информации о счете: {verification_result.get('error')}")
-            return {"verified": False, "message": "Ошибка получения информации о счете"}
-        
-        is_paid = verification_result.get("paid", False)
-        payload = verification_result.get("payload")
-        invoice = verification_result.get("invoice", {})
-        
-        # Проверяем, что счет оплачен
-        if not is_paid:
-            logger.warning(f"❌ Счет не оплачен: invoice_id {invoice_id}")
-            return {"verified": False, "message": "Счет не оплачен"}
+        payment = await payments.get_payment(invoice_id)
+        if payment is not None:
+            if payment.status == "needs_attention":
+                return {"verified": False, "status": payment.status, "message": "Счет оплачен, но начисление не выполнено. Обратитесь в поддержку"}
+            if payment.status != "paid":
+                return {"verified": False, "status": payment.status, "message": "Счет не оплачен"}
+            payload = payment.payload if isinstance(payment.payload, dict) else json.loads(payment.payload or "null")
+            if int(payment.user_id) != int(user_id):
+                logger.warning(f"❌ Счет оплачен другим пользователем: invoice_id {invoice_id}, ожидался user_id {user_id}, получен {payment.user_id}")
+                return {"verified": False, "message": "Счет принадлежит другому пользователю"}
+        else:
+            # Счет создан до появления таблицы payments - проверяем через CryptoBot API
+            verification_result = await cryptobot.verify_payment(invoice_id)
+            
+            if "error" in verification_result:
+                logger.warning(f"❌ Ошибка получения информации о счете: {verification_result.get('error')}")
+                return {"verified": False, "message": "Ошибка получения информации о счете"}
+            
+            # Проверяем, что счет оплачен
+            if not verification_result.get("paid", False):
+                logger.warning(f"❌ Счет не оплачен: invoice_id {invoice_id}")
+                return {"verified": False, "message": "Счет не оплачен"}
+            payload = verification_result.get("payload")
         
         # Проверяем, что счет принадлежит правильному пользователю
         if payload:
@@ -779,10 +856,7 @@ async def verify_payment(request: Request):
                 logger.warning(f"❌ Несоответствие товара: invoice_id {invoice_id}, ожидался {item_id}, получен {payload_item_id}")
                 return {"verified": False, "message": "Несоответствие данных счета"}
         else:
-            # Если payload отсутствует, проверяем по invoice (может содержать информацию о пользователе)
             logger.warning(f"⚠️ Payload отсутствует в счете: invoice_id {invoice_id}")
-            # В этом случае полагаемся на проверку статуса оплаты
-            # Но лучше всегда использовать payload
         
         logger.info(f"✅ Оплата подтверждена: invoice_id {invoice_id}, пользователь {user_id}, товар {category}/{item_id}")
         return {"verified": True, "message": "Оплата подтверждена"}
@@ -797,44 +871,16 @@ async def verify_payment(request: Request):
 async def get_purchased_items(tg_id: int = Query(...)):
     """Получить список купленных товаров пользователя"""
     try:
-        async with async_session() as session:
-            result = await session.execute(select(User).where(User.telegram_id == tg_id))
-            user = result.scalars().first()
-            
-            if not user:
-                return {"purchased_items": {"themes": [], "avatarStars": [], "nftGifts": []}}
-            
-            # Получаем купленные товары
-            purchased_items = None
-            if hasattr(user, 'purchased_items') and user.purchased_items:
-                try:
-                    if isinstance(user.purchased_items, str):
-                        purchased_items = json.loads(user.purchased_items)
-                    else:
-                        purchased_items = user.purchased_items
-                except:
-                    purchased_items = {"themes": [], "avatarStars": [], "nftGifts": []}
-            else:
-                purchased_items = {"themes": [], "avatarStars": [], "nftGifts": []}
-            
-            return {"purchased_items": purchased_items}
+        return {"purchased_items": await user_items.get_purchased_items(tg_id)}
     except Exception as e:
         logger.error(f"Ошибка при получении покупок: {e}", exc_info=True)
-        return {"purchased_items": {"themes": [], "avatarStars": [], "nftGifts": []}}
+        return {"purchased_items": user_items.empty_purchased_items()}
 
 @app.get("/api/profile/monkey-coins")
 async def get_monkey_coins(tg_id: int = Query(...)):
     """Получить баланс Monkey Coins пользователя"""
     try:
-        async with async_session() as session:
-            result = await session.execute(select(User).where(User.telegram_id == tg_id))
-            user = result.scalars().first()
-            
-            if not user:
-                return {"monkey_coins": 0}
-            
-            monkey_coins = getattr(user, 'monkey_coins', 0) or 0
-            return {"monkey_coins": monkey_coins}
+        return {"monkey_coins": await get_balance(tg_id)}
     except Exception as e:
         logger.error(f"Ошибка при получении баланса Monkey Coins: {e}", exc_info=True)
         return {"monkey_coins": 0}
@@ -843,7 +889,7 @@ async def get_monkey_coins(tg_id: int = Query(...)):
 async def get_pro_subscription(tg_id: int = Query(...)):
     """Получить информацию о Pro подписке пользователя"""
     try:
-        async with async_session() as session:
+        async with read_session() as session:
             result = await session.execute(select(User).where(User.telegram_id == tg_id))
             user = result.scalars().first()
             
@@ -994,37 +1040,29 @@ async def create_topup_stars_invoice(request: Request):
         unique_payload = f"{json.dumps(payload_data)}_{int(time.time())}"
         start_param = f"topup_stars_{int(time.time())}"
         
-        # Создаем invoice через бота
-        bot = Bot(token=BOT_TOKEN)
-        try:
-            from aiogram.types import LabeledPrice
-            prices = [LabeledPrice(label=f"Пополнение баланса на {monkey_coins} Monkey Coins", amount=int(amount))]
-            
-            message = await bot.send_invoice(
-                chat_id=user_id,
-                title="💰 Пополнение баланса Monkey Coins",
-                description=f"Пополнение баланса на {monkey_coins} Monkey Coins",
-                payload=unique_payload,
-                provider_token="",
-                currency="XTR",
-                prices=prices,
-                start_parameter=start_param
-            )
-            
-            logger.info(f"📋 Счет на пополнение создан: Пользователь {user_id}, {amount} ⭐ = {monkey_coins} Monkey Coins")
-            
-            return {
-                "success": True,
-                "message": "Счет отправлен в бота",
-                "invoice_id": str(message.message_id) if hasattr(message, 'message_id') else None
-            }
-        finally:
-            try:
-                session = await bot.get_session()
-                if session:
-                    await session.close()
-            except:
-                pass
+        # Создаем invoice через общий экземпляр бота
+        bot = auth_session.get_bot()
+        from aiogram.types import LabeledPrice
+        prices = [LabeledPrice(label=f"Пополнение баланса на {monkey_coins} Monkey Coins", amount=int(amount))]
+        
+        message = await bot.send_invoice(
+            chat_id=user_id,
+            title="💰 Пополнение баланса Monkey Coins",
+            description=f"Пополнение баланса на {monkey_coins} Monkey Coins",
+            payload=unique_payload,
+            provider_token="",
+            currency="XTR",
+            prices=prices,
+            start_parameter=start_param
+        )
+        
+        logger.info(f"📋 Счет на пополнение создан: Пользователь {user_id}, {amount} ⭐ = {monkey_coins} Monkey Coins")
+        
+        return {
+            "success": True,
+            "message": "Счет отправлен в бота",
+            "invoice_id": str(message.message_id) if hasattr(message, 'message_id') else None
+        }
             
     except HTTPException:
         raise
@@ -1073,6 +1111,7 @@ async def create_topup_invoice(request: Request):
         
         invoice_id = invoice.get("invoice_id")
         invoice_url = invoice.get("pay_url")
+        await payments.record_invoice(invoice_id, user_id, "topup", payload_data)
         
         logger.info(f"📋 Счет на пополнение создан: Пользователь {user_id}, {amount} {currency} = {monkey_coins} Monkey Coins")
         
@@ -1100,27 +1139,26 @@ async def add_monkey_coins(request: Request):
         if not user_id or not amount:
             raise HTTPException(status_code=400, detail="Необходимо указать user_id и amount")
         
+        # Ключ идемпотентности от клиента защищает от повторного начисления при повторе запроса
+        idempotency_key = data.get("idempotency_key")
         async with async_session() as session:
-            result = await session.execute(select(User).where(User.telegram_id == user_id))
-            user = result.scalars().first()
-            
-            if not user:
+            try:
+                balance, applied = await apply_coin_delta(
+                    session, user_id, int(amount), "manual_topup",
+                    idempotency_key=f"add-coins:{user_id}:{idempotency_key}" if idempotency_key else None
+                )
+            except LedgerError:
                 raise HTTPException(status_code=404, detail="Пользователь не найден")
-            
-            # Получаем текущий баланс
-            monkey_coins = getattr(user, 'monkey_coins', 0) or 0
-            # Добавляем монетки
-            user.monkey_coins = monkey_coins + int(amount)
-            
             await session.commit()
-            
-            logger.info(f"✅ Баланс пополнен: Пользователь {user_id}, добавлено {amount} Monkey Coins, новый баланс: {user.monkey_coins}")
-            
-            return {
-                "success": True,
-                "monkey_coins": user.monkey_coins,
-                "added": int(amount)
-            }
+        
+        if applied:
+            logger.info(f"✅ Баланс пополнен: Пользователь {user_id}, добавлено {amount} Monkey Coins, новый баланс: {balance}")
+        
+        return {
+            "success": True,
+            "monkey_coins": balance,
+            "added": int(amount) if applied else 0
+        }
             
     except HTTPException:
         raise
@@ -1141,45 +1179,26 @@ async def purchase_theme(request: Request):
             raise HTTPException(status_code=400, detail="Необходимо указать user_id, theme_id и price")
         
         async with async_session() as session:
-            result = await session.execute(select(User).where(User.telegram_id == user_id))
-            user = result.scalars().first()
-            
-            if not user:
-                raise HTTPException(status_code=404, detail="Пользователь не найден")
-            
-            # Проверяем баланс
-            monkey_coins = getattr(user, 'monkey_coins', 0) or 0
-            if monkey_coins < price:
-                raise HTTPException(status_code=400, detail=f"Недостаточно Monkey Coins. У вас: {monkey_coins}, нужно: {price}")
-            
             # Проверяем, не куплена ли уже тема
-            purchased_items = None
-            if hasattr(user, 'purchased_items') and user.purchased_items:
-                try:
-                    if isinstance(user.purchased_items, str):
-                        purchased_items = json.loads(user.purchased_items)
-                    else:
-                        purchased_items = user.purchased_items
-                except:
-                    purchased_items = {"themes": [], "avatarStars": [], "nftGifts": []}
-            else:
-                purchased_items = {"themes": [], "avatarStars": [], "nftGifts": []}
-            
-            if theme_id in purchased_items.get("themes", []):
+            if await user_items.has_user_item(session, user_id, "themes", theme_id):
                 raise HTTPException(status_code=400, detail="Эта тема уже куплена")
             
-            # Списываем Monkey Coins
-            user.monkey_coins = monkey_coins - price
+            # Списываем Monkey Coins (условный UPDATE: баланс не уйдёт в минус при параллельных покупках)
+            try:
+                balance, _ = await apply_coin_delta(
+                    session, user_id, -int(price), "theme_purchase",
+                    idempotency_key=f"theme:{user_id}:{theme_id}"
+                )
+            except InsufficientCoins as e:
+                raise HTTPException(status_code=400, detail=f"Недостаточно Monkey Coins. У вас: {e.balance}, нужно: {price}")
+            except LedgerError:
+                raise HTTPException(status_code=404, detail="Пользователь не найден")
             
             # Добавляем тему в покупки
-            if "themes" not in purchased_items:
-                purchased_items["themes"] = []
-            purchased_items["themes"].append(theme_id)
-            user.purchased_items = purchased_items
-            
+            await user_items.add_user_item(session, user_id, "themes", theme_id)
             await session.commit()
             
-            return {"success": True, "monkey_coins": user.monkey_coins}
+            return {"success": True, "monkey_coins": balance}
     except HTTPException:
         raise
     except Exception as e:
@@ -1199,35 +1218,14 @@ async def add_purchase(request: Request):
             raise HTTPException(status_code=400, detail="Необходимо указать tg_id, category и item_id")
         
         async with async_session() as session:
-            result = await session.execute(select(User).where(User.telegram_id == tg_id))
-            user = result.scalars().first()
-            
-            if not user:
+            result = await session.execute(select(User.id).where(User.telegram_id == tg_id))
+            if result.first() is None:
                 raise HTTPException(status_code=404, detail="Пользователь не найден")
             
-            # Получаем текущие покупки
-            purchased_items = None
-            if hasattr(user, 'purchased_items') and user.purchased_items:
-                try:
-                    if isinstance(user.purchased_items, str):
-                        purchased_items = json.loads(user.purchased_items)
-                    else:
-                        purchased_items = user.purchased_items
-                except:
-                    purchased_items = {"themes": [], "avatarStars": [], "nftGifts": []}
-            else:
-                purchased_items = {"themes": [], "avatarStars": [], "nftGifts": []}
-            
-            # Добавляем покупку
-            if category not in purchased_items:
-                purchased_items[category] = []
-            
-            if item_id not in purchased_items[category]:
-                purchased_items[category].append(item_id)
-            
-            # Сохраняем в базу данных
-            user.purchased_items = json.dumps(purchased_items) if isinstance(purchased_items, dict) else purchased_items
+            # Добавляем покупку (повторное добавление ничего не меняет)
+            await user_items.add_user_item(session, tg_id, category, item_id)
             await session.commit()
+            purchased_items = await user_items.get_purchased_items(tg_id, session=session)
             
             logger.info(f"✅ Покупка добавлена: пользователь {tg_id}, категория {category}, товар {item_id}")
             return {"success": True, "purchased_items": purchased_items}
@@ -1256,77 +1254,13 @@ async def payment_webhook(request: Request):
             invoice_id = invoice.get("invoice_id")
             
             if invoice_id:
-                # Получаем информацию о счете с проверкой
-                verification_result = await cryptobot.verify_payment(invoice_id)
-                
-                if verification_result.get("paid"):
-                    # Парсим payload для получения информации о покупке или пополнении
-                    payload = verification_result.get("payload")
-                    if payload:
-                        try:
-                            # Парсим JSON payload
-                            if isinstance(payload, str):
-                                payload_data = json.loads(payload)
-                            else:
-                                payload_data = payload
-                            
-                            payment_type = payload_data.get("type")
-                            user_id = payload_data.get("user_id")
-                            
-                            if not user_id:
-                                logger.warning(f"⚠️ Payload не содержит user_id для invoice_id {invoice_id}")
-                                return {"ok": True}
-                            
-                            # Обработка пополнения баланса
-                            if payment_type == "topup":
-                                monkey_coins = payload_data.get("monkey_coins", 0)
-                                
-                                async with async_session() as session:
-                                    result = await session.execute(select(User).where(User.telegram_id == int(user_id)))
-                                    user = result.scalars().first()
-                                    
-                                    if user:
-                                        current_balance = getattr(user, 'monkey_coins', 0) or 0
-                                        user.monkey_coins = current_balance + int(monkey_coins)
-                                        await session.commit()
-                                        
-                                        logger.info(f"✅ Баланс пополнен через CryptoBot: invoice_id {invoice_id}, пользователь {user_id}, добавлено {monkey_coins} Monkey Coins, новый баланс: {user.monkey_coins}")
-                                        
-                                        # Отправляем уведомление пользователю через бота
-                                        try:
-                                            bot = Bot(token=BOT_TOKEN)
-                                            await bot.send_message(
-                                                chat_id=int(user_id),
-                                                text=f"✅ **Баланс пополнен!**\n\nПолучено: {monkey_coins} Monkey Coins\nВаш баланс: {user.monkey_coins} Monkey Coins",
-                                                parse_mode="Markdown"
-                                            )
-                                            try:
-                                                session = await bot.get_session()
-                                                if session:
-                                                    await session.close()
-                                            except:
-                                                pass
-                                        except Exception as e:
-                                            logger.error(f"Ошибка отправки уведомления: {e}")
-                                    
-                                return {"ok": True}
-                            
-                            # Обработка покупки товаров (старая логика)
-                            category = payload_data.get("category")
-                            item_id = payload_data.get("item_id")
-                            
-                            logger.info(f"✅ Успешная оплата через CryptoBot: invoice_id {invoice_id}, пользователь {user_id}, товар {category}/{item_id}")
-                            
-                            # Здесь можно добавить логику сохранения покупки в базу данных
-                            # или отправки уведомления пользователю
-                            # Покупка будет автоматически добавлена при следующей проверке статуса
-                            
-                            return {"ok": True}
-                        except Exception as e:
-                            logger.error(f"Ошибка обработки payload: {e}", exc_info=True)
-                            return {"ok": False}
-                    else:
-                        logger.warning(f"⚠️ Payload отсутствует в счете: invoice_id {invoice_id}")
+                # Статус перепроверяем через API: начисление идемпотентно (payments.apply_paid_payment),
+                # поэтому повторный вебхук или параллельная фоновая сверка не начислят дважды
+                if await payments.get_payment(invoice_id) is None:
+                    verification_result = await cryptobot.verify_payment(invoice_id)
+                    if not verification_result.get("paid") or not await payments.record_legacy_invoice(invoice_id, verification_result):
+                        return {"ok": True}
+                await payments.reconcile_invoices([int(invoice_id)])
             
             return {"ok": True}
         
@@ -1364,7 +1298,7 @@ async def update_username(tg_id: int = Query(...), username: str = Query(...)):
 async def get_rating(role: str = Query("user")):
     """Получить рейтинг пользователей или админов (топ 100)"""
     try:
-        async with async_session() as session:
+        async with read_session() as session:
             # Определяем роль для фильтрации
             if role == "admin":
                 role_filter = "admin"
@@ -1609,22 +1543,19 @@ async def create_giveaway(request: Request):
                     fee = contest_fees.get(contest_type, 0)
                     
                     if fee > 0:
-                        # Получаем текущий баланс Monkey Coins
-                        current_balance = getattr(creator_user, 'monkey_coins', 0) or 0
-                        
-                        if current_balance < fee:
+                        # Списываем плату (будет закоммичено вместе с созданием конкурса)
+                        try:
+                            new_balance, _ = await apply_coin_delta(session, created_by, -fee, "contest_fee")
+                        except InsufficientCoins as e:
                             return {
                                 "success": False,
-                                "message": f"❌ Недостаточно Monkey Coins для создания конкурса!\n\nУ вас: {current_balance}\nНужно: {fee}\n\nПополните баланс через кнопку \"+\" в правом верхнем углу."
+                                "message": f"❌ Недостаточно Monkey Coins для создания конкурса!\n\nУ вас: {e.balance}\nНужно: {fee}\n\nПополните баланс через кнопку \"+\" в правом верхнем углу."
                             }
-                        
-                        # Списываем плату (будет закоммичено вместе с созданием конкурса)
-                        creator_user.monkey_coins = current_balance - fee
                         # Сохраняем информацию для логирования
                         admin_fee_deducted = {
                             "admin_id": created_by,
                             "fee": fee,
-                            "new_balance": current_balance - fee
+                            "new_balance": new_balance
                         }
                 elif creator_user.role == "user":
                     # Для обычного пользователя - проверяем Pro подписку
@@ -1734,213 +1665,207 @@ async def create_giveaway(request: Request):
                     save_collection_data(collection_data)
                     logger.info(f"✅ Создана начальная запись для конкурса коллекций {new_giveaway.id} в collection_contests.json")
 
+    bump_contests_version()
     return {"success": True, "message": "✅ Конкурс успешно создан!", "id": new_giveaway.id}
 
 
+# Колонки giveaways, которые отдаёт список конкурсов (в порядке выборки)
+LIST_GIVEAWAYS_COLUMNS = [
+    'id', 'post_link', 'created_at', 'name', 'prize', 'end_date', 'conditions',
+    'discussion_group_link', 'prize_links', 'contest_type', 'submission_end_date',
+    'winners_count', 'start_date', 'jury', 'created_by', 'is_confirmed', 'winners_selected_at',
+]
+# Компактная проекция для главного экрана WebApp (без prize_links, jury и условий)
+SUMMARY_GIVEAWAYS_COLUMNS = [
+    'id', 'post_link', 'name', 'prize', 'end_date', 'contest_type', 'submission_end_date',
+    'winners_count', 'start_date', 'created_by', 'is_confirmed',
+]
+LIST_GIVEAWAYS_STATUSES = ('active', 'ended', 'confirmed')
+LIST_GIVEAWAYS_MAX_LIMIT = 200
+_list_giveaways_queries = {}
+
+
+def _get_list_giveaways_query(view: str = "full"):
+    """
+    Возвращает подготовленный SELECT для списка конкурсов
+    
+    Набор колонок берётся из кэша схемы (db.has_column), поэтому запрос строится один раз
+    после init_db. Пока кэш схемы пуст, запрос не кэшируется.
+    """
+    query = _list_giveaways_queries.get(view)
+    if query is not None:
+        return query
+    column_names = SUMMARY_GIVEAWAYS_COLUMNS if view == "summary" else LIST_GIVEAWAYS_COLUMNS
+    columns = [getattr(Giveaway, name) for name in column_names if has_column('giveaways', name)]
+    if not columns:
+        return None
+    query = select(*columns).order_by(Giveaway.id)
+    _list_giveaways_queries[view] = query
+    return query
+
+
+def _parse_json_field(value, default):
+    """Приводит JSON-поле (строку или уже распарсенное значение) к объекту Python"""
+    if isinstance(value, str):
+        try:
+            return json.loads(value) if value else default
+        except Exception:
+            return default
+    return default if value is None else value
+
+
+def _giveaway_row_to_dict(row_dict, view: str = "full") -> dict:
+    """Формирует элемент ответа /api/giveaways из строки выборки"""
+    end_date = row_dict.get('end_date')
+    start_date = row_dict.get('start_date')
+    submission_end_date = row_dict.get('submission_end_date')
+    item = {
+        "id": row_dict.get('id'),
+        "title": row_dict.get('name') or row_dict.get('post_link') or 'Без названия',
+        "name": row_dict.get('name') or '',
+        "prize": row_dict.get('prize') or '',
+        "end_at": to_iso(end_date),
+        "end_at_local": to_datetime_local(end_date),
+        "end_date": to_iso(end_date),
+        "start_at": to_iso(start_date),
+        "start_at_local": to_datetime_local(start_date),
+        "start_date": to_iso(start_date),
+        "submission_end_date": to_iso(submission_end_date),
+        "submission_end_date_local": to_datetime_local(submission_end_date),
+        "created_by": row_dict.get('created_by'),
+        "is_confirmed": row_dict.get('is_confirmed') or False,
+        "winners_count": row_dict.get('winners_count', 1),
+        "contest_type": row_dict.get('contest_type', 'random_comment'),
+    }
+    if view == "summary":
+        return item
+    
+    # Парсим prize_links если это JSON строка - всегда возвращаем список, даже если пустой
+    prize_links = _parse_json_field(row_dict.get('prize_links'), [])
+    if not isinstance(prize_links, list):
+        prize_links = []
+    
+    item.update({
+        "post_link": row_dict.get('post_link') or '',
+        "discussion_group_link": row_dict.get('discussion_group_link') or '',
+        "conditions": row_dict.get('conditions') or '',
+        "prize_links": prize_links,
+        "created_at": to_iso(row_dict.get('created_at')),
+        "created_at_local": to_datetime_local(row_dict.get('created_at')),
+        "jury": _parse_json_field(row_dict.get('jury'), None),  # Данные жюри
+    })
+    return item
+
+
 @app.get("/api/giveaways")
-async def list_giveaways(admin_id: int = Query(None)):
-    """Получить список конкурсов. Если передан admin_id, возвращает только конкурсы этого админа."""
-    async with async_session() as session:
-        # Check which columns exist
+async def list_giveaways(
+    request: Request,
+    response: Response,
+    admin_id: int = Query(None),
+    status: str = Query(None),
+    cursor: int = Query(None),
+    limit: int = Query(None),
+    view: str = Query("full"),
+    caller: Optional[WebAppUser] = Depends(current_user("admin_id")),
+):
+    """
+    Получить список конкурсов. Если передан admin_id, возвращает только конкурсы этого админа.
+    
+    Дополнительные параметры:
+    - status: active / ended / confirmed - фильтрация на стороне сервера
+    - cursor + limit: постраничная выдача по id; курсор следующей страницы
+      возвращается в заголовке X-Next-Cursor
+    - view=summary: компактная проекция без prize_links, jury и условий
+    
+    Ответ снабжается ETag, зависящим от версии списка конкурсов (cache.contests_version),
+    поэтому повторный запрос с If-None-Match отдаёт 304 без обращения к БД.
+    """
+    if status and status not in LIST_GIVEAWAYS_STATUSES:
+        raise HTTPException(status_code=400, detail=f"status должен быть одним из: {', '.join(LIST_GIVEAWAYS_STATUSES)}")
+    if view not in ("full", "summary"):
+        raise HTTPException(status_code=400, detail="view должен быть full или summary")
+    if limit is not None:
+        limit = max(1, min(limit, LIST_GIVEAWAYS_MAX_LIMIT))
+    
+    # Фильтры active/ended зависят от текущего времени - добавляем в ETag минутную метку
+    time_bucket = int(time.time() // 60) if status in ('active', 'ended') else 0
+    etag = '"giveaways-' + hashlib.md5(
+        f"{get_contests_version()}:{time_bucket}:{admin_id}:{status}:{cursor}:{limit}:{view}".encode()
+    ).hexdigest() + '"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    
+    async with read_session() as session:
         try:
-            if IS_SQLITE:
-                result = await session.execute(text("PRAGMA table_info(giveaways)"))
-                columns_info = result.fetchall()
-                existing_columns = {row[1]: row for row in columns_info}
-            else:
-                result = await session.execute(text("""
-                    SELECT column_name 
-                    FROM information_schema.columns 
-                    WHERE table_name = 'giveaways'
-                """))
-                columns_info = result.fetchall()
-                existing_columns = {row[0]: row for row in columns_info}
-            
-            # Build SELECT query with only existing columns
-            base_cols = ['id', 'post_link', 'created_at']
-            optional_cols = {'name': 'name', 'prize': 'prize', 'end_date': 'end_date', 'conditions': 'conditions', 'discussion_group_link': 'discussion_group_link', 'prize_links': 'prize_links', 'contest_type': 'contest_type', 'submission_end_date': 'submission_end_date', 'winners_count': 'winners_count', 'start_date': 'start_date', 'jury': 'jury'}
-            
-            select_cols = []
-            for col in base_cols:
-                if col in existing_columns:
-                    select_cols.append(col)
-            
-            for col_key, col_name in optional_cols.items():
-                if col_name in existing_columns:
-                    select_cols.append(col_name)
-            
-            if not select_cols:
+            query = _get_list_giveaways_query(view)
+            if query is None:
+                # Без ETag: пустой ответ не должен закэшироваться у клиента
                 return []
             
-            # Проверяем наличие поля created_by
-            has_created_by = 'created_by' in existing_columns
-            
-            # Строим запрос с фильтрацией по admin_id если нужно
-            select_cols_final = select_cols.copy()
-            if has_created_by and 'created_by' not in select_cols_final:
-                select_cols_final.append('created_by')
-            
-            query = f"SELECT {', '.join(select_cols_final)} FROM giveaways"
-            
             # Добавляем фильтрацию для админа: показываем его конкурсы и конкурсы создателя
-            if admin_id and has_created_by:
-                # Проверяем, является ли пользователь создателем
-                user_result = await session.execute(
-                    select(User).where(User.telegram_id == admin_id)
-                )
-                user = user_result.scalars().first()
+            if admin_id and caller is not None and has_column('giveaways', 'created_by'):
+                # Роль пользователя - из проверенных данных WebApp (кэшируется)
+                user_role = caller.role
                 
-                if user and user.role == "admin":
+                if user_role == "admin":
                     # Для админа показываем его конкурсы и конкурсы создателя
-                    query += f" WHERE (created_by = {admin_id} OR created_by = {CREATOR_ID})"
-                elif user and user.role == "creator":
+                    query = query.where(or_(Giveaway.created_by == admin_id, Giveaway.created_by == CREATOR_ID))
+                elif user_role == "creator":
                     # Для создателя показываем все конкурсы
                     pass  # Без фильтрации
                 else:
                     # Для обычного пользователя или если пользователь не найден - только его конкурсы
-                    query += f" WHERE created_by = {admin_id}"
+                    query = query.where(Giveaway.created_by == admin_id)
+            
+            if status:
+                not_confirmed = or_(Giveaway.is_confirmed.is_(None), Giveaway.is_confirmed.is_(False))
+                now_msk = datetime.now(MSK_TZ).replace(tzinfo=None)
+                if status == 'active':
+                    query = query.where(not_confirmed, Giveaway.end_date > now_msk)
+                elif status == 'ended':
+                    query = query.where(not_confirmed, Giveaway.end_date <= now_msk)
+                else:
+                    query = query.where(Giveaway.is_confirmed.is_(True))
             
-            result = await session.execute(text(query))
-            rows = result.fetchall()
+            if cursor is not None:
+                query = query.where(Giveaway.id > cursor)
+            if limit is not None:
+                # Берём на одну запись больше, чтобы понять, есть ли следующая страница
+                query = query.limit(limit + 1)
             
-            # Map rows to dict format
-            giveaways_list = []
-            for row in rows:
-                # Используем select_cols_final для правильного маппинга
-                row_dict = dict(zip(select_cols_final, row))
-                
-                # Проверяем, окончен ли конкурс и нужно ли выбрать победителей
-                end_date = row_dict.get('end_date')
-                is_confirmed = row_dict.get('is_confirmed', False) if 'is_confirmed' in existing_columns else False
-                winners_selected_at = row_dict.get('winners_selected_at') if 'winners_selected_at' in existing_columns else None
-                winners_count = row_dict.get('winners_count', 1) if 'winners_count' in existing_columns else 1
-                
-                # Автоматически выбираем победителей, если конкурс окончен и победители еще не выбраны
-                contest_id = row_dict.get('id')
-                if end_date and not is_confirmed and not winners_selected_at:
-                    # Просто парсим дату без timezone - сравниваем с временем сервера
-                    end_date_obj = None
-                    
-                    try:
-                        if isinstance(end_date, str):
-                            # Обрабатываем строку в формате "2025-11-04 15:54:00.000000" или ISO формате
-                            end_date_clean = end_date.strip()
-                            
-                            # Если формат "YYYY-MM-DD HH:MM:SS.microseconds" или "YYYY-MM-DD HH:MM:SS"
-                            if 'T' not in end_date_clean and ' ' in end_date_clean:
-                                # Формат: "2025-11-04 15:54:00.000000" или "2025-11-04 15:54:00"
-                                try:
-                                    # Пробуем парсить с микросекундами
-                                    if '.' in end_date_clean:
-                                        end_date_obj = datetime.strptime(end_date_clean, '%Y-%m-%d %H:%M:%S.%f')
-                                    else:
-                                        end_date_obj = datetime.strptime(end_date_clean, '%Y-%m-%d %H:%M:%S')
-                                except ValueError:
-                                    # Если не получилось, пробуем ISO формат
-                                    end_date_clean = end_date_clean.replace('Z', '').replace('+00:00', '').replace('+03:00', '')
-                                    if 'T' in end_date_clean:
-                                        end_date_obj = datetime.fromisoformat(end_date_clean)
-                                    else:
-                                        end_date_obj = datetime.fromisoformat(f"{end_date_clean}T00:00:00")
-                                    # Убираем timezone, если есть
-                                    if end_date_obj.tzinfo is not None:
-                                        end_date_obj = end_date_obj.replace(tzinfo=None)
-                            else:
-                                # ISO формат с T
-                                end_date_clean = end_date_clean.replace('Z', '').replace('+00:00', '').replace('+03:00', '')
-                                if 'T' in end_date_clean:
-                                    end_date_obj = datetime.fromisoformat(end_date_clean)
-                                else:
-                                    end_date_obj = datetime.fromisoformat(f"{end_date_clean}T00:00:00")
-                                # Убираем timezone, если есть
-                                if end_date_obj.tzinfo is not None:
-                                    end_date_obj = end_date_obj.replace(tzinfo=None)
-                        elif isinstance(end_date, datetime):
-                            # Если это уже datetime объект, просто убираем timezone
-                            end_date_obj = end_date.replace(tzinfo=None) if end_date.tzinfo is not None else end_date
-                    except Exception as e:
-                        logger.warning(f"⚠️ Не удалось преобразовать end_date в datetime для конкурса {contest_id}: {end_date}, ошибка: {e}")
-                        end_date_obj = None
-                    
-                    if end_date_obj:
-                        current_time = datetime.now()
-                        logger.debug(f"🔍 Проверка конкурса {contest_id}: end_date={end_date_obj}, current_time={current_time}, окончен={end_date_obj < current_time}")
-                        # Удален автоматический выбор победителей - теперь только через кнопку "Подвести итоги"
-                    else:
-                        logger.warning(f"⚠️ Не удалось преобразовать end_date в datetime для конкурса {contest_id}: {end_date}")
-                elif is_confirmed:
-                    logger.debug(f"✓ Конкурс {contest_id} уже подтвержден")
-                elif winners_selected_at:
-                    logger.debug(f"✓ Победители для конкурса {contest_id} уже выбраны в {winners_selected_at}")
-                
-                # Парсим prize_links если это JSON строка
-                prize_links = row_dict.get('prize_links')
-                if isinstance(prize_links, str):
-                    try:
-                        import json
-                        prize_links = json.loads(prize_links) if prize_links else []
-                    except:
-                        prize_links = []
-                elif prize_links is None:
-                    prize_links = []
-                elif not isinstance(prize_links, list):
-                    prize_links = []
-                
-                # Логируем для отладки (только если есть призы)
-                if prize_links:
-                    logger.debug(f"Конкурс {contest_id}: загружено {len(prize_links)} призов")
-                
-                # Получаем contest_type и submission_end_date
-                contest_type = row_dict.get('contest_type', 'random_comment') if 'contest_type' in existing_columns else 'random_comment'
-                submission_end_date = row_dict.get('submission_end_date') if 'submission_end_date' in existing_columns else None
-                start_date = row_dict.get('start_date') if 'start_date' in existing_columns else None
-                created_by = row_dict.get('created_by') if has_created_by else None
-                
-                # Парсим jury если это JSON строка
-                jury = row_dict.get('jury') if 'jury' in existing_columns else None
-                if isinstance(jury, str):
-                    try:
-                        import json
-                        jury = json.loads(jury) if jury else None
-                    except:
-                        jury = None
-                
-                giveaways_list.append({
-                    "id": row_dict.get('id'),
-                    "title": row_dict.get('name') or row_dict.get('post_link') or 'Без названия',
-                    "name": row_dict.get('name') or '',
-                    "post_link": row_dict.get('post_link') or '',
-                    "discussion_group_link": row_dict.get('discussion_group_link') or '',
-                    "conditions": row_dict.get('conditions') or '',
-                    "prize": row_dict.get('prize') or '',
-                    "prize_links": prize_links if prize_links else [],  # Всегда возвращаем список, даже если пустой
-                    "end_at": to_iso(end_date),
-                    "end_at_local": to_datetime_local(end_date),
-                    "end_date": to_iso(end_date),
-                    "start_at": to_iso(start_date),
-                    "start_at_local": to_datetime_local(start_date),
-                    "start_date": to_iso(start_date),
-                    "submission_end_date": to_iso(submission_end_date),
-                    "submission_end_date_local": to_datetime_local(submission_end_date),
-                    "created_at": to_iso(row_dict.get('created_at')),
-                    "created_at_local": to_datetime_local(row_dict.get('created_at')),
-                    "created_by": created_by,  # Добавляем created_by в ответ
-                    "is_confirmed": is_confirmed,
-                    "winners_count": winners_count,
-                    "contest_type": contest_type,
-                    "jury": jury,  # Добавляем данные жюри в ответ
-                })
+            result = await session.execute(query)
+            rows = result.mappings().all()
+            # ETag - только для успешно прочитанного списка
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = "no-cache"
+            
+            if limit is not None and len(rows) > limit:
+                rows = rows[:limit]
+                response.headers["X-Next-Cursor"] = str(rows[-1]['id'])
             
-            return giveaways_list
+            return [_giveaway_row_to_dict(row_dict, view) for row_dict in rows]
+        except HTTPException:
+            raise
         except Exception as e:
-            print(f"Error listing giveaways: {e}")
-            return []
+            logger.error(f"Ошибка при получении списка конкурсов: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail="Не удалось получить список конкурсов")
 
 # Backward-compat aliases for creator.html JS expecting /api/contests
 @app.get("/api/contests")
-async def alias_list_contests(admin_id: int = Query(None)):
+async def alias_list_contests(
+    request: Request,
+    response: Response,
+    admin_id: int = Query(None),
+    status: str = Query(None),
+    cursor: int = Query(None),
+    limit: int = Query(None),
+    view: str = Query("full"),
+    caller: Optional[WebAppUser] = Depends(current_user("admin_id")),
+):
     """Получить список конкурсов. Для админа - только его конкурсы, для создателя - все."""
-    return await list_giveaways(admin_id=admin_id)
+    return await list_giveaways(
+        request, response, admin_id=admin_id, status=status, cursor=cursor, limit=limit, view=view, caller=caller
+    )
 
 @app.post("/api/contests")
 async def alias_create_contest(request: Request):
@@ -1951,6 +1876,7 @@ async def select_winners(
     contest_id: int,
     winners_count: int = Query(default=1),
     current_user_id: int = Query(default=None),
+    caller: Optional[WebAppUser] = Depends(current_user()),
 ):
     """Выбирает победителей из конкурса на основе комментариев под постом через Telethon.
 
@@ -1968,12 +1894,9 @@ async def select_winners(
                 raise HTTPException(status_code=404, detail="Конкурс не найден")
 
             # Если передан current_user_id — проверяем, что это владелец конкурса
-            if current_user_id is not None:
-                user_result = await session.execute(
-                    select(User).where(User.telegram_id == current_user_id)
-                )
-                user = user_result.scalars().first()
-                if not user:
+            if caller is not None:
+                current_user_id = caller.id
+                if not caller.exists:
                     raise HTTPException(status_code=403, detail="Пользователь не найден")
 
                 # Разрешаем только владельцу конкурса (created_by)
@@ -2001,6 +1924,9 @@ async def select_winners(
             # Создаем временный Bot объект только для передачи в функцию (но он не используется)
             bot = Bot(token=BOT_TOKEN)
             winners = await select_winners_from_contest(contest_id, winners_count, bot)
+            # Победители изменились - сбрасываем кэш статистики профилей
+            profile_stats_cache.clear()
+            bump_contests_version()
             # Не закрываем сессию бота, так как она может быть None
             return {"success": True, "winners": winners}
         except ValueError as e:
@@ -2043,7 +1969,7 @@ async def get_winners(contest_id: int, current_user_id: int = Query(None)):
     параметр current_user_id зарезервирован на будущее и сейчас не влияет на логику.
     """
     try:
-        async with async_session() as session:
+        async with read_session() as session:
             # Получаем информацию о конкурсе
             giveaway_result = await session.execute(
                 select(Giveaway).where(Giveaway.id == contest_id)
@@ -2106,12 +2032,15 @@ async def get_winners(contest_id: int, current_user_id: int = Query(None)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/contests/{contest_id}/reroll-winner")
-async def reroll_winner(contest_id: int, request: Request):
+async def reroll_winner(
+    contest_id: int,
+    request: Request,
+    caller: Optional[WebAppUser] = Depends(current_user(body=True)),
+):
     """Рерандомизирует одного победителя. Доступно только создателю конкурса."""
     try:
         data = await request.json()
         old_winner_link = data.get("old_winner_link")
-        current_user_id = data.get("current_user_id")
         
         if not old_winner_link:
             raise HTTPException(status_code=400, detail="old_winner_link обязателен")
@@ -2125,9 +2054,9 @@ async def reroll_winner(contest_id: int, request: Request):
             if not giveaway:
                 raise HTTPException(status_code=404, detail="Конкурс не найден")
 
-            if current_user_id is not None and giveaway.created_by is not None:
+            if caller is not None and giveaway.created_by is not None:
                 try:
-                    if int(giveaway.created_by) != int(current_user_id):
+                    if int(giveaway.created_by) != caller.id:
                         raise HTTPException(
                             status_code=403,
                             detail="Реролл доступен только создателю конкурса",
@@ -2142,6 +2071,8 @@ async def reroll_winner(contest_id: int, request: Request):
         bot = Bot(token=BOT_TOKEN)
         try:
             new_winner = await reroll_single_winner(contest_id, old_winner_link, bot)
+            profile_stats_cache.clear()
+            bump_contests_version()
         finally:
             # Закрываем сессию бота, если она существует
             try:
@@ -2379,6 +2310,7 @@ async def participate_in_contest(contest_id: int, request: Request):
                 )
                 session.add(participant)
                 await session.commit()
+                profile_stats_cache.invalidate(user_id)
                 
                 return {"success": True, "message": "✅ Вы успешно присоединились к конкурсу!"}
             except IntegrityError as e:
@@ -2425,6 +2357,15 @@ async def upload_photo_for_drawing_contest(
 ):
     """Загрузка фотографии для конкурса рисунков"""
     try:
+        # request.form() сохраняет всё тело запроса во временные файлы без ограничения размера,
+        # поэтому заведомо слишком большой запрос отклоняется по Content-Length до разбора формы
+        try:
+            content_length = int(request.headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некорректный заголовок Content-Length")
+        if content_length > DRAWING_UPLOAD_MAX_SIZE + DRAWING_UPLOAD_FORM_OVERHEAD:
+            raise HTTPException(status_code=413, detail="Размер файла не должен превышать 10 МБ")
+        
         # Читаем multipart/form-data напрямую из запроса
         # ВАЖНО: читаем только один раз, чтобы избежать ошибки "body stream already read"
         form = await request.form()
@@ -2445,26 +2386,44 @@ async def upload_photo_for_drawing_contest(
         if not file or not hasattr(file, 'read'):
             raise HTTPException(status_code=400, detail="Файл не найден в запросе")
         
-        # Сохраняем имя файла ДО чтения
         original_filename = file.filename or "photo.jpg"
         
-        # Читаем файл ОДИН РАЗ
-        try:
-            file_content = await file.read()
-        except Exception as e:
-            logger.error(f"Ошибка при чтении файла: {e}", exc_info=True)
-            raise HTTPException(status_code=400, detail=f"Ошибка при чтении файла: {str(e)}")
-        
         # Проверяем тип файла
         if not file.content_type or not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="Файл должен быть изображением")
         
-        if len(file_content) == 0:
-            raise HTTPException(status_code=400, detail="Файл пуст")
-        
-        if len(file_content) > 10 * 1024 * 1024:  # 10 MB
-            raise HTTPException(status_code=400, detail="Размер файла не должен превышать 10 МБ")
+        # Копируем файл на диск блоками, не читая его целиком в память
+        try:
+            upload_path, upload_size = await spool_upload(file, DRAWING_UPLOADS_TMP_DIR, DRAWING_UPLOAD_MAX_SIZE)
+        except UploadTooLarge:
+            raise HTTPException(status_code=413, detail="Размер файла не должен превышать 10 МБ")
+        except Exception as e:
+            logger.error(f"Ошибка при чтении файла: {e}", exc_info=True)
+            raise HTTPException(status_code=400, detail=f"Ошибка при чтении файла: {str(e)}")
         
+        try:
+            if upload_size == 0:
+                raise HTTPException(status_code=400, detail="Файл пуст")
+            return await _store_drawing_upload(contest_id, user_id, user_username, original_filename, upload_path)
+        finally:
+            remove_quietly(upload_path)
+    except HTTPException:
+        raise
+    except Exception as e:
+        error_msg = str(e)
+        # Проверяем, не связана ли ошибка с чтением тела запроса
+        if "body" in error_msg.lower() or "stream" in error_msg.lower() or "locked" in error_msg.lower() or "disturbed" in error_msg.lower():
+            logger.error(f"Ошибка чтения тела запроса при загрузке фотографии: {e}", exc_info=True)
+            raise HTTPException(status_code=400, detail="Ошибка обработки запроса. Попробуйте загрузить фотографию еще раз.")
+        logger.error(f"Ошибка при загрузке фотографии: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Ошибка при загрузке фотографии: {error_msg}")
+
+
+async def _store_drawing_upload(contest_id: int, user_id: int, user_username, original_filename: str, upload_path: str) -> dict:
+    """Проверяет участника, обрабатывает изображение в пуле процессов, сохраняет работу и отправляет её создателю"""
+    processed_path = None
+    derivative_tmp_paths = []
+    try:
         async with async_session() as session:
             # Получаем информацию о конкурсе
             giveaway_result = await session.execute(
@@ -2508,114 +2467,17 @@ async def upload_photo_for_drawing_contest(
             if participant.photo_link:
                 raise HTTPException(status_code=400, detail="Вы уже загрузили фотографию для этого конкурса")
             
-            # Ресайзим изображение, если оно слишком большое (Telegram API ограничение: 10000x10000)
+            # Ресайз/перекодирование (Telegram API ограничение: 10000x10000) - в пуле процессов
+            image_path = upload_path
+            image_format = None
+            processed_path = upload_path + ".processed"
             try:
-                from PIL import Image
-                import io as io_module  # Используем явный импорт, чтобы избежать конфликта
-                max_dimension = 10000  # Максимальный размер для Telegram API
-                max_file_size = 50 * 1024 * 1024  # 50 МБ (увеличено для больших фотографий)
-                
-                # Открываем изображение из байтов
-                img = Image.open(io_module.BytesIO(file_content))
-                original_size = img.size
-                original_format = img.format
-                
-                # Конвертируем RGBA в RGB для JPEG (если нужно)
-                if img.mode in ('RGBA', 'LA', 'P') and original_format != 'PNG':
-                    # Создаем белый фон для изображений с прозрачностью
-                    background = Image.new('RGB', img.size, (255, 255, 255))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA')
-                    background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                    img = background
-                
-                # Проверяем размеры
-                needs_resize = img.width > max_dimension or img.height > max_dimension
-                if needs_resize:
-                    logger.info(f"📐 Ресайз изображения: {original_size} -> максимум {max_dimension}x{max_dimension}")
-                    # Вычисляем новые размеры с сохранением пропорций
-                    ratio = min(max_dimension / img.width, max_dimension / img.height)
-                    new_width = int(img.width * ratio)
-                    new_height = int(img.height * ratio)
-                    # Используем совместимый способ ресайза
-                    try:
-                        # Для новых версий PIL
-                        img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                    except AttributeError:
-                        # Для старых версий PIL
-                        img = img.resize((new_width, new_height), Image.LANCZOS)
-                    logger.info(f"📐 Новые размеры: {img.size}")
-                
-                # Сохраняем в байты и проверяем размер файла
-                output = io_module.BytesIO()
-                # Определяем формат для сохранения
-                if original_format == 'PNG' and img.mode != 'RGBA':
-                    # Если оригинал был PNG, но мы конвертировали в RGB, используем JPEG
-                    format_ext = 'JPEG'
-                elif original_format in ['JPEG', 'JPG']:
-                    format_ext = 'JPEG'
-                elif original_format == 'PNG':
-                    format_ext = 'PNG'
-                else:
-                    format_ext = 'JPEG'  # По умолчанию JPEG
-                
-                # Пробуем сохранить с разным качеством, если файл слишком большой
-                # Начинаем с более низкого качества для лучшего сжатия
-                quality = 85
-                max_quality_iterations = 20  # Увеличено количество итераций
-                iteration = 0
-                min_quality = 30  # Минимальное качество (не ниже 30 для читаемости)
-                
-                while iteration < max_quality_iterations:
-                    output.seek(0)
-                    output.truncate(0)
-                    if format_ext == 'JPEG':
-                        img.save(output, format='JPEG', quality=quality, optimize=True)
-                    else:
-                        # Для PNG также пробуем сжать, если возможно
-                        if format_ext == 'PNG':
-                            # Пробуем сохранить PNG с оптимизацией
-                            img.save(output, format='PNG', optimize=True)
-                        else:
-                            img.save(output, format=format_ext, optimize=True)
-                    
-                    file_size = len(output.getvalue())
-                    # Если файл помещается в лимит или достигли минимального качества - останавливаемся
-                    if file_size <= max_file_size or quality <= min_quality:
-                        break
-                    # Более агрессивное снижение качества для больших файлов
-                    if file_size > max_file_size * 2:
-                        quality -= 10  # Снижаем на 10 для очень больших файлов
-                    else:
-                        quality -= 5  # Обычное снижение на 5
-                    iteration += 1
-                
-                # Если файл все еще слишком большой, пробуем уменьшить размер изображения
-                final_file_size = len(output.getvalue())
-                if final_file_size > max_file_size:
-                    logger.warning(f"⚠️ Файл все еще слишком большой ({final_file_size} байт), уменьшаем размер изображения")
-                    # Уменьшаем размер изображения на 20%
-                    new_width = int(img.width * 0.8)
-                    new_height = int(img.height * 0.8)
-                    try:
-                        img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                    except AttributeError:
-                        img = img.resize((new_width, new_height), Image.LANCZOS)
-                    
-                    # Пробуем сохранить снова с минимальным качеством
-                    output.seek(0)
-                    output.truncate(0)
-                    if format_ext == 'JPEG':
-                        img.save(output, format='JPEG', quality=min_quality, optimize=True)
-                    else:
-                        img.save(output, format=format_ext, optimize=True)
-                    
-                    final_file_size = len(output.getvalue())
-                    logger.info(f"📦 Размер файла после уменьшения изображения: {final_file_size} байт")
-                
-                file_content = output.getvalue()
-                logger.info(f"📦 Размер файла после обработки: {len(file_content)} байт (качество: {quality}, формат: {format_ext})")
-                
+                image_info = await process_image(upload_path, processed_path)
+                image_path = processed_path
+                image_format = image_info["format"]
+                logger.info(f"📦 Размер файла после обработки: {image_info['size']} байт (качество: {image_info['quality']}, формат: {image_format})")
+            except ImageQueueFull:
+                raise HTTPException(status_code=503, detail="Сервер перегружен обработкой изображений. Попробуйте еще раз через минуту.")
             except ImportError:
                 logger.warning("⚠️ PIL/Pillow не установлен, пропускаем ресайз изображения. Установите: pip install Pillow")
             except Exception as e:
@@ -2630,14 +2492,6 @@ async def upload_photo_for_drawing_contest(
             local_rel_path = None
 
             try:
-                import tempfile
-                import io
-
-                try:
-                    from aiogram.types import BufferedInputFile as LocalBufferedInputFile
-                except ImportError:
-                    LocalBufferedInputFile = None
-
                 # Определяем ID создателя конкурса - фото должно отправляться ему
                 preferred_creator_id = getattr(giveaway, 'created_by', None)
                 chat_candidates = []
@@ -2671,39 +2525,39 @@ async def upload_photo_for_drawing_contest(
                 
                 logger.info(f"📤 Отправка фото конкурса {contest_id} создателю {chat_id} от пользователя {user_id}")
 
-                def build_buffered_input():
-                    if LocalBufferedInputFile is None:
-                        return None
-                    try:
-                        return LocalBufferedInputFile(file_content, filename=original_filename)
-                    except Exception:
-                        return None
-
-                async def send_photo_with_fallback(target_chat_id: int, caption: str, reply_markup=None):
-                    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-                    buffered = build_buffered_input()
-                    if buffered is not None:
-                        return await bot.send_photo(chat_id=target_chat_id, photo=buffered, caption=caption, reply_markup=reply_markup)
+                def build_photo_input(photo_path: str):
                     if FSInputFile is not None:
-                        tmp_path = None
-                        try:
-                            with tempfile.NamedTemporaryFile(delete=False, suffix=(f"_{original_filename}" if original_filename else "")) as tmp:
-                                tmp.write(file_content)
-                                tmp_path = tmp.name
-                            return await bot.send_photo(chat_id=target_chat_id, photo=FSInputFile(tmp_path), caption=caption, reply_markup=reply_markup)
-                        finally:
-                            if tmp_path and os.path.exists(tmp_path):
-                                try:
-                                    os.remove(tmp_path)
-                                except Exception:
-                                    pass
-                    return await bot.send_photo(chat_id=target_chat_id, photo=file_content, caption=caption, reply_markup=reply_markup)
+                        return FSInputFile(photo_path, filename=original_filename)
+                    from aiogram.types import InputFile
+                    return InputFile(photo_path, filename=original_filename)
+
+                async def send_photo_with_fallback(target_chat_id: int, caption: str, photo_path: str, file_id: str = None, reply_markup=None):
+                    # Если такой же файл уже отправлялся, используем его file_id - байты не загружаются повторно
+                    if file_id:
+                        _, results = await send_photo_batch(bot, [target_chat_id], file_id=file_id, caption=caption, reply_markup=reply_markup)
+                        if not isinstance(results[target_chat_id], Exception):
+                            return results[target_chat_id]
+                        logger.warning(f"⚠️ Не удалось отправить фото по file_id, загружаем файл: {results[target_chat_id]}")
+                    _, results = await send_photo_batch(bot, [target_chat_id], photo=build_photo_input(photo_path), caption=caption, reply_markup=reply_markup)
+                    if isinstance(results[target_chat_id], Exception):
+                        raise results[target_chat_id]
+                    return results[target_chat_id]
 
                 logger.debug(f"📨 Обработка загрузки работы для конкурса {contest_id} пользователем {user_id}")
 
-                async with drawing_data_lock:
-                    drawing_data = load_drawing_data()
-                    contest_key = str(contest_id)
+                # Уменьшенные копии для голосования строятся один раз, до захвата блокировки
+                derivatives = {}
+                try:
+                    derivatives = await make_derivatives(image_path, DRAWING_UPLOADS_TMP_DIR)
+                    derivative_tmp_paths = [info["path"] for info in derivatives.values() if info.get("path")]
+                except ImportError:
+                    pass
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось построить уменьшенные копии работы: {e}", exc_info=True)
+
+                contest_key = str(contest_id)
+
+                def ensure_contest_entry(drawing_data: dict) -> dict:
                     contest_entry = drawing_data.get(contest_key)
                     if not contest_entry:
                         created_at_msk = None
@@ -2728,61 +2582,79 @@ async def upload_photo_for_drawing_contest(
                         if getattr(giveaway, 'conditions', None):
                             contest_entry["topic"] = giveaway.conditions
                         contest_entry["created_by"] = preferred_creator_id
+                    return contest_entry
 
-                    works = contest_entry.setdefault("works", [])
+                def assign_work_number(works: list):
                     existing_work = next((w for w in works if w.get("participant_user_id") == user_id), None)
                     if existing_work and existing_work.get("work_number"):
-                        work_number = existing_work["work_number"]
-                    else:
-                        work_number = len(works) + 1
-
-                    file_ext = os.path.splitext(original_filename or "")[1].lower()
-                    if not file_ext or len(file_ext) > 5:
-                        file_ext = ".jpg"
-                    work_dir = os.path.join(DRAWING_UPLOADS_DIR, f"contest_{contest_id}")
-                    _ensure_dir(work_dir)
-                    local_filename = f"work_{work_number}{file_ext}"
-                    local_path = os.path.join(work_dir, local_filename)
-                    with open(local_path, "wb") as f_out:
-                        f_out.write(file_content)
-                    local_rel_path = os.path.relpath(local_path, ROOT_DIR).replace("\\", "/")
+                        return existing_work, existing_work["work_number"]
+                    return existing_work, len(works) + 1
 
+                def build_creator_caption(work_number: int) -> str:
                     # Получаем username: сначала из параметров, потом из базы данных, если не передан
                     final_username = user_username
                     if not final_username and participant and participant.username:
                         final_username = participant.username
-                    
                     # Формируем подпись с username и ID
                     if final_username:
-                        caption_creator = f"Конкурс рисунков #{contest_id}\nРабота #{work_number}\nУчастник: @{final_username} (ID: {user_id})"
-                    else:
-                        # Если username нет, показываем только ID
-                        caption_creator = f"Конкурс рисунков #{contest_id}\nРабота #{work_number}\nУчастник: ID: {user_id}"
-                    caption_user = f"Конкурс рисунков #{contest_id}\nВаша работа #{work_number}"
+                        return f"Конкурс рисунков #{contest_id}\nРабота #{work_number}\nУчастник: @{final_username} (ID: {user_id})"
+                    # Если username нет, показываем только ID
+                    return f"Конкурс рисунков #{contest_id}\nРабота #{work_number}\nУчастник: ID: {user_id}"
 
-                    try:
-                        logger.info(f"📤 Попытка отправить фото конкурса {contest_id} создателю {chat_id}")
-                        sent_message = await send_photo_with_fallback(chat_id, caption_creator)
-                        logger.info(f"✅ Фото успешно отправлено создателю {chat_id}, message_id={sent_message.message_id}, reply_markup установлен")
-                    except Exception as send_error:
-                        logger.error(f"❌ Ошибка при отправке фото создателю {chat_id}: {send_error}", exc_info=True)
-                        try:
-                            if os.path.exists(local_path):
-                                os.remove(local_path)
-                        except Exception:
-                            pass
-                        error_detail = f"Не удалось отправить фотографию создателю конкурса. Убедитесь, что создатель начал диалог с ботом. Ошибка: {str(send_error)}"
-                        raise HTTPException(status_code=500, detail=error_detail) from send_error
+                if image_format:
+                    file_ext = ".png" if image_format == "PNG" else ".jpg"
+                else:
+                    file_ext = os.path.splitext(original_filename or "")[1].lower()
+                    if not file_ext or len(file_ext) > 5:
+                        file_ext = ".jpg"
+                # Файлы уже на диске - перемещаем в хранилище по хэшу содержимого
+                # (одинаковые файлы хранятся один раз; сборщик мусора не трогает свежие файлы)
+                local_rel_path = drawing_blob_store.put_file(image_path, file_ext)
+                local_path = os.path.join(ROOT_DIR, local_rel_path)
+                for info in derivatives.values():
+                    if info.get("path"):
+                        info["path"] = drawing_blob_store.put_file(info["path"], os.path.splitext(info["path"])[1])
+                new_paths = [local_rel_path] + [info["path"] for info in derivatives.values() if info.get("path")]
+
+                # Номер работы для подписи и file_id уже отправленного файла - под короткой блокировкой
+                async with drawing_data_lock:
+                    works = (load_drawing_data().get(contest_key) or {}).get("works", [])
+                    _, caption_work_number = assign_work_number(works)
+                    known_file_id = next(
+                        (w.get("photo_file_id") for w in works if w.get("local_path") == local_rel_path and w.get("photo_file_id")),
+                        None
+                    )
 
-                    photo_file_id = sent_message.photo[-1].file_id if sent_message.photo else None
-                    photo_message_id = sent_message.message_id
+                # Фото отправляется без блокировки: ожидание flood-wait Telegram
+                # не должно останавливать голосование и загрузки во всех процессах
+                try:
+                    logger.info(f"📤 Попытка отправить фото конкурса {contest_id} создателю {chat_id}")
+                    sent_message = await send_photo_with_fallback(chat_id, build_creator_caption(caption_work_number), local_path, file_id=known_file_id)
+                    logger.info(f"✅ Фото успешно отправлено создателю {chat_id}, message_id={sent_message.message_id}, reply_markup установлен")
+                except Exception as send_error:
+                    logger.error(f"❌ Ошибка при отправке фото создателю {chat_id}: {send_error}", exc_info=True)
+                    async with drawing_data_lock:
+                        drawing_blob_store.remove_if_unreferenced(new_paths, referenced_paths(load_drawing_data()))
+                    error_detail = f"Не удалось отправить фотографию создателю конкурса. Убедитесь, что создатель начал диалог с ботом. Ошибка: {str(send_error)}"
+                    raise HTTPException(status_code=500, detail=error_detail) from send_error
+
+                photo_file_id = sent_message.photo[-1].file_id if sent_message.photo else None
+                photo_message_id = sent_message.message_id
+
+                chat_id_int = chat_id if isinstance(chat_id, int) else None
+                if chat_id_int is not None and chat_id_int < 0:
+                    channel_id = str(chat_id_int).replace('-100', '')
+                    photo_link = f"https://t.me/c/{channel_id}/{photo_message_id}"
+                else:
+                    photo_link = f"tg://photo?file_id={photo_file_id}" if photo_file_id else None
 
-                    chat_id_int = chat_id if isinstance(chat_id, int) else None
-                    if chat_id_int is not None and chat_id_int < 0:
-                        channel_id = str(chat_id_int).replace('-100', '')
-                        photo_link = f"https://t.me/c/{channel_id}/{photo_message_id}"
-                    else:
-                        photo_link = f"tg://photo?file_id={photo_file_id}" if photo_file_id else None
+                async with drawing_data_lock:
+                    drawing_data = load_drawing_data()
+                    contest_entry = ensure_contest_entry(drawing_data)
+                    works = contest_entry.setdefault("works", [])
+                    # Номер назначается заново: пока фото отправлялось, работу мог добавить другой участник
+                    existing_work, work_number = assign_work_number(works)
+                    old_paths = list(referenced_paths({contest_key: {"works": [existing_work]}})) if existing_work else []
 
                     work_record = existing_work or {
                         "work_number": work_number,
@@ -2795,12 +2667,22 @@ async def upload_photo_for_drawing_contest(
                         "photo_message_id": photo_message_id,
                         "photo_file_id": photo_file_id,
                         "local_path": local_rel_path,
+                        "derivatives": derivatives,
                         "uploaded_at": now_msk.isoformat()
                     })
                     if not existing_work:
                         works.append(work_record)
 
                     save_drawing_data(drawing_data)
+                    contest_event_bus.mark_changed(contest_id, "drawing")
+                    # Файлы предыдущей загрузки этой работы, если на них больше никто не ссылается
+                    drawing_blob_store.remove_if_unreferenced(old_paths, referenced_paths(drawing_data))
+
+                if work_number != caption_work_number:
+                    try:
+                        await bot.edit_message_caption(chat_id=chat_id, message_id=photo_message_id, caption=build_creator_caption(work_number))
+                    except Exception as e:
+                        logger.warning(f"⚠️ Не удалось исправить номер работы в подписи фото {photo_message_id}: {e}")
             finally:
                 try:
                     bot_session = await bot.get_session()
@@ -2813,6 +2695,7 @@ async def upload_photo_for_drawing_contest(
             participant.photo_message_id = photo_message_id
 
             await session.commit()
+            profile_stats_cache.invalidate(participant.user_id)
 
             return {
                 "success": True,
@@ -2821,16 +2704,10 @@ async def upload_photo_for_drawing_contest(
                 "photo_message_id": photo_message_id,
                 "work_number": work_number
             }
-    except HTTPException:
-        raise
-    except Exception as e:
-        error_msg = str(e)
-        # Проверяем, не связана ли ошибка с чтением тела запроса
-        if "body" in error_msg.lower() or "stream" in error_msg.lower() or "locked" in error_msg.lower() or "disturbed" in error_msg.lower():
-            logger.error(f"Ошибка чтения тела запроса при загрузке фотографии: {e}", exc_info=True)
-            raise HTTPException(status_code=400, detail="Ошибка обработки запроса. Попробуйте загрузить фотографию еще раз.")
-        logger.error(f"Ошибка при загрузке фотографии: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Ошибка при загрузке фотографии: {error_msg}")
+    finally:
+        remove_quietly(processed_path)
+        for path in derivative_tmp_paths:
+            remove_quietly(path)
 
 @app.post("/api/contests/{contest_id}/submit-collection")
 async def submit_collection_for_contest(
@@ -2936,10 +2813,12 @@ async def submit_collection_for_contest(
                 })
                 
                 save_collection_data(collection_data)
+                contest_event_bus.mark_changed(contest_id, "collection")
                 
                 # Обновляем participant, чтобы отметить, что коллекция отправлена
                 participant.photo_link = "collection_submitted"  # Используем как флаг
                 await session.commit()
+                profile_stats_cache.invalidate(participant.user_id)
             
             return {
                 "success": True,
@@ -3138,6 +3017,7 @@ async def verify_subscription(contest_id: int, request: Request):
                 )
                 session.add(participant)
                 await session.commit()
+                profile_stats_cache.invalidate(user_id)
                 
                 return {"success": True, "message": "✅ Вы успешно присоединились к конкурсу!"}
             except IntegrityError as e:
@@ -3174,7 +3054,7 @@ async def verify_subscription(contest_id: int, request: Request):
 async def get_participant_status(contest_id: int, user_id: int = Query(...)):
     """Получить статус участия пользователя в конкурсе (участвует ли, загружена ли фотография/коллекция)"""
     try:
-        async with async_session() as session:
+        async with read_session() as session:
             from models import Participant
             giveaway_result = await session.execute(
                 select(Giveaway).where(Giveaway.id == contest_id)
@@ -3226,7 +3106,7 @@ async def get_participant_status(contest_id: int, user_id: int = Query(...)):
 @app.get("/api/contests/{contest_id}/can-vote")
 async def can_user_vote(contest_id: int, user_id: int = Query(...)):
     """Проверить, может ли пользователь голосовать в конкурсе"""
-    async with async_session() as session:
+    async with read_session() as session:
         giveaway_result = await session.execute(select(Giveaway).where(Giveaway.id == contest_id))
         giveaway = giveaway_result.scalars().first()
 
@@ -3298,11 +3178,24 @@ async def can_user_vote(contest_id: int, user_id: int = Query(...)):
         }
 
 @app.get("/api/contests/{contest_id}/voting-queue")
-async def get_voting_queue(contest_id: int, user_id: int = Query(...)):
-    """Получить список работ для голосования в конкурсе рисунков"""
+async def get_voting_queue(
+    contest_id: int,
+    user_id: int = Query(...),
+    cursor: int = Query(None),
+    limit: int = Query(None),
+    unrated_only: bool = Query(False),
+):
+    """
+    Получить список работ для голосования в конкурсе рисунков
+    
+    Без cursor/limit возвращается вся очередь. С limit - страница после работы cursor;
+    unrated_only=true отдаёт только неоценённые работы ("следующая неоценённая").
+    next_cursor - курсор следующей страницы, prefetch_image_url - изображение
+    следующей работы для предзагрузки в WebApp.
+    """
     from models import Participant
 
-    async with async_session() as session:
+    async with read_session() as session:
         giveaway_result = await session.execute(select(Giveaway).where(Giveaway.id == contest_id))
         giveaway = giveaway_result.scalars().first()
 
@@ -3347,20 +3240,17 @@ async def get_voting_queue(contest_id: int, user_id: int = Query(...)):
         
         print(f"DEBUG get_voting_queue: audience_voting={audience_voting}, audience_voting_enabled={audience_voting_enabled}")
         
-        # Все могут голосовать: создатель, жюри, участники и зрители (если включены зрительские симпатии)
-        can_vote = is_creator or is_jury_member or audience_voting_enabled
-        
-        # Если ни создатель, ни жюри, ни зрительские симпатии не включены - проверяем участие
-        if not can_vote:
-            participant_result = await session.execute(
-                select(Participant).where(
-                    Participant.giveaway_id == contest_id,
-                    Participant.user_id == user_id
-                )
+        # Участие проверяем один раз: оно нужно и для прав, и для категории голоса
+        participant_result = await session.execute(
+            select(Participant.id).where(
+                Participant.giveaway_id == contest_id,
+                Participant.user_id == user_id
             )
-            participant = participant_result.scalars().first()
-            if participant:
-                can_vote = True
+        )
+        is_participant = participant_result.first() is not None
+
+        # Все могут голосовать: создатель, жюри, участники и зрители (если включены зрительские симпатии)
+        can_vote = is_creator or is_jury_member or audience_voting_enabled or is_participant
 
         if not can_vote:
             raise HTTPException(status_code=403, detail="У вас нет прав для голосования в этом конкурсе")
@@ -3375,17 +3265,6 @@ async def get_voting_queue(contest_id: int, user_id: int = Query(...)):
         if voting_end and now_msk > voting_end:
             raise HTTPException(status_code=400, detail="Голосование завершено")
 
-        # ВАЖНО: Проверяем, является ли пользователь участником конкурса
-        # Делаем это ДО входа в блок drawing_data_lock, чтобы сессия БД была активна
-        participant_result = await session.execute(
-            select(Participant).where(
-                Participant.giveaway_id == contest_id,
-                Participant.user_id == user_id
-            )
-        )
-        participant = participant_result.scalars().first()
-        is_participant = participant is not None
-
     # Определяем тип голосующего: жюри/создатель или участник (зритель)
     is_jury_or_creator_local = is_creator or is_jury_member
     
@@ -3394,73 +3273,58 @@ async def get_voting_queue(contest_id: int, user_id: int = Query(...)):
     # ВАЖНО: Если пользователь участник, он может голосовать, даже если audience_voting не установлено
     is_audience_local = not is_jury_or_creator_local and (audience_voting_enabled or is_participant)
 
+    # Категория голосов пользователя; для обратной совместимости по умолчанию - старая структура votes
+    if is_jury_or_creator_local:
+        category = "jury_votes"
+    elif is_audience_local and audience_voting_enabled:
+        category = "audience_votes"
+    else:
+        category = "votes"
+
+    if limit is not None:
+        limit = max(1, min(limit, 100))
+
     async with drawing_data_lock:
-        drawing_data = load_drawing_data()
-        contest_entry = drawing_data.get(str(contest_id))
-        if not contest_entry:
+        vote_index = get_drawing_vote_index(contest_id)
+        if vote_index is None:
             return {"success": True, "works": [], "total": 0}
 
-        works_raw = contest_entry.get("works", [])
-        works_sorted = sorted(works_raw, key=lambda w: w.get("work_number", 0))
-        sanitized = []
-        for work in works_sorted:
-            work_number = work.get("work_number")
-            local_path = work.get("local_path")
-            participant_user_id = work.get("participant_user_id")
-            
-            # Пропускаем работы без необходимых данных
-            if not work_number or not local_path or not participant_user_id:
-                continue
-            
-            # Пропускаем собственную работу пользователя
-            if participant_user_id == user_id:
-                continue
-            
-            # Проверяем голоса в соответствующей категории
-            already_rated = False
-            rating = None
-            if is_jury_or_creator_local:
-                jury_votes = work.get("jury_votes", {}) or {}
-                already_rated = str(user_id) in jury_votes
-                rating = jury_votes.get(str(user_id))
-            elif is_audience_local:
-                if audience_voting_enabled:
-                    # Если зрительские симпатии включены, проверяем audience_votes
-                    audience_votes = work.get("audience_votes", {}) or {}
-                    already_rated = str(user_id) in audience_votes
-                    rating = audience_votes.get(str(user_id))
-                else:
-                    # Если зрительские симпатии не включены, но пользователь участник, проверяем старую структуру votes
-                    votes = work.get("votes", {}) or {}
-                    already_rated = str(user_id) in votes
-                    rating = votes.get(str(user_id))
-            else:
-                # Для обратной совместимости проверяем старую структуру votes
-                votes = work.get("votes", {}) or {}
-                already_rated = str(user_id) in votes
-                rating = votes.get(str(user_id))
-            
-            sanitized.append({
+        # Очередь уже отсортирована в индексе, собственные работы пропускаются
+        page, next_work_number = vote_index.queue_page(category, user_id, cursor, limit, unrated_only)
+        sanitized = [
+            {
                 "work_number": work_number,
-                "image_url": f"/api/drawing-contests/{contest_id}/works/{work_number}/image",
-                "already_rated": already_rated,
+                **_drawing_image_urls(contest_id, work_number, vote_index.payloads.get(work_number)),
+                "already_rated": rating is not None,
                 "rating": rating,
-                "is_own": False  # Все работы здесь уже не свои, так как мы их отфильтровали
-            })
+                "is_own": False  # Собственные работы в очередь не попадают
+            }
+            for work_number, rating in page
+        ]
 
         # can_vote уже определен выше при проверке прав доступа
         return {
             "success": True,
             "works": sanitized,
             "total": len(sanitized),
+            "remaining": vote_index.remaining(category, user_id),
+            "next_cursor": sanitized[-1]["work_number"] if next_work_number is not None and sanitized else None,
+            "prefetch_image_url": (
+                _drawing_image_urls(contest_id, next_work_number, vote_index.payloads.get(next_work_number))["image_url"]
+                if next_work_number is not None else None
+            ),
             "can_vote": can_vote  # Информация о правах доступа для оценивания
         }
 
 @app.post("/api/contests/{contest_id}/vote")
-async def submit_vote(contest_id: int, request: Request):
+async def submit_vote(
+    contest_id: int,
+    request: Request,
+    caller: Optional[WebAppUser] = Depends(current_user("user_id", body=True)),
+):
     """Сохранить оценку за работу конкурса рисунков"""
     data = await request.json()
-    user_id = data.get("user_id")
+    user_id = caller.id if caller is not None else None
     work_number = data.get("work_number")
     score = data.get("score")
 
@@ -3576,75 +3440,44 @@ async def submit_vote(contest_id: int, request: Request):
     # ВАЖНО: Если пользователь участник, он может голосовать, даже если audience_voting не установлено
     is_audience = not is_jury_or_creator and (audience_voting_enabled or is_participant)
 
+    # Голос жюри/создателя - в jury_votes; голос участника (зрителя) - в audience_votes,
+    # если зрительские симпатии включены, иначе в старую структуру votes
+    if is_jury_or_creator:
+        category = "jury_votes"
+        already_voted_detail = "Вы уже оценили эту работу как жюри/создатель. Повторная оценка не разрешена."
+    elif is_audience and audience_voting_enabled:
+        category = "audience_votes"
+        already_voted_detail = "Вы уже оценили эту работу как зритель. Повторная оценка не разрешена."
+    elif is_audience:
+        category = "votes"
+        already_voted_detail = "Вы уже оценили эту работу. Повторная оценка не разрешена."
+    else:
+        raise HTTPException(status_code=403, detail="У вас нет прав для голосования в этом конкурсе")
+
+    print(f"DEBUG submit_vote: Определение типа голосующего - is_creator={is_creator}, is_jury_member={is_jury_member}, is_participant={is_participant}, audience_voting_enabled={audience_voting_enabled}, category={category}")
+
+    # Файл конкурсов не перечитывается: проверки идут по индексу в памяти,
+    # голос дописывается в журнал и позже сжимается в drawing_contests.json
     async with drawing_data_lock:
-        drawing_data = load_drawing_data()
-        contest_entry = drawing_data.get(str(contest_id))
-        if not contest_entry:
+        vote_index = get_drawing_vote_index(contest_id)
+        if vote_index is None:
             raise HTTPException(status_code=404, detail="Работы для голосования не найдены")
 
-        works = contest_entry.get("works", [])
-        work = next((w for w in works if w.get("work_number") == work_number), None)
-        if not work:
-            raise HTTPException(status_code=404, detail="Работа не найдена")
-        
-        if work.get("participant_user_id") == user_id:
-            raise HTTPException(status_code=400, detail="Вы не можете оценивать собственную работу")
-        
-        print(f"DEBUG submit_vote: Определение типа голосующего - is_creator={is_creator}, is_jury_member={is_jury_member}, is_jury_or_creator={is_jury_or_creator}, is_participant={is_participant}, audience_voting={audience_voting}, audience_voting_enabled={audience_voting_enabled}, is_audience={is_audience}")
-        
-        # Инициализируем структуру голосов, если её нет
-        if "jury_votes" not in work:
-            work["jury_votes"] = {}
-        if "audience_votes" not in work:
-            work["audience_votes"] = {}
-        if "votes" not in work:
-            work["votes"] = {}
+        if not vote_index.has_work(work_number):
+            raise HTTPException(status_code=404, detail="Работа не найдена")
         
-        # Сохраняем голос в соответствующую категорию
-        if is_jury_or_creator:
-            # Голос жюри или создателя
-            jury_votes = work["jury_votes"]
-            if str(user_id) in jury_votes:
-                raise HTTPException(status_code=400, detail="Вы уже оценили эту работу как жюри/создатель. Повторная оценка не разрешена.")
-            jury_votes[str(user_id)] = score
-        elif is_audience:
-            # Голос участника (зрителя)
-            if audience_voting_enabled:
-                # Если зрительские симпатии включены, сохраняем в audience_votes
-                audience_votes = work["audience_votes"]
-                if str(user_id) in audience_votes:
-                    raise HTTPException(status_code=400, detail="Вы уже оценили эту работу как зритель. Повторная оценка не разрешена.")
-                audience_votes[str(user_id)] = score
-                print(f"DEBUG submit_vote: Голос участника сохранен в audience_votes - user_id={user_id}, work_number={work_number}, score={score}")
-            else:
-                # Если зрительские симпатии не включены, но пользователь участник, сохраняем в старую структуру votes
-                votes = work["votes"]
-                if str(user_id) in votes:
-                    raise HTTPException(status_code=400, detail="Вы уже оценили эту работу. Повторная оценка не разрешена.")
-                votes[str(user_id)] = score
-                print(f"DEBUG submit_vote: Голос участника сохранен в votes - user_id={user_id}, work_number={work_number}, score={score}")
-        else:
-            raise HTTPException(status_code=403, detail="У вас нет прав для голосования в этом конкурсе")
+        if vote_index.work_owner(work_number) == user_id:
+            raise HTTPException(status_code=400, detail="Вы не можете оценивать собственную работу")
 
-        # Подсчитываем оставшиеся работы для голосования
-        remaining = 0
-        for w in works:
-            if w.get("participant_user_id") == user_id:
-                continue
-            if is_jury_or_creator:
-                if str(user_id) not in (w.get("jury_votes") or {}):
-                    remaining += 1
-            elif is_audience:
-                if audience_voting_enabled:
-                    # Если зрительские симпатии включены, проверяем audience_votes
-                    if str(user_id) not in (w.get("audience_votes") or {}):
-                        remaining += 1
-                else:
-                    # Если зрительские симпатии не включены, проверяем старую структуру votes
-                    if str(user_id) not in (w.get("votes") or {}):
-                        remaining += 1
+        if vote_index.is_rated(category, user_id, work_number):
+            raise HTTPException(status_code=400, detail=already_voted_detail)
 
-        save_drawing_data(drawing_data)
+        drawing_vote_log.append(contest_id, work_number, category, user_id, score)
+        vote_index.add_vote(category, user_id, work_number, score)
+        contest_event_bus.mark_changed(contest_id, "drawing")
+
+        # Подсчитываем оставшиеся работы для голосования
+        remaining = vote_index.remaining(category, user_id)
 
     return {
         "success": True,
@@ -3654,21 +3487,39 @@ async def submit_vote(contest_id: int, request: Request):
     }
 
 @app.get("/api/drawing-contests/{contest_id}/works/{work_number}/image")
-async def get_drawing_work_image(contest_id: int, work_number: int):
+async def get_drawing_work_image(
+    request: Request,
+    contest_id: int,
+    work_number: int,
+    size: str = Query(None),
+    v: str = Query(None),
+):
+    """
+    Изображение работы: size=thumb|mid - уменьшенная копия (если есть), иначе оригинал
+    
+    ETag - хэш содержимого. Если в URL передан актуальный v (см. _drawing_image_urls),
+    ответ кэшируется навсегда (immutable), иначе - с ревалидацией по ETag.
+    """
     async with drawing_data_lock:
-        drawing_data = load_drawing_data()
-        contest_entry = drawing_data.get(str(contest_id))
-        if not contest_entry:
+        vote_index = get_drawing_vote_index(contest_id)
+        if vote_index is None:
             raise HTTPException(status_code=404, detail="Конкурс не найден")
-        work = next((w for w in contest_entry.get("works", []) if w.get("work_number") == work_number), None)
-        if not work:
+        if not vote_index.has_work(work_number):
             raise HTTPException(status_code=404, detail="Работа не найдена")
-        
-        local_path = work.get("local_path")
+        payload = vote_index.payloads.get(work_number) or {}
 
+    local_path = payload.get("local_path")
     if not local_path:
         raise HTTPException(status_code=404, detail="Файл не найден")
 
+    derivatives = payload.get("derivatives") or {}
+    derivative = derivatives.get(size) if size and size != "original" else None
+    if derivative:
+        local_path = derivative["path"]
+        etag = derivative["etag"]
+    else:
+        etag = (derivatives.get("original") or {}).get("etag")
+
     full_path = os.path.abspath(os.path.join(ROOT_DIR, local_path))
     uploads_root = os.path.abspath(DRAWING_UPLOADS_DIR)
     if not full_path.startswith(uploads_root):
@@ -3676,13 +3527,23 @@ async def get_drawing_work_image(contest_id: int, work_number: int):
     if not os.path.exists(full_path):
         raise HTTPException(status_code=404, detail="Файл не найден")
 
-    media_type = mimetypes.guess_type(full_path)[0] or "image/jpeg"
-    return FileResponse(full_path, media_type=media_type)
+    if not etag:
+        # Работы, загруженные до появления уменьшенных копий
+        etag = _source_file_etag(full_path)
+    if v and v == etag:
+        cache_control = "public, max-age=31536000, immutable"
+    else:
+        cache_control = "public, no-cache"
+    return serve_static_file(request, full_path, etag, cache_control)
 
 @app.get("/api/contests/{contest_id}/works")
-async def get_contest_works(contest_id: int, current_user_id: int = Query(...)):
+async def get_contest_works(
+    contest_id: int,
+    current_user_id: int = Query(...),
+    caller: Optional[WebAppUser] = Depends(current_user()),
+):
     """Получить список всех работ конкурса (для создателя/админа)"""
-    async with async_session() as session:
+    async with read_session() as session:
         # Проверяем права доступа
         giveaway_result = await session.execute(select(Giveaway).where(Giveaway.id == contest_id))
         giveaway = giveaway_result.scalars().first()
@@ -3695,14 +3556,11 @@ async def get_contest_works(contest_id: int, current_user_id: int = Query(...)):
             raise HTTPException(status_code=400, detail="Этот endpoint доступен только для конкурса рисунков")
         
         # Проверяем права: создатель конкурса или админ
-        user_result = await session.execute(select(User).where(User.telegram_id == current_user_id))
-        user = user_result.scalars().first()
-        
-        if not user:
+        if not caller.exists:
             raise HTTPException(status_code=403, detail="Пользователь не найден")
         
-        is_creator = giveaway.created_by == current_user_id
-        is_admin = user.role in ['admin', 'creator']
+        is_creator = giveaway.created_by == caller.id
+        is_admin = caller.is_admin
         
         if not (is_creator or is_admin):
             raise HTTPException(status_code=403, detail="Недостаточно прав для просмотра работ")
@@ -3722,7 +3580,7 @@ async def get_contest_works(contest_id: int, current_user_id: int = Query(...)):
         works_sorted = sorted(works_raw, key=lambda w: w.get("work_number", 0))
     
     # Используем отдельную сессию для получения информации об участниках
-    async with async_session() as works_session:
+    async with read_session() as works_session:
         from models import Participant
         for work in works_sorted:
             work_number = work.get("work_number")
@@ -3757,7 +3615,8 @@ async def get_contest_works(contest_id: int, current_user_id: int = Query(...)):
                 "participant_user_id": participant_user_id,
                 "username": username or f"User_{participant_user_id}",
                 "has_image": bool(local_path),
-                "image_url": f"/api/drawing-contests/{contest_id}/works/{work_number}/image" if local_path else None
+                "image_url": f"/api/drawing-contests/{contest_id}/works/{work_number}/image" if local_path else None,
+                "thumb_url": _drawing_image_urls(contest_id, work_number, work)["thumb_url"] if local_path else None
             })
     
     return {
@@ -3767,24 +3626,23 @@ async def get_contest_works(contest_id: int, current_user_id: int = Query(...)):
     }
 
 @app.post("/api/contests/{contest_id}/works/{work_number}/cancel")
-async def cancel_contest_work(contest_id: int, work_number: int, request: Request):
+async def cancel_contest_work(
+    contest_id: int,
+    work_number: int,
+    request: Request,
+    caller: Optional[WebAppUser] = Depends(current_user("user_id", body=True)),
+):
     """Аннулировать работу в конкурсе"""
     data = await request.json()
-    current_user_id = data.get("user_id")
     reason = data.get("reason", "").strip()
     
-    if not current_user_id:
+    if caller is None:
         raise HTTPException(status_code=400, detail="Необходимо указать user_id")
+    current_user_id = caller.id
     
     if not reason:
         raise HTTPException(status_code=400, detail="Необходимо указать причину аннулирования")
     
-    try:
-        current_user_id = int(current_user_id)
-        work_number = int(work_number)
-    except (TypeError, ValueError):
-        raise HTTPException(status_code=400, detail="Неверный формат данных")
-    
     async with async_session() as session:
         # Проверяем права доступа
         giveaway_result = await session.execute(select(Giveaway).where(Giveaway.id == contest_id))
@@ -3798,14 +3656,11 @@ async def cancel_contest_work(contest_id: int, work_number: int, request: Reques
             raise HTTPException(status_code=400, detail="Этот endpoint доступен только для конкурса рисунков")
         
         # Проверяем права: создатель конкурса или админ
-        user_result = await session.execute(select(User).where(User.telegram_id == current_user_id))
-        user = user_result.scalars().first()
-        
-        if not user:
+        if not caller.exists:
             raise HTTPException(status_code=403, detail="Пользователь не найден")
         
         is_creator = giveaway.created_by == current_user_id
-        is_admin = user.role in ['admin', 'creator']
+        is_admin = caller.is_admin
         
         if not (is_creator or is_admin):
             raise HTTPException(status_code=403, detail="Недостаточно прав для аннулирования работ")
@@ -3836,8 +3691,8 @@ async def cancel_contest_work(contest_id: int, work_number: int, request: Reques
             participant_user_id = work.get("participant_user_id")
             local_path = work.get("local_path")
             
-            # Удаляем файл фото, если он существует
-            if local_path:
+            # Удаляем файл фото, если он существует (файлы хранилища - после сохранения, по ссылкам)
+            if local_path and not drawing_blob_store.contains(local_path):
                 try:
                     full_path = os.path.join(ROOT_DIR, local_path)
                     if os.path.exists(full_path):
@@ -3848,6 +3703,7 @@ async def cancel_contest_work(contest_id: int, work_number: int, request: Reques
             
             # Удаляем работу из списка
             works.remove(work)
+            released_paths = list(referenced_paths({str(contest_id): {"works": [work]}}))
             
             # ВАЖНО: Пересчитываем номера работ, чтобы они были последовательными (1, 2, 3, ...)
             # Сортируем работы по текущему номеру
@@ -3861,8 +3717,9 @@ async def cancel_contest_work(contest_id: int, work_number: int, request: Reques
                     work_item["work_number"] = new_number
                     
                     # Переименовываем файл, если он существует
+                    # (файлы хранилища названы по содержимому и не переименовываются)
                     old_local_path = work_item.get("local_path")
-                    if old_local_path:
+                    if old_local_path and not drawing_blob_store.contains(old_local_path):
                         try:
                             old_full_path = os.path.join(ROOT_DIR, old_local_path)
                             if os.path.exists(old_full_path):
@@ -3891,6 +3748,8 @@ async def cancel_contest_work(contest_id: int, work_number: int, request: Reques
             contest_entry["works"] = works_sorted
             
             save_drawing_data(drawing_data)
+            contest_event_bus.mark_changed(contest_id, "drawing")
+            drawing_blob_store.remove_if_unreferenced(released_paths, referenced_paths(drawing_data))
             
             # Обновляем participant в базе данных - удаляем photo_link
             from models import Participant
@@ -3905,29 +3764,20 @@ async def cancel_contest_work(contest_id: int, work_number: int, request: Reques
                 participant.photo_link = None
                 participant.photo_message_id = None
                 await session.commit()
+                profile_stats_cache.invalidate(participant_user_id)
                 logger.info(f"✅ Обновлен participant для пользователя {participant_user_id} в конкурсе {contest_id}")
         
         # Получаем название конкурса
         contest_title = getattr(giveaway, 'title', f"Конкурс #{contest_id}")
         
-        # Отправляем сообщение участнику через бота
+        # Отправляем сообщение участнику через очередь сообщений бота
         try:
-            from aiogram import Bot
-            bot = Bot(token=BOT_TOKEN)
             participant_message = (
                 f"❌ Ваша работа аннулирована в конкурсе \"{contest_title}\"\n\n"
                 f"Причина: {reason}"
             )
-            await bot.send_message(chat_id=participant_user_id, text=participant_message)
-            logger.info(f"✅ Отправлено уведомление участнику {participant_user_id} об аннулировании работы")
-            
-            # Закрываем сессию бота
-            try:
-                bot_session = await bot.get_session()
-                if bot_session:
-                    await bot_session.close()
-            except Exception:
-                pass
+            outbound_queue.enqueue(participant_user_id, "send_message", text=participant_message)
+            logger.info(f"✅ Уведомление участнику {participant_user_id} об аннулировании работы поставлено в очередь")
         except Exception as e:
             logger.error(f"⚠️ Ошибка при отправке сообщения участнику {participant_user_id}: {e}")
             # Не прерываем выполнение, если не удалось отправить сообщение
@@ -3938,11 +3788,21 @@ async def cancel_contest_work(contest_id: int, work_number: int, request: Reques
         }
 
 @app.get("/api/contests/{contest_id}/collection-voting-queue")
-async def get_collection_voting_queue(contest_id: int, user_id: int = Query(...)):
-    """Получить список коллекций для голосования в конкурсе коллекций"""
+async def get_collection_voting_queue(
+    contest_id: int,
+    user_id: int = Query(...),
+    cursor: int = Query(None),
+    limit: int = Query(None),
+    unrated_only: bool = Query(False),
+):
+    """
+    Получить список коллекций для голосования в конкурсе коллекций
+    
+    Параметры cursor/limit/unrated_only работают так же, как в /voting-queue.
+    """
     from models import Participant
 
-    async with async_session() as session:
+    async with read_session() as session:
         giveaway_result = await session.execute(select(Giveaway).where(Giveaway.id == contest_id))
         giveaway = giveaway_result.scalars().first()
 
@@ -3971,48 +3831,43 @@ async def get_collection_voting_queue(contest_id: int, user_id: int = Query(...)
         if voting_end and now_msk > voting_end:
             raise HTTPException(status_code=400, detail="Голосование завершено")
 
+    if limit is not None:
+        limit = max(1, min(limit, 100))
+
     async with collection_data_lock:
-        collection_data = load_collection_data()
-        contest_entry = collection_data.get(str(contest_id))
-        if not contest_entry:
+        vote_index = get_collection_vote_index(contest_id)
+        if vote_index is None:
             return {"success": True, "collections": [], "total": 0}
 
-        collections_raw = contest_entry.get("collections", [])
-        collections_sorted = sorted(collections_raw, key=lambda c: c.get("collection_number", 0))
-        sanitized = []
-        for collection in collections_sorted:
-            collection_number = collection.get("collection_number")
-            nft_links = collection.get("nft_links", [])
-            participant_user_id = collection.get("participant_user_id")
-            
-            # Пропускаем коллекции без необходимых данных
-            if not collection_number or not nft_links or len(nft_links) != 9 or not participant_user_id:
-                continue
-            
-            # Пропускаем собственную коллекцию пользователя
-            if participant_user_id == user_id:
-                continue
-            
-            votes = collection.get("votes", {}) or {}
-            sanitized.append({
+        page, next_collection_number = vote_index.queue_page("votes", user_id, cursor, limit, unrated_only)
+        sanitized = [
+            {
                 "collection_number": collection_number,
-                "nft_links": nft_links,
-                "already_rated": str(user_id) in votes,
-                "rating": votes.get(str(user_id)),
+                "nft_links": vote_index.payloads[collection_number]["nft_links"],
+                "already_rated": rating is not None,
+                "rating": rating,
                 "is_own": False
-            })
+            }
+            for collection_number, rating in page
+        ]
 
         return {
             "success": True,
             "collections": sanitized,
-            "total": len(sanitized)
+            "total": len(sanitized),
+            "remaining": vote_index.remaining("votes", user_id),
+            "next_cursor": sanitized[-1]["collection_number"] if next_collection_number is not None and sanitized else None
         }
 
 @app.post("/api/contests/{contest_id}/vote-collection")
-async def submit_collection_vote(contest_id: int, request: Request):
+async def submit_collection_vote(
+    contest_id: int,
+    request: Request,
+    caller: Optional[WebAppUser] = Depends(current_user("user_id", body=True)),
+):
     """Сохранить оценку за коллекцию конкурса коллекций"""
     data = await request.json()
-    user_id = data.get("user_id")
+    user_id = caller.id if caller is not None else None
     collection_number = data.get("collection_number")
     score = data.get("score")
 
@@ -4061,33 +3916,27 @@ async def submit_collection_vote(contest_id: int, request: Request):
             raise HTTPException(status_code=400, detail="Голосование завершено")
 
     async with collection_data_lock:
-        collection_data = load_collection_data()
-        contest_entry = collection_data.get(str(contest_id))
-        if not contest_entry:
+        # Проверки - по индексу в памяти, без поиска по списку коллекций
+        vote_index = get_collection_vote_index(contest_id)
+        if vote_index is None:
             raise HTTPException(status_code=404, detail="Коллекции для голосования не найдены")
 
-        collections = contest_entry.get("collections", [])
-        collection = next((c for c in collections if c.get("collection_number") == collection_number), None)
-        if not collection:
+        if not vote_index.has_work(collection_number):
             raise HTTPException(status_code=404, detail="Коллекция не найдена")
 
-        if collection.get("participant_user_id") == user_id:
+        if vote_index.work_owner(collection_number) == user_id:
             raise HTTPException(status_code=400, detail="Вы не можете оценивать собственную коллекцию")
 
-        votes = collection.setdefault("votes", {})
         # Проверяем, не оценил ли пользователь уже эту коллекцию
-        if str(user_id) in votes:
+        if vote_index.is_rated("votes", user_id, collection_number):
             raise HTTPException(status_code=400, detail="Вы уже оценили эту коллекцию. Повторная оценка не разрешена.")
-        
-        votes[str(user_id)] = score
-
-        remaining = sum(
-            1
-            for c in collections
-            if c.get("participant_user_id") != user_id and str(user_id) not in (c.get("votes") or {})
-        )
 
-        save_collection_data(collection_data)
+        # Голос дописывается в журнал (сжимается в документ фоновой задачей),
+        # индекс обновляется инкрементально
+        collection_vote_log.append(contest_id, collection_number, "votes", user_id, score)
+        vote_index.add_vote("votes", user_id, collection_number, score)
+        contest_event_bus.mark_changed(contest_id, "collection")
+        remaining = vote_index.remaining("votes", user_id)
 
     return {
         "success": True,
@@ -4096,11 +3945,73 @@ async def submit_collection_vote(contest_id: int, request: Request):
         "remaining": remaining
     }
 
+@app.get("/api/contests/{contest_id}/live")
+async def stream_contest_leaderboard(
+    request: Request,
+    contest_id: int,
+    current_user_id: int = Query(...),
+    caller: Optional[WebAppUser] = Depends(current_user()),
+):
+    """
+    Live-таблица лидеров конкурса рисунков/коллекций (Server-Sent Events)
+    
+    Доступно создателю конкурса, админам и членам жюри. Первое событие - текущий
+    снимок, далее снимки приходят при новых работах и голосах (не чаще раза в секунду).
+    """
+    async with read_session() as session:
+        giveaway_result = await session.execute(select(Giveaway).where(Giveaway.id == contest_id))
+        giveaway = giveaway_result.scalars().first()
+        
+        if not giveaway:
+            raise HTTPException(status_code=404, detail="Конкурс не найден")
+        
+        contest_type = getattr(giveaway, 'contest_type', 'random_comment')
+        if contest_type not in ('drawing', 'collection'):
+            raise HTTPException(status_code=400, detail="Live-таблица доступна только для конкурсов рисунков и коллекций")
+        
+        # Проверяем права: создатель конкурса, админ или член жюри
+        is_creator = giveaway.created_by == current_user_id
+        jury = getattr(giveaway, 'jury', None)
+        is_jury_member = bool(jury and isinstance(jury, dict) and jury.get('enabled', False) and any(
+            str(member.get('user_id')) == str(current_user_id) for member in jury.get('members', [])
+        ))
+        if not (is_creator or is_jury_member or caller.is_admin):
+            raise HTTPException(status_code=403, detail="Недостаточно прав для просмотра таблицы лидеров")
+
+    snapshot = await build_leaderboard_snapshot(contest_id, contest_type)
+    queue = contest_event_bus.subscribe(contest_id, contest_type)
+
+    async def event_stream():
+        try:
+            if snapshot is not None:
+                yield f"event: leaderboard\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=CONTEST_EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event.get('type', 'message')}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            contest_event_bus.unsubscribe(contest_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # nginx не должен буферизовать поток событий
+            "X-Accel-Buffering": "no"
+        }
+    )
+
 @app.get("/api/contests/{contest_id}/participants-count")
 async def get_participants_count(contest_id: int):
     """Получить количество участников конкурса"""
     try:
-        async with async_session() as session:
+        async with read_session() as session:
             from models import Participant
             result = await session.execute(
                 select(func.count(Participant.id)).where(Participant.giveaway_id == contest_id)
@@ -4111,8 +4022,37 @@ async def get_participants_count(contest_id: int):
         logger.error(f"Ошибка при получении количества участников: {e}", exc_info=True)
         return {"count": 0}
 
+async def _load_participant_usernames(session, contest_id: int, user_ids) -> dict:
+    """
+    Возвращает {user_id: username} для участников конкурса двумя запросами
+
+    Приоритет у username из таблицы User, если его нет - берётся из Participant.
+    """
+    user_ids = {int(user_id) for user_id in user_ids}
+    if not user_ids:
+        return {}
+    users_result = await session.execute(
+        select(User.telegram_id, User.username).where(User.telegram_id.in_(user_ids))
+    )
+    usernames = {telegram_id: username for telegram_id, username in users_result.all() if username}
+    missing = user_ids - usernames.keys()
+    if missing:
+        participants_result = await session.execute(
+            select(Participant.user_id, Participant.username).where(
+                Participant.giveaway_id == contest_id,
+                Participant.user_id.in_(missing)
+            )
+        )
+        for user_id, username in participants_result.all():
+            usernames.setdefault(user_id, username)
+    return usernames
+
 @app.post("/api/contests/{contest_id}/calculate-results")
-async def calculate_drawing_contest_results(contest_id: int, current_user_id: int = Query(...)):
+async def calculate_drawing_contest_results(
+    contest_id: int,
+    current_user_id: int = Query(...),
+    caller: Optional[WebAppUser] = Depends(current_user()),
+):
     """Подсчитать итоги конкурса рисунков (среднее арифметическое оценок)"""
     try:
         async with async_session() as session:
@@ -4126,17 +4066,9 @@ async def calculate_drawing_contest_results(contest_id: int, current_user_id: in
             if contest_type != 'drawing':
                 raise HTTPException(status_code=400, detail="Этот конкурс не является конкурсом рисунков")
             
-            # Проверяем права доступа - только создатель может подсчитывать итоги
-            if giveaway.created_by != current_user_id:
-                # Проверяем, является ли пользователь админом или создателем
-                user_result = await session.execute(
-                    select(User).where(User.telegram_id == current_user_id)
-                )
-                user = user_result.scalars().first()
-                if not user or (user.role != "creator" and user.role != "admin"):
-                    raise HTTPException(status_code=403, detail="Только создатель конкурса может подсчитывать итоги")
-                if user.role == "admin" and giveaway.created_by != current_user_id:
-                    raise HTTPException(status_code=403, detail="Только создатель конкурса может подсчитывать итоги")
+            # Проверяем права доступа - только создатель конкурса (или создатель бота)
+            if giveaway.created_by != current_user_id and not caller.is_creator:
+                raise HTTPException(status_code=403, detail="Только создатель конкурса может подсчитывать итоги")
             
             # Проверяем, что время голосования истекло
             # Используем московское время для сравнения
@@ -4193,6 +4125,7 @@ async def calculate_drawing_contest_results(contest_id: int, current_user_id: in
                 works = contest_entry.get("works", [])
                 if not works:
                     raise HTTPException(status_code=400, detail="Нет работ для подсчета")
+                vote_index = get_drawing_vote_index(contest_id)
                 
                 # Проверяем, включено ли жюри
                 jury = getattr(giveaway, 'jury', None)
@@ -4201,7 +4134,11 @@ async def calculate_drawing_contest_results(contest_id: int, current_user_id: in
                 # Подсчитываем среднее арифметическое для каждой работы
                 jury_results = []
                 audience_results = []
-                from models import Participant
+                # username всех участников загружаются до цикла, а не запросом на каждую работу
+                usernames = await _load_participant_usernames(
+                    session, contest_id,
+                    [w.get("participant_user_id") for w in works if w.get("work_number") and w.get("participant_user_id")]
+                )
                 
                 for work in works:
                     work_number = work.get("work_number")
@@ -4210,25 +4147,7 @@ async def calculate_drawing_contest_results(contest_id: int, current_user_id: in
                     if not work_number or not participant_user_id:
                         continue
                     
-                    # Получаем username участника из таблицы User (приоритет) или Participant
-                    username = None
-                    user_result = await session.execute(
-                        select(User).where(User.telegram_id == participant_user_id)
-                    )
-                    user = user_result.scalars().first()
-                    if user and user.username:
-                        username = user.username
-                    else:
-                        # Если username нет в User, берем из Participant
-                        participant_result = await session.execute(
-                            select(Participant).where(
-                                Participant.giveaway_id == contest_id,
-                                Participant.user_id == participant_user_id
-                            )
-                        )
-                        participant = participant_result.scalars().first()
-                        if participant:
-                            username = participant.username
+                    username = usernames.get(int(participant_user_id))
                     
                     # Базовые данные работы
                     work_data = {
@@ -4254,74 +4173,67 @@ async def calculate_drawing_contest_results(contest_id: int, current_user_id: in
                             except:
                                 audience_voting_enabled = False
                     
+                    # Суммы и количества оценок поддерживаются индексом при каждом голосе,
+                    # поэтому здесь голоса не перебираются
+                    jury_total = vote_index.aggregate("jury_votes", work_number)
+                    audience_total = vote_index.aggregate("audience_votes", work_number)
+                    old_total = vote_index.aggregate("votes", work_number)
+                    
                     # Миграция старых голосов: если есть старые votes, но нет jury_votes/audience_votes,
                     # пытаемся определить, кто голосовал (для существующих конкурсов)
                     old_votes = work.get("votes", {}) or {}
-                    jury_votes = work.get("jury_votes", {}) or {}
-                    audience_votes = work.get("audience_votes", {}) or {}
                     
                     # Если есть старые голоса и новые структуры пусты, мигрируем
-                    if old_votes and not jury_votes and not audience_votes:
+                    if old_votes and not work.get("jury_votes") and not work.get("audience_votes"):
                         # Для существующих конкурсов: если жюри включено, считаем что старые голоса - это голоса жюри
                         # Иначе - голоса участников
                         if jury_enabled:
                             # Мигрируем старые голоса в jury_votes
                             work["jury_votes"] = old_votes.copy()
-                            jury_votes = old_votes
+                            jury_total, old_total = old_total, (0, 0)
                             # Очищаем старые голоса
-                            if "votes" in work:
-                                del work["votes"]
+                            del work["votes"]
                         elif audience_voting_enabled:
                             # Мигрируем старые голоса в audience_votes
                             work["audience_votes"] = old_votes.copy()
-                            audience_votes = old_votes
+                            audience_total, old_total = old_total, (0, 0)
                             # Очищаем старые голоса
-                            if "votes" in work:
-                                del work["votes"]
+                            del work["votes"]
                         else:
                             # Если ни жюри, ни зрительские симпатии не включены, оставляем старые голоса
                             pass
                     
                     # Подсчитываем голоса жюри/создателя
                     if jury_enabled:
-                        jury_scores = [int(score) for score in jury_votes.values() if score]
-                        if jury_scores:
-                            jury_average = sum(jury_scores) / len(jury_scores)
-                        else:
-                            jury_average = 0.0
-                        
                         jury_result = work_data.copy()
                         jury_result.update({
-                            "average_score": round(jury_average, 2),
-                            "votes_count": len(jury_scores)
+                            "average_score": average_score(*jury_total),
+                            "votes_count": jury_total[1]
                         })
                         jury_results.append(jury_result)
                     
                     # Подсчитываем голоса участников (зрителей)
                     # ВАЖНО: Всегда добавляем работу в audience_results, если есть голоса участников
                     # (в audience_votes или в старой структуре votes)
-                    audience_scores = []
+                    audience_scores = (0, 0)
                     
                     # Проверяем голоса в audience_votes (если зрительские симпатии включены)
                     if audience_voting_enabled:
-                        audience_scores = [int(score) for score in audience_votes.values() if score]
+                        audience_scores = audience_total
                     
                     # Также проверяем старую структуру votes (для обратной совместимости)
                     # Это нужно, если зрительские симпатии не включены, но участники голосовали
-                    if not audience_scores:
-                        votes = work.get("votes", {}) or {}
-                        audience_scores = [int(score) for score in votes.values() if score]
+                    if not audience_scores[1]:
+                        audience_scores = old_total
                     
                     # Если есть голоса участников, добавляем работу в audience_results
-                    if audience_scores:
-                        audience_average = sum(audience_scores) / len(audience_scores)
+                    if audience_scores[1]:
                         audience_result = work_data.copy()
                         audience_result.update({
-                            "average_score": round(audience_average, 2),
-                            "votes_count": len(audience_scores)
+                            "average_score": average_score(*audience_scores),
+                            "votes_count": audience_scores[1]
                         })
                         audience_results.append(audience_result)
-                        print(f"DEBUG calculate_results: Работа {work_number} добавлена в audience_results: average={audience_average}, votes_count={len(audience_scores)}, audience_votes={audience_votes}, votes={work.get('votes', {})}")
                     elif not jury_enabled and not audience_voting_enabled:
                         # Для обратной совместимости: если жюри не включено и зрительские симпатии не включены,
                         # и нет голосов, все равно добавляем работу (для отображения всех работ)
@@ -4331,15 +4243,9 @@ async def calculate_drawing_contest_results(contest_id: int, current_user_id: in
                         })
                         audience_results.append(work_data)
                 
-                # Сортируем результаты по среднему баллу (по убыванию)
-                jury_results.sort(key=lambda x: x["average_score"], reverse=True)
-                audience_results.sort(key=lambda x: x["average_score"], reverse=True)
-                
-                # Добавляем место (place) для каждой работы
-                for idx, result in enumerate(jury_results):
-                    result["place"] = idx + 1
-                for idx, result in enumerate(audience_results):
-                    result["place"] = idx + 1
+                # Сортируем результаты по среднему баллу и проставляем места
+                rank_results(jury_results, "work_number")
+                rank_results(audience_results, "work_number")
                 
                 # Сохраняем результаты в drawing_data
                 now_msk = datetime.now()
@@ -4375,7 +4281,7 @@ async def calculate_drawing_contest_results(contest_id: int, current_user_id: in
 async def get_drawing_contest_results(contest_id: int):
     """Получить итоги конкурса рисунков"""
     try:
-        async with async_session() as session:
+        async with read_session() as session:
             giveaway_result = await session.execute(select(Giveaway).where(Giveaway.id == contest_id))
             giveaway = giveaway_result.scalars().first()
             
@@ -4496,7 +4402,11 @@ async def get_drawing_contest_results(contest_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/contests/{contest_id}/calculate-collection-results")
-async def calculate_collection_contest_results(contest_id: int, current_user_id: int = Query(...)):
+async def calculate_collection_contest_results(
+    contest_id: int,
+    current_user_id: int = Query(...),
+    caller: Optional[WebAppUser] = Depends(current_user()),
+):
     """Подсчитать итоги конкурса коллекций (среднее арифметическое оценок)"""
     try:
         async with async_session() as session:
@@ -4534,62 +4444,39 @@ async def calculate_collection_contest_results(contest_id: int, current_user_id:
                 collections = contest_entry.get("collections", [])
                 if not collections:
                     raise HTTPException(status_code=400, detail="Нет коллекций для подсчета")
+                vote_index = get_collection_vote_index(contest_id)
                 
                 # Подсчитываем среднее арифметическое для каждой коллекции
                 results = []
-                from models import Participant
+                usernames = await _load_participant_usernames(
+                    session, contest_id,
+                    [c.get("participant_user_id") for c in collections if c.get("collection_number") and c.get("participant_user_id")]
+                )
                 
                 for collection in collections:
                     collection_number = collection.get("collection_number")
                     participant_user_id = collection.get("participant_user_id")
-                    votes = collection.get("votes", {}) or {}
                     nft_links = collection.get("nft_links", [])
                     
                     if not collection_number or not participant_user_id:
                         continue
                     
-                    # Получаем username участника из таблицы User (приоритет) или Participant
-                    username = None
-                    user_result = await session.execute(
-                        select(User).where(User.telegram_id == participant_user_id)
-                    )
-                    user = user_result.scalars().first()
-                    if user and user.username:
-                        username = user.username
-                    else:
-                        # Если username нет в User, берем из Participant
-                        participant_result = await session.execute(
-                            select(Participant).where(
-                                Participant.giveaway_id == contest_id,
-                                Participant.user_id == participant_user_id
-                            )
-                        )
-                        participant = participant_result.scalars().first()
-                        if participant:
-                            username = participant.username
+                    username = usernames.get(int(participant_user_id))
                     
-                    # Подсчитываем среднее арифметическое
-                    scores = [int(score) for score in votes.values() if score]
-                    if scores:
-                        average_score = sum(scores) / len(scores)
-                    else:
-                        average_score = 0.0
+                    # Среднее арифметическое по текущим суммам индекса
+                    score_sum, votes_count = vote_index.aggregate("votes", collection_number)
                     
                     results.append({
                         "collection_number": collection_number,
                         "participant_user_id": participant_user_id,
                         "username": username,
-                        "average_score": round(average_score, 2),
-                        "votes_count": len(scores),
+                        "average_score": average_score(score_sum, votes_count),
+                        "votes_count": votes_count,
                         "nft_links": nft_links
                     })
                 
-                # Сортируем по среднему баллу (по убыванию)
-                results.sort(key=lambda x: x["average_score"], reverse=True)
-                
-                # Добавляем место (place) для каждой коллекции
-                for idx, result in enumerate(results):
-                    result["place"] = idx + 1
+                # Сортируем по среднему баллу и проставляем места
+                rank_results(results, "collection_number")
                 
                 # Сохраняем результаты в collection_data
                 now_msk = datetime.now()
@@ -4614,7 +4501,7 @@ async def calculate_collection_contest_results(contest_id: int, current_user_id:
 async def get_collection_contest_results(contest_id: int):
     """Получить итоги конкурса коллекций"""
     try:
-        async with async_session() as session:
+        async with read_session() as session:
             giveaway_result = await session.execute(select(Giveaway).where(Giveaway.id == contest_id))
             giveaway = giveaway_result.scalars().first()
             
@@ -4678,7 +4565,11 @@ async def get_collection_contest_results(contest_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/contests/{contest_id}/confirm-winners")
-async def confirm_contest_winners(contest_id: int, current_user_id: int = Query(default=None)):
+async def confirm_contest_winners(
+    contest_id: int,
+    current_user_id: int = Query(default=None),
+    caller: Optional[WebAppUser] = Depends(current_user()),
+):
     """Подтверждает победителей конкурса (финализирует выбор).
 
     Подтверждать победителей может только владелец конкурса (created_by).
@@ -4693,9 +4584,9 @@ async def confirm_contest_winners(contest_id: int, current_user_id: int = Query(
             if not giveaway:
                 raise HTTPException(status_code=404, detail="Конкурс не найден")
 
-            if current_user_id is not None and giveaway.created_by is not None:
+            if caller is not None and giveaway.created_by is not None:
                 try:
-                    if int(giveaway.created_by) != int(current_user_id):
+                    if int(giveaway.created_by) != caller.id:
                         raise HTTPException(
                             status_code=403,
                             detail="Подтверждать победителей может только создатель конкурса",
@@ -4707,11 +4598,21 @@ async def confirm_contest_winners(contest_id: int, current_user_id: int = Query(
                     )
 
         result = await confirm_winners(contest_id)
+        bump_contests_version()
 
         # Отправляем поздравительные сообщения победителям
         try:
-            bot = Bot(token=BOT_TOKEN)
-            await send_congratulations_messages(contest_id, bot)
+            # Общий экземпляр бота: отдельный Bot на каждый запрос оставлял незакрытую сессию aiohttp
+            bot = auth_session.get_bot()
+            # Для конкурса рисунков фото победителей отправляются по сохранённым file_id
+            async with drawing_data_lock:
+                contest_entry = load_drawing_data().get(str(contest_id)) or {}
+            photo_file_ids = {
+                w.get("participant_user_id"): w.get("photo_file_id")
+                for w in contest_entry.get("works", [])
+                if w.get("photo_file_id")
+            }
+            await send_congratulations_messages(contest_id, bot, photo_file_ids=photo_file_ids)
         except Exception as e:
             logger.error(f"Ошибка при отправке поздравительных сообщений: {e}")
             # Не прерываем выполнение, если не удалось отправить поздравления
@@ -4725,7 +4626,11 @@ async def confirm_contest_winners(contest_id: int, current_user_id: int = Query(
 
 
 @app.delete("/api/contests/{contest_id}")
-async def delete_contest(contest_id: int, current_user_id: int = Query(None)):
+async def delete_contest(
+    contest_id: int,
+    current_user_id: int = Query(None),
+    caller: Optional[WebAppUser] = Depends(current_user()),
+):
     """Удалить конкурс. Админ может удалять только свои конкурсы."""
     async with async_session() as session:
         try:
@@ -4735,18 +4640,14 @@ async def delete_contest(contest_id: int, current_user_id: int = Query(None)):
                 raise HTTPException(status_code=404, detail="Конкурс не найден")
             
             # Проверяем права доступа
-            if current_user_id:
-                user_result = await session.execute(
-                    select(User).where(User.telegram_id == current_user_id)
-                )
-                user = user_result.scalars().first()
-                
-                if user:
-                    if user.role == "admin":
+            if caller is not None:
+                current_user_id = caller.id
+                if caller.exists:
+                    if caller.role == "admin":
                         # Админ может удалять только свои конкурсы
                         if contest.created_by != current_user_id:
                             raise HTTPException(status_code=403, detail="Вы можете удалять только свои конкурсы")
-                    elif user.role == "creator":
+                    elif caller.role == "creator":
                         # Создатель может удалять любые конкурсы
                         pass
                     else:
@@ -4757,48 +4658,23 @@ async def delete_contest(contest_id: int, current_user_id: int = Query(None)):
             if hasattr(contest, 'is_confirmed') and contest.is_confirmed:
                 raise HTTPException(status_code=403, detail="Нельзя удалить подтвержденный конкурс")
             
-            # Удаляем всех победителей конкурса
-            from models import Winner, Participant
-            winners_result = await session.execute(
-                select(Winner).where(Winner.giveaway_id == contest_id)
-            )
-            winners = winners_result.scalars().all()
-            for winner in winners:
-                await session.delete(winner)
-            
-            # Удаляем всех участников конкурса
-            participants_result = await session.execute(
-                select(Participant).where(Participant.giveaway_id == contest_id)
-            )
-            participants = participants_result.scalars().all()
-            for participant in participants:
-                await session.delete(participant)
-            
-            # Проверяем тип конкурса - если это конкурс рисунков, удаляем данные из файла
-            contest_type = getattr(contest, 'contest_type', 'random_comment')
-            if contest_type == 'drawing':
-                async with drawing_data_lock:
-                    drawing_data = load_drawing_data()
-                    contest_key = str(contest_id)
-                    if contest_key in drawing_data:
-                        # Удаляем данные о конкурсе из файла
-                        del drawing_data[contest_key]
-                        save_drawing_data(drawing_data)
-                        logger.info(f"🗑️ Удалены данные конкурса рисунков {contest_id} из файла drawing_contests.json")
-                    
-                    # Также удаляем папку с загруженными фотографиями
-                    try:
-                        import shutil
-                        work_dir = os.path.join(DRAWING_UPLOADS_DIR, f"contest_{contest_id}")
-                        if os.path.exists(work_dir):
-                            shutil.rmtree(work_dir)
-                            logger.info(f"🗑️ Удалена папка с фотографиями конкурса {contest_id}: {work_dir}")
-                    except Exception as e:
-                        logger.warning(f"⚠️ Не удалось удалить папку с фотографиями конкурса {contest_id}: {e}")
-            
-            # Удаляем сам конкурс
-            await session.delete(contest)
+            # Победители и участники удаляются одним запросом на таблицу
+            # (без загрузки строк в сессию); при включённых внешних ключах
+            # это же сделал бы ON DELETE CASCADE, явные DELETE работают и для старых таблиц без FK
+            from sqlalchemy import delete
+            await session.execute(delete(Winner).where(Winner.giveaway_id == contest_id))
+            await session.execute(delete(Participant).where(Participant.giveaway_id == contest_id))
+            await session.execute(delete(Giveaway).where(Giveaway.id == contest_id))
             await session.commit()
+            profile_stats_cache.clear()
+            bump_contests_version()
+
+            # Файлы работ, данные из drawing_contests.json и JSONL комментариев
+            # чистятся в фоне - ответ не ждёт файловых операций
+            contest_type = getattr(contest, 'contest_type', 'random_comment')
+            task = asyncio.create_task(cleanup_deleted_contest_files(contest_id, contest_type))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
             return {"success": True, "message": "Конкурс удален"}
         except HTTPException:
             raise
@@ -4806,6 +4682,41 @@ async def delete_contest(contest_id: int, current_user_id: int = Query(None)):
             await session.rollback()
             raise HTTPException(status_code=500, detail=str(e))
 
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора до завершения
+_background_tasks = set()
+
+
+async def cleanup_deleted_contest_files(contest_id: int, contest_type: str) -> None:
+    """Удаляет файлы удалённого конкурса: работы рисунков, папку загрузок, JSONL комментариев"""
+    try:
+        if contest_type == 'drawing':
+            async with drawing_data_lock:
+                drawing_data = load_drawing_data()
+                contest_key = str(contest_id)
+                if contest_key in drawing_data:
+                    released_paths = list(referenced_paths({contest_key: drawing_data[contest_key]}))
+                    del drawing_data[contest_key]
+                    save_drawing_data(drawing_data)
+                    refs = referenced_paths(drawing_data)
+                    await asyncio.to_thread(drawing_blob_store.remove_if_unreferenced, released_paths, refs)
+                    logger.info(f"🗑️ Удалены данные конкурса рисунков {contest_id} из файла drawing_contests.json")
+
+            # Папка с загруженными фотографиями (старый формат хранения)
+            import shutil
+            work_dir = os.path.join(DRAWING_UPLOADS_DIR, f"contest_{contest_id}")
+            if os.path.exists(work_dir):
+                await asyncio.to_thread(shutil.rmtree, work_dir, True)
+                logger.info(f"🗑️ Удалена папка с фотографиями конкурса {contest_id}: {work_dir}")
+
+        from telethon_comments import get_comments_file_path
+        comments_file = get_comments_file_path(contest_id)
+        if os.path.exists(comments_file):
+            await asyncio.to_thread(remove_quietly, comments_file)
+            logger.info(f"🗑️ Удалён файл комментариев конкурса {contest_id}: {comments_file}")
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось очистить файлы удалённого конкурса {contest_id}: {e}")
+
+
 @app.delete("/api/admins/{admin_id}")
 async def delete_admin(admin_id: int):
     """Удалить администратора (изменить роль на user)"""
@@ -4817,6 +4728,9 @@ async def delete_admin(admin_id: int):
                 raise HTTPException(status_code=404, detail="Администратор не найден")
             user.role = "user"
             await session.commit()
+            # Роль влияет на фильтрацию списка конкурсов
+            bump_contests_version()
+            auth_session.invalidate_profile(admin_id)
             return {"success": True, "message": "Администратор удален"}
         except HTTPException:
             raise
@@ -4852,7 +4766,11 @@ async def update_admin(admin_id: int, request: Request):
             raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/api/contests/{contest_id}")
-async def update_contest(contest_id: int, request: Request):
+async def update_contest(
+    contest_id: int,
+    request: Request,
+    caller: Optional[WebAppUser] = Depends(current_user(body=True)),
+):
     """Обновить данные конкурса"""
     try:
         data = await request.json()
@@ -4870,19 +4788,13 @@ async def update_contest(contest_id: int, request: Request):
                 raise HTTPException(status_code=404, detail="Конкурс не найден")
             
             # Проверяем права доступа
-            current_user_id = data.get("current_user_id")
-            if current_user_id:
-                user_result = await session.execute(
-                    select(User).where(User.telegram_id == current_user_id)
-                )
-                user = user_result.scalars().first()
-                
-                if user:
-                    if user.role == "admin":
+            if caller is not None:
+                if caller.exists:
+                    if caller.role == "admin":
                         # Админ может изменять только свои конкурсы
-                        if contest.created_by != current_user_id:
+                        if contest.created_by != caller.id:
                             raise HTTPException(status_code=403, detail="Вы можете изменять только свои конкурсы")
-                    elif user.role == "creator":
+                    elif caller.is_creator:
                         # Создатель может изменять любые конкурсы
                         pass
                     else:
@@ -5011,6 +4923,7 @@ async def update_contest(contest_id: int, request: Request):
             # Обновляем объект из БД, чтобы убедиться, что изменения сохранены
             await session.refresh(contest)
             logger.info(f"Конкурс {contest_id} успешно обновлен. prize_links после сохранения: {contest.prize_links}")
+            bump_contests_version()
             return {"success": True, "message": "Конкурс обновлен"}
         except HTTPException:
             raise
@@ -5322,7 +5235,7 @@ async def create_message(request: Request):
 async def list_messages(user_id: int = Query(None), status: str = Query(None)):
     """Получить список сообщений"""
     try:
-        async with async_session() as session:
+        async with read_session() as session:
             query = select(Message)
             
             # Если передан user_id, фильтруем сообщения для создателя (все pending)
@@ -5352,7 +5265,7 @@ async def list_messages(user_id: int = Query(None), status: str = Query(None)):
 async def get_unread_count():
     """Получить количество непрочитанных сообщений (pending)"""
     try:
-        async with async_session() as session:
+        async with read_session() as session:
             result = await session.execute(
                 select(Message).where(Message.status == "pending")
             )
@@ -5394,9 +5307,8 @@ async def respond_to_message(message_id: int, request: Request):
             message.status = "approved" if action == "approve" else "rejected"
             message.responded_at = datetime.now(timezone.utc)
             
-            # Отправляем сообщение пользователю через Telegram бота
+            # Отправляем сообщение пользователю через очередь сообщений бота
             try:
-                bot = Bot(token=BOT_TOKEN)
                 from_user_id = message.from_user_id
                 
                 if action == "approve":
@@ -5404,15 +5316,7 @@ async def respond_to_message(message_id: int, request: Request):
                 else:
                     response_text = "❌ Ваше сообщение было отклонено."
                 
-                await bot.send_message(
-                    chat_id=from_user_id,
-                    text=response_text
-                )
-                try:
-                    bot_session = await bot.get_session()
-                    await bot_session.close()
-                except Exception:
-                    pass
+                outbound_queue.enqueue(from_user_id, "send_message", text=response_text)
             except Exception as bot_error:
                 # Логируем ошибку, но не прерываем процесс
                 print(f"⚠️ Ошибка отправки сообщения в Telegram: {bot_error}")
@@ -5428,10 +5332,33 @@ async def respond_to_message(message_id: int, request: Request):
 
 DRAWING_DATA_FILE = os.path.join(ROOT_DIR, "drawing_contests.json")
 DRAWING_UPLOADS_DIR = os.path.join(ROOT_DIR, "drawing_uploads")
-drawing_data_lock = asyncio.Lock()
+# Временные файлы загрузок (в том же разделе диска, чтобы os.replace был атомарным)
+DRAWING_UPLOADS_TMP_DIR = os.path.join(DRAWING_UPLOADS_DIR, ".tmp")
+DRAWING_UPLOAD_MAX_SIZE = 10 * 1024 * 1024  # 10 МБ
+# Запас на поля формы и заголовки multipart сверх размера файла
+DRAWING_UPLOAD_FORM_OVERHEAD = 64 * 1024
+# Файлы работ и их уменьшенные копии хранятся по хэшу содержимого (см. blob_store.py)
+DRAWING_BLOBS_DIR = os.path.join(DRAWING_UPLOADS_DIR, "blobs")
+DRAWING_BLOBS_GC_INTERVAL = 24 * 3600  # секунды между сборками мусора
+drawing_blob_store = BlobStore(DRAWING_BLOBS_DIR, ROOT_DIR)
+# Блокировки документов общие для всех процессов (бот и воркеры uvicorn, см. shared_state.py)
+drawing_data_lock = FileLock(shared_path("drawing_contests.lock"))
+
+# Журнал голосов (см. drawing_votes.py) и индексы голосования по конкурсам
+DRAWING_VOTES_LOG_FILE = os.path.join(ROOT_DIR, "drawing_votes.jsonl")
+VOTES_COMPACT_INTERVAL = 5  # секунды между сжатиями журналов голосов в документы конкурсов
+drawing_vote_log = VoteLog.for_drawing(DRAWING_VOTES_LOG_FILE)
+drawing_vote_indexes = {}
+# Подпись drawing_contests.json, по которой построены индексы: если файл изменил
+# другой процесс, индексы строятся заново
+_drawing_data_signature = None
 
 COLLECTION_DATA_FILE = os.path.join(ROOT_DIR, "collection_contests.json")
-collection_data_lock = asyncio.Lock()
+collection_data_lock = FileLock(shared_path("collection_contests.lock"))
+COLLECTION_VOTES_LOG_FILE = os.path.join(ROOT_DIR, "collection_votes.jsonl")
+collection_vote_log = VoteLog.for_collection(COLLECTION_VOTES_LOG_FILE)
+collection_vote_indexes = {}
+_collection_data_signature = None
 
 
 def _ensure_dir(path: str):
@@ -5451,7 +5378,8 @@ def load_drawing_data() -> dict:
                 # Файл пустой, возвращаем пустой словарь
                 logger.warning(f"Файл {DRAWING_DATA_FILE} пустой, возвращаем пустой словарь")
                 return {}
-            return json.loads(content)
+            # Добавляем голоса, которые ещё не сжаты из журнала в файл
+            return drawing_vote_log.apply(json.loads(content))
     except json.JSONDecodeError as e:
         logger.error(f"Ошибка парсинга JSON в файле данных конкурсов рисунков: {e}")
         # Если файл поврежден, создаем резервную копию и возвращаем пустой словарь
@@ -5469,13 +5397,14 @@ def load_drawing_data() -> dict:
         return {}
 
 
-def save_drawing_data(data: dict) -> None:
+def _write_drawing_data_file(data: dict) -> bool:
     _ensure_dir(os.path.dirname(DRAWING_DATA_FILE) or ROOT_DIR)
     temp_path = DRAWING_DATA_FILE + ".tmp"
     try:
         with open(temp_path, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
         os.replace(temp_path, DRAWING_DATA_FILE)
+        return True
     except Exception as e:
         logger.error(f"Не удалось сохранить файл данных конкурсов рисунков: {e}")
         if os.path.exists(temp_path):
@@ -5483,6 +5412,195 @@ def save_drawing_data(data: dict) -> None:
                 os.remove(temp_path)
             except Exception:
                 pass
+        return False
+
+
+def save_drawing_data(data: dict) -> None:
+    """
+    Сохраняет документ конкурсов рисунков (вызывается под drawing_data_lock)
+
+    Документ загружен через load_drawing_data и уже содержит все голоса журнала,
+    поэтому после записи журнал очищается: иначе после перенумерации работ
+    (отмена работы) старые записи журнала применились бы к чужим работам
+    по номеру work_number.
+    """
+    global _drawing_data_signature
+    if _write_drawing_data_file(data):
+        drawing_vote_log.clear()
+    # Документ мог измениться произвольно (работы добавлены/удалены) - индексы строим заново
+    drawing_vote_indexes.clear()
+    _drawing_data_signature = file_signature(DRAWING_DATA_FILE)
+
+
+def sync_drawing_vote_indexes() -> bool:
+    """
+    Подхватывает изменения, сделанные другими процессами
+
+    Если drawing_contests.json переписан - индексы сбрасываются; голоса,
+    дописанные в журнал другими процессами, применяются к построенным индексам.
+
+    Returns:
+        bool: True, если документ изменился и индексы сброшены
+    """
+    global _drawing_data_signature
+    signature = file_signature(DRAWING_DATA_FILE)
+    document_changed = signature != _drawing_data_signature
+    if document_changed:
+        drawing_vote_indexes.clear()
+        _drawing_data_signature = signature
+    _apply_vote_log_entries(drawing_vote_log, drawing_vote_indexes, "drawing")
+    return document_changed
+
+
+def _apply_vote_log_entries(vote_log: VoteLog, vote_indexes: dict, contest_type: str) -> None:
+    """Применяет к построенным индексам голоса, дописанные в журнал (в т.ч. другими процессами)"""
+    for entry in vote_log.refresh():
+        contest_id = entry.get("contest_id")
+        vote_index = vote_indexes.get(contest_id)
+        number = entry.get(vote_log.number_key)
+        category = entry.get("category")
+        if vote_index is None or not vote_index.has_work(number) or category not in vote_index.categories:
+            continue
+        # Повторное применение своего же голоса ничего не меняет
+        vote_index.add_vote(category, entry.get("user_id"), number, entry.get("score"))
+        contest_event_bus.mark_changed(contest_id, contest_type)
+
+
+def _drawing_image_urls(contest_id: int, work_number: int, payload: Optional[dict]) -> dict:
+    """
+    URL изображения работы для очереди голосования
+    
+    image_url - средний размер (или оригинал), thumb_url - миниатюра,
+    image_srcset - все размеры для <img srcset>. Параметр v - хэш содержимого.
+    """
+    base_url = f"/api/drawing-contests/{contest_id}/works/{work_number}/image"
+    derivatives = (payload or {}).get("derivatives") or {}
+    original = derivatives.get("original") or {}
+    original_url = f"{base_url}?v={original['etag']}" if original.get("etag") else base_url
+
+    urls = {}
+    srcset = []
+    for name in ("thumb", "mid"):
+        info = derivatives.get(name)
+        if info:
+            urls[name] = f"{base_url}?size={name}&v={info['etag']}"
+            srcset.append(f"{urls[name]} {info['width']}w")
+    if original.get("width") and srcset:
+        srcset.append(f"{original_url} {original['width']}w")
+    return {
+        "image_url": urls.get("mid", original_url),
+        "thumb_url": urls.get("thumb", urls.get("mid", original_url)),
+        "image_srcset": ", ".join(srcset) or None
+    }
+
+
+def get_drawing_vote_index(contest_id: int) -> Optional[VoteIndex]:
+    """Возвращает индекс голосования конкурса рисунков (строится из документа при первом обращении)"""
+    sync_drawing_vote_indexes()
+    vote_index = drawing_vote_indexes.get(contest_id)
+    if vote_index is None:
+        contest_entry = load_drawing_data().get(str(contest_id))
+        if not contest_entry:
+            return None
+        vote_index = VoteIndex.for_drawing(contest_entry.get("works", []))
+        drawing_vote_indexes[contest_id] = vote_index
+    return vote_index
+
+
+async def compact_drawing_votes() -> None:
+    """Переносит голоса из журнала в drawing_contests.json и очищает журнал"""
+    global _drawing_data_signature
+    if not drawing_vote_log.pending():
+        return
+    async with drawing_data_lock:
+        # Индексы должны содержать все голоса журнала до его очистки
+        sync_drawing_vote_indexes()
+        data = load_drawing_data()  # уже содержит голоса из журнала
+        if not data:
+            # Документ не прочитан - журнал не трогаем, чтобы не потерять голоса
+            return
+        if _write_drawing_data_file(data):
+            drawing_vote_log.clear()
+            # Голоса в индексах уже учтены - перестраивать их не нужно
+            _drawing_data_signature = file_signature(DRAWING_DATA_FILE)
+
+
+async def votes_compaction_loop() -> None:
+    while True:
+        await asyncio.sleep(VOTES_COMPACT_INTERVAL)
+        for compact in (compact_drawing_votes, compact_collection_votes):
+            try:
+                await compact()
+            except Exception as e:
+                logger.error(f"Ошибка при сжатии журнала голосов: {e}", exc_info=True)
+
+
+async def migrate_drawing_uploads_to_blobs() -> int:
+    """Переносит файлы работ из старых папок contest_<id>/ в хранилище по хэшу"""
+    moved = 0
+    async with drawing_data_lock:
+        drawing_data = load_drawing_data()
+        for contest_entry in drawing_data.values():
+            if not isinstance(contest_entry, dict):
+                continue
+            for work in contest_entry.get("works", []):
+                entries = [work] + [info for info in (work.get("derivatives") or {}).values() if info.get("path")]
+                for entry in entries:
+                    key = "local_path" if entry is work else "path"
+                    rel_path = entry.get(key)
+                    if not rel_path or drawing_blob_store.contains(rel_path):
+                        continue
+                    full_path = os.path.join(ROOT_DIR, rel_path)
+                    if not os.path.exists(full_path):
+                        continue
+                    try:
+                        entry[key] = drawing_blob_store.put_file(full_path, os.path.splitext(rel_path)[1])
+                        moved += 1
+                    except Exception as e:
+                        logger.warning(f"⚠️ Не удалось перенести файл {rel_path} в хранилище: {e}")
+        if moved:
+            save_drawing_data(drawing_data)
+    return moved
+
+
+def _cleanup_upload_tmp_dir(max_age: int) -> None:
+    """Удаляет временные файлы незавершённых загрузок"""
+    if not os.path.isdir(DRAWING_UPLOADS_TMP_DIR):
+        return
+    now = time.time()
+    for file_name in os.listdir(DRAWING_UPLOADS_TMP_DIR):
+        path = os.path.join(DRAWING_UPLOADS_TMP_DIR, file_name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+async def collect_drawing_blobs_garbage() -> dict:
+    """Удаляет из хранилища файлы, на которые не ссылается ни одна работа"""
+    async with drawing_data_lock:
+        refs = referenced_paths(load_drawing_data())
+    result = await asyncio.to_thread(drawing_blob_store.collect_garbage, refs)
+    await asyncio.to_thread(_cleanup_upload_tmp_dir, 3600)
+    return result
+
+
+async def drawing_blobs_maintenance_loop() -> None:
+    try:
+        moved = await migrate_drawing_uploads_to_blobs()
+        if moved:
+            logger.info(f"📦 Перенесено файлов работ в хранилище: {moved}")
+    except Exception as e:
+        logger.error(f"Ошибка при переносе файлов работ в хранилище: {e}", exc_info=True)
+    while True:
+        try:
+            result = await collect_drawing_blobs_garbage()
+            if result["removed"]:
+                logger.info(f"🗑️ Сборка мусора хранилища: удалено {result['removed']} файлов, {result['freed_bytes']} байт")
+        except Exception as e:
+            logger.error(f"Ошибка при сборке мусора хранилища работ: {e}", exc_info=True)
+        await asyncio.sleep(DRAWING_BLOBS_GC_INTERVAL)
 
 
 _ensure_dir(DRAWING_UPLOADS_DIR)
@@ -5497,7 +5615,8 @@ def load_collection_data() -> dict:
             if not content:
                 logger.warning(f"Файл {COLLECTION_DATA_FILE} пустой, возвращаем пустой словарь")
                 return {}
-            return json.loads(content)
+            # Добавляем голоса, которые ещё не сжаты из журнала в файл
+            return collection_vote_log.apply(json.loads(content))
     except json.JSONDecodeError as e:
         logger.error(f"Ошибка парсинга JSON в файле данных конкурсов коллекций: {e}")
         try:
@@ -5635,13 +5754,14 @@ async def get_nft_info_endpoint(nft_link: str = Query(...)):
 
 
 
-def save_collection_data(data: dict) -> None:
+def _write_collection_data_file(data: dict) -> bool:
     _ensure_dir(os.path.dirname(COLLECTION_DATA_FILE) or ROOT_DIR)
     temp_path = COLLECTION_DATA_FILE + ".tmp"
     try:
         with open(temp_path, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
         os.replace(temp_path, COLLECTION_DATA_FILE)
+        return True
     except Exception as e:
         logger.error(f"Не удалось сохранить файл данных конкурсов коллекций: {e}")
         if os.path.exists(temp_path):
@@ -5649,3 +5769,117 @@ def save_collection_data(data: dict) -> None:
                 os.remove(temp_path)
             except Exception:
                 pass
+        return False
+
+
+def save_collection_data(data: dict) -> None:
+    """Сохраняет документ конкурсов коллекций (под collection_data_lock, см. save_drawing_data)"""
+    global _collection_data_signature
+    if _write_collection_data_file(data):
+        collection_vote_log.clear()
+    # Коллекции могли быть добавлены/удалены - индексы строим заново
+    collection_vote_indexes.clear()
+    _collection_data_signature = file_signature(COLLECTION_DATA_FILE)
+
+
+def sync_collection_vote_indexes() -> bool:
+    """
+    Подхватывает изменения, сделанные другими процессами (см. sync_drawing_vote_indexes)
+
+    Returns:
+        bool: True, если документ изменился и индексы сброшены
+    """
+    global _collection_data_signature
+    signature = file_signature(COLLECTION_DATA_FILE)
+    document_changed = signature != _collection_data_signature
+    if document_changed:
+        collection_vote_indexes.clear()
+        _collection_data_signature = signature
+    _apply_vote_log_entries(collection_vote_log, collection_vote_indexes, "collection")
+    return document_changed
+
+
+def get_collection_vote_index(contest_id: int) -> Optional[VoteIndex]:
+    """Возвращает индекс голосования конкурса коллекций (строится из документа при первом обращении)"""
+    sync_collection_vote_indexes()
+    vote_index = collection_vote_indexes.get(contest_id)
+    if vote_index is None:
+        contest_entry = load_collection_data().get(str(contest_id))
+        if not contest_entry:
+            return None
+        vote_index = VoteIndex.for_collection(contest_entry.get("collections", []))
+        collection_vote_indexes[contest_id] = vote_index
+    return vote_index
+
+
+async def compact_collection_votes() -> None:
+    """Переносит голоса из журнала в collection_contests.json и очищает журнал"""
+    global _collection_data_signature
+    if not collection_vote_log.pending():
+        return
+    async with collection_data_lock:
+        sync_collection_vote_indexes()
+        data = load_collection_data()
+        if not data:
+            return
+        if _write_collection_data_file(data):
+            collection_vote_log.clear()
+            _collection_data_signature = file_signature(COLLECTION_DATA_FILE)
+
+
+CONTEST_EVENTS_INTERVAL = 1  # секунды между рассылками снимков таблицы лидеров
+CONTEST_EVENTS_KEEPALIVE = 15  # секунды между keep-alive комментариями SSE
+
+
+async def build_leaderboard_snapshot(contest_id: int, contest_type: str) -> Optional[dict]:
+    """Снимок таблицы лидеров конкурса по текущим суммам оценок индекса"""
+    if contest_type == "collection":
+        async with collection_data_lock:
+            vote_index = get_collection_vote_index(contest_id)
+    else:
+        async with drawing_data_lock:
+            vote_index = get_drawing_vote_index(contest_id)
+    if vote_index is None:
+        return None
+    return {
+        "type": "leaderboard",
+        "contest_id": contest_id,
+        "contest_type": contest_type,
+        "works_total": len(vote_index.queue),
+        "standings": {category: vote_index.standings(category) for category in vote_index.categories},
+        "updated_at": datetime.now().isoformat()
+    }
+
+
+def _sync_subscribed_contests() -> None:
+    """Отмечает конкурсы с подписчиками, данные которых изменили другие процессы"""
+    subscribed = contest_event_bus.subscribed_contests()
+    if not subscribed:
+        return
+    changed_types = set()
+    if sync_drawing_vote_indexes():
+        changed_types.add("drawing")
+    if sync_collection_vote_indexes():
+        changed_types.add("collection")
+    for contest_id, contest_type in subscribed.items():
+        if contest_type in changed_types:
+            contest_event_bus.mark_changed(contest_id, contest_type)
+
+
+async def contest_events_loop() -> None:
+    """Раз в интервал строит по одному снимку на изменённый конкурс и рассылает подписчикам"""
+    while True:
+        await asyncio.sleep(CONTEST_EVENTS_INTERVAL)
+        try:
+            _sync_subscribed_contests()
+        except Exception as e:
+            logger.error(f"Ошибка при проверке изменений конкурсов: {e}", exc_info=True)
+        for contest_id, contest_type in contest_event_bus.take_changed().items():
+            if not contest_event_bus.has_subscribers(contest_id):
+                continue
+            try:
+                snapshot = await build_leaderboard_snapshot(contest_id, contest_type)
+                if snapshot is not None:
+                    contest_event_bus.publish(contest_id, snapshot)
+            except Exception as e:
+                logger.error(f"Ошибка при рассылке таблицы лидеров конкурса {contest_id}: {e}", exc_info=True)
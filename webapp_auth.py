@@ -0,0 +1,192 @@
+"""
+Проверка пользователя Telegram WebApp по подписанному initData
+
+Клиент передаёт Telegram.WebApp.initData в заголовке X-Telegram-Init-Data.
+Подпись проверяется по алгоритму Telegram:
+    secret_key = HMAC_SHA256(key="WebAppData", msg=BOT_TOKEN)
+    hash = hex(HMAC_SHA256(key=secret_key, msg=data_check_string))
+где data_check_string - пары key=value (кроме hash), отсортированные по ключу
+и разделённые переводом строки.
+
+Проверенный пользователь (id, роль, флаги) кэшируется по SHA-256 от initData
+до истечения срока действия initData (auth_date + INIT_DATA_MAX_AGE): повторные
+запросы с тем же initData не проверяют подпись и не читают роль из БД.
+Кэш сбрасывается при изменении ролей (общая версия auth_session.auth_version).
+
+Зависимости FastAPI:
+- webapp_user - пользователь из initData или None, если заголовка нет
+  (401 при недействительной подписи)
+- current_user(param) - пользователь из initData, а для старых клиентов без initData
+  (пока WEBAPP_AUTH_REQUIRED=0) - из параметра запроса param (current_user_id, admin_id, ...);
+  current_user(param, body=True) ищет param также в JSON-теле запроса
+"""
+import hashlib
+import hmac
+import json
+import logging
+import time
+from typing import Optional
+from urllib.parse import parse_qsl
+
+from fastapi import HTTPException, Request
+
+from auth_session import auth_version
+from cache import TTLCache
+from config import BOT_TOKEN, CREATOR_ID, INIT_DATA_MAX_AGE, WEBAPP_AUTH_REQUIRED
+
+logger = logging.getLogger(__name__)
+
+INIT_DATA_HEADER = "X-Telegram-Init-Data"
+
+_secret_key = hmac.new(b"WebAppData", (BOT_TOKEN or "").encode(), hashlib.sha256).digest()
+
+# Проверенные initData: sha256(initData) -> WebAppUser
+_verified_cache = TTLCache(ttl=INIT_DATA_MAX_AGE, maxsize=50000, shared_version=auth_version)
+# Роли пользователей без initData: telegram_id -> WebAppUser
+_legacy_cache = TTLCache(ttl=300, maxsize=50000, shared_version=auth_version)
+
+
+class WebAppUser:
+    """Пользователь запроса: telegram_id, роль и флаги"""
+
+    __slots__ = ("id", "role", "username", "verified")
+
+    def __init__(self, telegram_id: int, role: Optional[str], username: Optional[str] = None, verified: bool = False):
+        self.id = telegram_id
+        self.role = role
+        self.username = username
+        self.verified = verified  # True - личность подтверждена подписью initData
+
+    @property
+    def exists(self) -> bool:
+        return self.role is not None
+
+    @property
+    def is_creator(self) -> bool:
+        return self.role == "creator"
+
+    @property
+    def is_admin(self) -> bool:
+        """Админ или создатель"""
+        return self.role in ("admin", "creator")
+
+
+def validate_init_data(init_data: str, max_age: int = INIT_DATA_MAX_AGE):
+    """
+    Проверяет подпись и срок действия initData
+
+    Returns:
+        dict | None: поля initData (user - уже разобранный dict) или None
+    """
+    try:
+        fields = dict(parse_qsl(init_data, keep_blank_values=True, strict_parsing=True))
+    except ValueError:
+        return None
+    received_hash = fields.pop("hash", None)
+    if not received_hash:
+        return None
+    data_check_string = "\n".join(f"{key}={fields[key]}" for key in sorted(fields))
+    expected_hash = hmac.new(_secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(received_hash, expected_hash):
+        return None
+    try:
+        auth_date = int(fields.get("auth_date", 0))
+        fields["user"] = json.loads(fields.get("user") or "null")
+    except (TypeError, ValueError):
+        return None
+    if max_age and auth_date < time.time() - max_age:
+        return None
+    if not isinstance(fields["user"], dict) or not fields["user"].get("id"):
+        return None
+    fields["hash"] = received_hash
+    return fields
+
+
+async def _load_role(telegram_id: int) -> Optional[str]:
+    from sqlalchemy.future import select
+    from db import read_session
+    from models import User
+    async with read_session() as session:
+        result = await session.execute(select(User.role).where(User.telegram_id == telegram_id))
+        role = result.scalar()
+    if role is None and telegram_id == CREATOR_ID:
+        return "creator"
+    return role
+
+
+async def webapp_user(request: Request) -> Optional[WebAppUser]:
+    """Зависимость: пользователь из подписанного initData (None - заголовка нет)"""
+    init_data = request.headers.get(INIT_DATA_HEADER)
+    if not init_data:
+        return None
+    cache_key = hashlib.sha256(init_data.encode()).digest()
+    user = _verified_cache.get(cache_key)
+    if user is not None:
+        return user
+    fields = validate_init_data(init_data)
+    if fields is None:
+        raise HTTPException(status_code=401, detail="Недействительные данные Telegram WebApp")
+    telegram_id = int(fields["user"]["id"])
+    user = WebAppUser(telegram_id, await _load_role(telegram_id), fields["user"].get("username"), verified=True)
+    if user.exists:
+        # Незарегистрированного пользователя не кэшируем: он может появиться после /start.
+        # Запись живёт не дольше срока действия initData, отсчитанного от auth_date
+        ttl = int(fields["auth_date"]) + INIT_DATA_MAX_AGE - time.time() if INIT_DATA_MAX_AGE else None
+        if ttl is None or ttl > 0:
+            _verified_cache.set(cache_key, user, ttl=ttl)
+    return user
+
+
+async def _claimed_value(request: Request, param: str, body: bool):
+    value = request.query_params.get(param)
+    if value is None and body:
+        # Starlette кэширует тело запроса - обработчик прочитает его повторно
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            value = data.get(param)
+    return value
+
+
+def current_user(param: str = "current_user_id", body: bool = False):
+    """
+    Зависимость: пользователь запроса с ролью (роль из кэша)
+
+    Если initData есть, id из параметра запроса param должен с ним совпадать (иначе 403).
+    Без initData пользователь берётся из параметра param (старые клиенты), а при
+    WEBAPP_AUTH_REQUIRED=1 такой запрос отклоняется (401); None - пользователь не указан.
+
+    Args:
+        param: Параметр запроса, в котором клиент передаёт свой telegram_id
+        body: Искать param также в JSON-теле запроса (если его нет в строке запроса)
+    """
+    async def dependency(request: Request) -> Optional[WebAppUser]:
+        user = await webapp_user(request)
+        value = await _claimed_value(request, param, body)
+        try:
+            claimed_id = int(value) if value else None
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"{param} должен быть числом")
+        if user is not None:
+            if claimed_id is not None and claimed_id != user.id:
+                raise HTTPException(status_code=403, detail="Параметры запроса не совпадают с пользователем Telegram")
+            return user
+        if claimed_id is None:
+            return None
+        if WEBAPP_AUTH_REQUIRED:
+            raise HTTPException(status_code=401, detail="Требуются данные Telegram WebApp")
+        user = _legacy_cache.get(claimed_id)
+        if user is None:
+            # Личность не подтверждена - пользователь взят из параметра запроса
+            # (предупреждение пишется при чтении роли, не чаще раза в 300 с на пользователя)
+            logger.warning(
+                f"⚠️ Запрос {request.url.path} без initData: пользователь {claimed_id} взят из параметра {param} "
+                f"(включите WEBAPP_AUTH_REQUIRED=1, когда все клиенты передают initData)"
+            )
+            user = WebAppUser(claimed_id, await _load_role(claimed_id))
+            if user.exists:
+                _legacy_cache.set(claimed_id, user)
+        return user
+    return dependency